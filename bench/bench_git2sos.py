@@ -0,0 +1,266 @@
+#!/bin/python3
+
+## benchmark harness for git2sos. runs every SOSWrapper command against a
+## synthetic workarea served by fake_soscmd.py, which is put first on PATH.
+## wall time, subprocess count and peak RSS are saved as JSON so that runs
+## can be compared with --compare.
+## peak RSS is taken from wait4() and so includes the harness's own RSS at
+## fork time as a floor; only growth above that floor is meaningful.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+WRAPPER_PATH = os.path.join(REPO_DIR, 'git2sos_cmd_wrapper.py')
+LAUNCHER_PATH = os.path.join(REPO_DIR, 'git2sos')
+FAKE_SOS_PATH = os.path.join(BENCH_DIR, 'fake_soscmd.py')
+
+sys.path.insert(0, BENCH_DIR)
+from fake_soscmd import FakeSOS # noqa: E402
+
+## bench cases as (name, argv). read-only commands are listed first since the
+## later ones change the workarea state.
+def get_bench_cases(fake):
+    file0 = fake.synth_path(0)
+    file1 = fake.synth_path(1)
+    file2 = fake.synth_path(2)
+    return [
+        ('help_script', ['-h']),
+        ('status', ['status']),
+        ('status_scope', ['status', 'ip0']),
+        ('log', ['log']),
+        ('log_range', ['log', '-from-1000']),
+        ('log_file', ['log', file0]),
+        ('log_datetime', ['log', '2024/01/01 10:00:00']),
+        ('bisect', ['bisect', 'start', '2024/01/02 23:30:00', '2024/01/01 09:30:00']),
+        ('bisect_run', ['bisect', 'run', 'true']),
+        ('bisect_reset', ['bisect', 'reset']),
+        ('blame', ['blame', file0]),
+        ('blame_range', ['blame', '-L', '1,5', file0]),
+        ('diff', ['diff']),
+        ('diff_dir', ['diff', '--dir-diff']),
+        ('diff_stat', ['diff', '--stat']),
+        ('diff_text', ['diff', '--text']),
+        ('diff_rev', ['diff', '-r1', '-r2', file0]),
+        ('diff_datetime', ['diff', '2024/01/01 10:00:00']),
+        ('diff_range', ['diff', '--stat', '2024/01/01 10:00:00..2024/01/02 10:00:00']),
+        ('fetch', ['fetch']),
+        ('prefetch', ['prefetch']),
+        ('help', ['help']),
+        ('daemon_status', ['daemon', 'status']),
+        ('stash', ['stash', 'create', 'bench']),
+        ('stash_list', ['stash', 'list']),
+        ('stash_apply', ['stash', 'apply']),
+        ('stash_drop', ['stash', 'drop']),
+        ('add', ['add', file1]),
+        ('add_recursive', ['add', '-r', 'ip3']),
+        ('rm', ['rm', file2]),
+        ('mv', ['mv', file0, 'ip1']),
+        ('discard', ['discard', file2]),
+        ('merge', ['merge']),
+        ('pull_parallel', ['pull', '--parallel', '4']),
+        ('pull', ['pull']),
+        ('checkout', ['checkout', 'dev']),
+        ('push', ['push']),
+        ('cleanup_dry_run', ['cleanup', '--dry-run']),
+        ('cleanup', ['cleanup', '--yes']),
+        ('clone', ['clone', 'srv', 'prj', 'wa_clone']),
+        ('declone', ['declone']),
+    ]
+
+def write_tool(bin_dir, name, body):
+    tool_path = os.path.join(bin_dir, name)
+    with open(tool_path, 'w') as tool_file:
+        tool_file.write('#!/bin/sh\n' + body + '\n')
+    os.chmod(tool_path, 0o755)
+
+def setup_tools(bin_dir, call_log):
+    os.makedirs(bin_dir, exist_ok=True)
+    write_tool(bin_dir, 'soscmd', f'exec "{sys.executable}" "{FAKE_SOS_PATH}" "$@"')
+    # interactive tools are replaced with no-op stand-ins
+    log_call = f'echo "$(basename "$0") 0" >> "{call_log}"'
+    write_tool(bin_dir, 'vi', f'{log_call}\nsed -i "1s/^/bench commit/" "$1"')
+    for tool in ['tkdiff', 'meld', 'less']:
+        write_tool(bin_dir, tool, log_call)
+    # external helpers are counted and then passed to the real tool
+    for tool in ['diff', 'patch']:
+        real_tool = shutil.which(tool)
+        if real_tool:
+            write_tool(bin_dir, tool, f'{log_call}\nexec "{real_tool}" "$@"')
+
+def run_case(argv, wa_root, env, stdin_text):
+    call_log = env['FAKE_SOS_CALL_LOG']
+    open(call_log, 'w').close()
+    start_time = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, WRAPPER_PATH] + argv, cwd=wa_root, env=env, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    proc.stdin.write(stdin_text.encode())
+    proc.stdin.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.perf_counter() - start_time
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    with open(call_log) as log_file:
+        calls = [line.split()[:2] for line in log_file if line.strip()]
+    return {
+        'wall_s': round(wall_time, 4),
+        'subprocs': len(calls),
+        'soscmd_calls': sum(1 for call in calls if call[0] == 'soscmd'),
+        'peak_rss_kb': rusage.ru_maxrss,
+        'returncode': proc.returncode,
+    }
+
+def bench_size(size, args, only_cases):
+    results = []
+    work_dir = tempfile.mkdtemp(prefix=f'git2sos_bench_{size}_')
+    try:
+        wa_root = os.path.join(work_dir, 'wa')
+        bin_dir = os.path.join(work_dir, 'bin')
+        call_log = os.path.join(work_dir, 'calls.log')
+        env = dict(os.environ)
+        env.update({
+            'PATH': bin_dir + os.pathsep + env.get('PATH', ''),
+            'FAKE_SOS_LATENCY': str(args.latency),
+            'FAKE_SOS_BANNER': str(args.banner),
+            'FAKE_SOS_FILE_LINES': str(args.file_lines),
+            'FAKE_SOS_CALL_LOG': call_log,
+            'GIT2SOS_CACHE_DIR': os.path.join(work_dir, 'cache'),
+            'MRVL_PROJECT': 'bench',
+            'USER': env.get('USER', 'bench'),
+        })
+        env.pop('VIMRUNTIME', None)
+        setup_tools(bin_dir, call_log)
+
+        os.environ['FAKE_SOS_FILE_LINES'] = str(args.file_lines)
+        fake = FakeSOS()
+        start_time = time.perf_counter()
+        fake.init_wa([wa_root, str(size)])
+        print(f'# size {size}: workarea created in {time.perf_counter() - start_time:.2f}s', file=sys.stderr)
+
+        for name, argv in get_bench_cases(fake):
+            if only_cases and name not in only_cases:
+                continue
+            result = {'size': size, 'case': name, 'command': argv[0]}
+            result.update(run_case(argv, wa_root, env, 'sa\n'))
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+## startup cases time a 'status' run up to its first soscmd call, through the
+## launcher, through the launcher with the daemon running and with the script
+## run directly. soscmd is a stub which records when it started and fails, so
+## the wrapper stops there.
+def bench_startup(args, only_cases):
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='git2sos_bench_startup_')
+    try:
+        bin_dir = os.path.join(work_dir, 'bin')
+        start_log = os.path.join(work_dir, 'start.log')
+        os.makedirs(bin_dir)
+        tool_path = os.path.join(bin_dir, 'soscmd')
+        with open(tool_path, 'w') as tool_file:
+            tool_file.write(f'#!/bin/bash\necho $EPOCHREALTIME >> "{start_log}"\nexit 1\n')
+        os.chmod(tool_path, 0o755)
+        env = dict(os.environ)
+        env.update({
+            'PATH': bin_dir + os.pathsep + env.get('PATH', ''),
+            'GIT2SOS_CACHE_DIR': os.path.join(work_dir, 'cache'),
+            'USER': env.get('USER', 'bench'),
+        })
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        # one untimed run so that the launcher finds the bytecode cached
+        subprocess.run([sys.executable, LAUNCHER_PATH, 'status'], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for name, script_path in [('startup', LAUNCHER_PATH), ('startup_daemon', LAUNCHER_PATH), ('startup_script', WRAPPER_PATH)]:
+            if only_cases and name not in only_cases:
+                continue
+            if name == 'startup_daemon':
+                subprocess.run([sys.executable, LAUNCHER_PATH, 'daemon', 'start'], cwd=work_dir, env=env, stdout=subprocess.DEVNULL)
+                for _ in range(500):
+                    if os.path.exists(os.path.join(env['GIT2SOS_CACHE_DIR'], 'daemon.sock')):
+                        break
+                    time.sleep(0.01)
+            times, peak_rss = [], 0
+            for _ in range(args.startup_runs):
+                open(start_log, 'w').close()
+                start_time = time.time()
+                proc = subprocess.Popen([sys.executable, script_path, 'status'], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                _, _, rusage = os.wait4(proc.pid, 0)
+                with open(start_log) as log_file:
+                    times.append(float(log_file.readline()) - start_time)
+                peak_rss = max(peak_rss, rusage.ru_maxrss)
+            if name == 'startup_daemon':
+                subprocess.run([sys.executable, LAUNCHER_PATH, 'daemon', 'stop'], cwd=work_dir, env=env, stdout=subprocess.DEVNULL)
+            times.sort()
+            result = {'size': 0, 'case': name, 'command': 'status', 'wall_s': round(times[len(times) // 2], 4), 'min_s': round(times[0], 4),
+                      'subprocs': 1, 'soscmd_calls': 1, 'peak_rss_kb': peak_rss}
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def check_coverage(only_cases):
+    # warn for wrapper commands that no bench case runs
+    sys.path.insert(0, REPO_DIR)
+    import git2sos_cmd_wrapper
+    wrapper_cmds = set(git2sos_cmd_wrapper.SOSWrapper().commands.keys())
+    bench_cmds = {argv[0] for name, argv in get_bench_cases(FakeSOS()) if not only_cases or name in only_cases}
+    for cmd in sorted(wrapper_cmds - bench_cmds):
+        print(f'# warning: no bench case for command \'{cmd}\'', file=sys.stderr)
+
+def compare_results(base_path, new_path):
+    with open(base_path) as base_file:
+        base = {(res['size'], res['case']): res for res in json.load(base_file)['results']}
+    with open(new_path) as new_file:
+        new = {(res['size'], res['case']): res for res in json.load(new_file)['results']}
+    print(f'{"size":>7} {"case":16} {"wall_s":>17} {"ratio":>6} {"subprocs":>13} {"peak_rss_kb":>17}')
+    for key in sorted(set(base) & set(new)):
+        old_res, new_res = base[key], new[key]
+        ratio = new_res['wall_s'] / old_res['wall_s'] if old_res['wall_s'] else 0
+        print(f'{key[0]:>7} {key[1]:16} {old_res["wall_s"]:>8.3f}>{new_res["wall_s"]:<8.3f} {ratio:>6.2f} '
+              f'{old_res["subprocs"]:>6}>{new_res["subprocs"]:<6} {old_res["peak_rss_kb"]:>8}>{new_res["peak_rss_kb"]:<8}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark git2sos commands against a fake soscmd.')
+    parser.add_argument('--sizes', default='10,100,1000,10000,100000', help='comma separated workarea sizes (number of files)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of latency per soscmd call')
+    parser.add_argument('--banner', type=int, default=1, help='banner lines printed by each soscmd call')
+    parser.add_argument('--file-lines', type=int, default=50, help='lines per file revision')
+    parser.add_argument('--cases', default='', help='comma separated bench cases to run (default all)')
+    parser.add_argument('--startup-runs', type=int, default=20, help='runs per startup case, 0 to skip them')
+    parser.add_argument('--output', default='bench_output.json', help='results file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two results files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    only_cases = [case for case in args.cases.split(',') if case]
+    check_coverage(only_cases)
+    results = bench_startup(args, only_cases) if args.startup_runs else []
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        results.extend(bench_size(size, args, only_cases))
+
+    meta = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y/%m/%d %H:%M:%S'),
+        'latency': args.latency,
+        'banner': args.banner,
+        'file_lines': args.file_lines,
+    }
+    with open(args.output, 'w') as out_file:
+        json.dump({'meta': meta, 'results': results}, out_file, indent=2)
+    print(f'Saved results to \'{args.output}\'.', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
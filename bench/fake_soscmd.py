@@ -0,0 +1,449 @@
+#!/bin/python3
+
+## fake soscmd used by the benchmark harness. emulates the subset of SOS
+## commands used by git2sos against a synthetic workarea, with configurable
+## per-call latency and output size.
+##
+## workarea state is kept in '<wa_root>/.fakesos/db' with one line per
+## managed file: '<rev> <latest_rev> <checked_out> <path>'.
+##
+## environment knobs:
+##   FAKE_SOS_LATENCY     : seconds to sleep per call (float, default 0)
+##   FAKE_SOS_BANNER      : number of banner lines printed per call (default 1)
+##   FAKE_SOS_FILE_LINES  : number of lines in each file revision (default 50)
+##   FAKE_SOS_CALL_LOG    : if set, one line per call is appended to this file
+
+import datetime
+import fcntl
+import os
+import shutil
+import sys
+import time
+
+DB_DIR = '.fakesos'
+DB_FILE = 'db'
+CHANGESETS_PER_REV = 20
+T0 = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+class FakeSOS:
+    def __init__(self):
+        self.latency = float(os.environ.get('FAKE_SOS_LATENCY', '0'))
+        self.banner = int(os.environ.get('FAKE_SOS_BANNER', '1'))
+        self.file_lines = int(os.environ.get('FAKE_SOS_FILE_LINES', '50'))
+        self.wa_root = None
+        self.db = {}
+        self.db_order = []
+        self.out = []
+
+    def run(self, argv):
+        start_time = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+        cmd = argv[0] if argv else 'help'
+        args = argv[1:]
+        ret = 0
+        if cmd == 'init':
+            self.init_wa(args)
+        else:
+            for _ in range(self.banner):
+                self.out.append('Invoking SOS fake client.')
+            self.wa_root = self.find_wa_root(os.getcwd())
+            if cmd not in ['newworkarea', 'help'] and not self.wa_root:
+                sys.stderr.write('Error: Not in a workarea.\n')
+                ret = 1
+            else:
+                handler = getattr(self, f'cmd_{cmd}', None)
+                if handler and self.wa_root:
+                    # concurrent calls (e.g. pull --parallel) take turns on the db
+                    with open(os.path.join(self.wa_root, DB_DIR, 'lock'), 'w') as lock_file:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                        self.load_db()
+                        ret = handler(args) or 0
+                elif handler:
+                    ret = handler(args) or 0
+                else:
+                    sys.stderr.write(f'Error: Unknown command: {cmd}\n')
+                    ret = 1
+        sys.stdout.write('\n'.join(self.out) + ('\n' if self.out else ''))
+        sys.stdout.flush()
+        call_log = os.environ.get('FAKE_SOS_CALL_LOG')
+        if call_log:
+            with open(call_log, 'a') as log_file:
+                log_file.write(f'soscmd {cmd} {time.time() - start_time:.6f}\n')
+        return ret
+
+    ## workarea setup
+    def init_wa(self, args):
+        # init <wa_root> <num_files> [<num_checkout> <num_unmanaged> <num_resolve>]
+        wa_root = os.path.abspath(args[0])
+        num_files = int(args[1])
+        num_co = int(args[2]) if len(args) > 2 else max(1, num_files // 20)
+        num_unm = int(args[3]) if len(args) > 3 else max(1, num_files // 10)
+        num_res = int(args[4]) if len(args) > 4 else max(1, num_files // 50)
+        os.makedirs(os.path.join(wa_root, DB_DIR), exist_ok=True)
+        self.wa_root = wa_root
+        for idx in range(num_files):
+            path = self.synth_path(idx)
+            latest = 3 if idx < num_res else 2
+            co = 1 if idx % max(1, num_files // num_co) == 0 and idx // max(1, num_files // num_co) < num_co else 0
+            self.db[path] = [2, latest, co]
+            self.db_order.append(path)
+            abs_path = os.path.join(wa_root, path)
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            text = self.rev_text(path, 2)
+            if co and idx % 3: # leave some checkouts unedited
+                text += f'{path} local edit\n'
+            with open(abs_path, 'w') as out_file:
+                out_file.write(text)
+        for idx in range(num_unm):
+            abs_path = os.path.join(wa_root, 'scratch', f'run{idx % 10}', f'out_{idx}.log')
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            with open(abs_path, 'w') as out_file:
+                out_file.write('log\n' * 4)
+        self.save_db()
+
+    def synth_path(self, idx):
+        return f'ip{idx % 7}/blk{(idx // 7) % 31}/sub{(idx // 217) % 11}/file_{idx}.v'
+
+    def rev_text(self, path, rev):
+        lines = [f'{path} line {idx}\n' for idx in range(self.file_lines)]
+        for rev_idx in range(2, rev + 1):
+            lines[(rev_idx * 7) % self.file_lines] = f'{path} changed in rev {rev_idx}\n'
+        return ''.join(lines)
+
+    def find_wa_root(self, path):
+        path = os.path.abspath(path)
+        while True:
+            if os.path.isdir(os.path.join(path, DB_DIR)):
+                return path
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    def load_db(self):
+        db_path = os.path.join(self.wa_root, DB_DIR, DB_FILE)
+        if not os.path.isfile(db_path):
+            return
+        with open(db_path) as db_file:
+            for line in db_file:
+                rev, latest, co, path = line.rstrip('\n').split(' ', 3)
+                self.db[path] = [int(rev), int(latest), int(co)]
+                self.db_order.append(path)
+
+    def save_db(self):
+        db_path = os.path.join(self.wa_root, DB_DIR, DB_FILE)
+        with open(db_path + '.tmp', 'w') as db_file:
+            db_file.write(''.join(f'{self.db[path][0]} {self.db[path][1]} {self.db[path][2]} {path}\n' for path in self.db_order if path in self.db))
+        os.replace(db_path + '.tmp', db_path)
+
+    ## path helpers
+    def rel(self, path):
+        rel_path = os.path.relpath(os.path.abspath(path), self.wa_root)
+        return '' if rel_path == '.' else rel_path
+
+    def path_args(self, args):
+        return [self.rel(arg) for arg in args if not arg.startswith('-')]
+
+    def in_scope(self, path, scopes, recursive=True):
+        if not scopes:
+            return True
+        for scope in scopes:
+            if not scope or path == scope or (recursive and path.startswith(scope + '/')):
+                return True
+        return False
+
+    def managed_dirs(self):
+        dirs = set()
+        for path in self.db:
+            path = os.path.dirname(path)
+            while path and path not in dirs:
+                dirs.add(path)
+                path = os.path.dirname(path)
+        return dirs
+
+    def unmanaged_paths(self, scopes):
+        # unmanaged dirs are listed before their contents
+        managed_dirs = self.managed_dirs()
+        paths = []
+        for dir_path, dir_names, file_names in os.walk(self.wa_root):
+            rel_dir = self.rel(dir_path)
+            if rel_dir == DB_DIR:
+                dir_names[:] = []
+                continue
+            dir_names.sort()
+            for dir_name in dir_names:
+                rel_path = os.path.join(rel_dir, dir_name)
+                if rel_path != DB_DIR and rel_path not in managed_dirs and self.in_scope(rel_path, scopes):
+                    paths.append(rel_path)
+            for file_name in sorted(file_names):
+                rel_path = os.path.join(rel_dir, file_name)
+                if rel_path not in self.db and self.in_scope(rel_path, scopes):
+                    paths.append(rel_path)
+        return paths
+
+    def split_rev(self, path_arg):
+        if '/#/' in path_arg:
+            path, rev = path_arg.split('/#/', 1)
+            return self.rel(path), rev
+        return self.rel(path_arg), None
+
+    def file_changed(self, path):
+        abs_path = os.path.join(self.wa_root, path)
+        if not os.path.exists(abs_path):
+            return '!'
+        with open(abs_path) as in_file:
+            return '-' if in_file.read() == self.rev_text(path, self.db[path][0]) else 'M'
+
+    ## commands
+    def cmd_findwaroot(self, args):
+        self.out.append(self.wa_root)
+
+    def cmd_query(self, args):
+        if args and args[0] == 'branches':
+            self.out.extend(['main', 'dev'])
+        elif args and args[0] == 'rso':
+            self.out.append('main')
+        elif args and args[0] == 'last_update_time':
+            self.out.append(T0.strftime('%Y/%m/%d %H:%M:%S'))
+
+    def cmd_objstatus(self, args):
+        for path in self.path_args(args):
+            abs_path = os.path.join(self.wa_root, path)
+            if path in self.db:
+                self.out.append(f'{3 if self.db[path][2] else 4} 1')
+            elif not path or path in self.managed_dirs():
+                self.out.append('4 2')
+            elif os.path.isdir(abs_path):
+                self.out.append('2 2')
+            elif os.path.exists(abs_path):
+                self.out.append('2 1')
+            else:
+                self.out.append('1 1')
+
+    def cmd_status(self, args):
+        fmt = '%P'
+        sel = []
+        sel_and = False
+        for arg in args:
+            if arg.startswith('-f'):
+                fmt = arg[2:]
+            elif arg == '-sand':
+                sel_and = True
+            elif arg.startswith('-s'):
+                sel.append(arg[2:])
+        scopes = self.path_args(args)
+        self.out.append('*** Status of objects ***')
+
+        sel_sets = []
+        for sel_item in sel:
+            if sel_item == 'co':
+                sel_sets.append({path for path in self.db_order if self.db[path][2] and self.in_scope(path, scopes)})
+            elif sel_item == 'nt':
+                sel_sets.append({path for path in self.db_order if self.db[path][0] < self.db[path][1] and self.in_scope(path, scopes)})
+            elif sel_item == 'unm':
+                sel_sets.append(set(self.unmanaged_paths(scopes)))
+        if not sel_sets:
+            sel_sets.append({path for path in self.db_order if self.in_scope(path, scopes)})
+        selected = set.intersection(*sel_sets) if sel_and else set.union(*sel_sets)
+
+        for path in sorted(selected):
+            if path in self.db:
+                rev, latest, co = self.db[path]
+                chg = self.file_changed(path) if '%C' in fmt else '-'
+                state = 'C' if co else '-'
+                res = 'R' if rev < latest else '-'
+            else:
+                rev, chg, state, res = ('?',) * 4
+            line = fmt.replace('%C', chg).replace('%S', state).replace('%R', res).replace('%V', str(rev)).replace('%P', path)
+            self.out.append(line)
+
+    def cmd_exportrev(self, args):
+        out_path = None
+        targets = []
+        for arg in args:
+            if arg.startswith('-out'):
+                out_path = arg[4:]
+            elif not arg.startswith('-'):
+                targets.append(arg)
+        for target in targets:
+            path, rev = self.split_rev(target)
+            if path not in self.db:
+                sys.stderr.write(f'Error: {path} is not managed.\n')
+                return 1
+            if rev is None:
+                rev = self.db[path][0]
+            elif not rev.isdigit():
+                rev = self.db[path][1]
+            text = self.rev_text(path, int(rev))
+            if out_path:
+                with open(out_path, 'w') as out_file:
+                    out_file.write(text)
+            else:
+                self.out.append(text.rstrip('\n'))
+
+    def cmd_co(self, args):
+        for path in self.expand(self.path_args(args)):
+            if path in self.db:
+                self.db[path][2] = 1
+                self.out.append(f'Checked out {path}.')
+        self.save_db()
+
+    def cmd_discardco(self, args):
+        for path in self.expand(self.path_args(args)):
+            if path in self.db and self.db[path][2]:
+                self.db[path][2] = 0
+                self.write_rev(path, self.db[path][0])
+                self.out.append(f'Discarded checkout of {path}.')
+        self.save_db()
+
+    def cmd_ci(self, args):
+        for path in self.expand(self.path_args(args)):
+            if path in self.db and self.db[path][2]:
+                self.db[path][1] += 1
+                self.db[path][0] = self.db[path][1]
+                self.db[path][2] = 0
+                self.out.append(f'Checked in {path} revision {self.db[path][0]}.')
+        self.save_db()
+
+    def cmd_create(self, args):
+        for path in self.path_args(args):
+            if path not in self.db and os.path.isfile(os.path.join(self.wa_root, path)):
+                self.db[path] = [1, 1, 0]
+                self.db_order.append(path)
+                self.out.append(f'Created {path}.')
+        self.save_db()
+
+    def cmd_delete(self, args):
+        for path in self.path_args(args):
+            if path in self.db:
+                del self.db[path]
+                abs_path = os.path.join(self.wa_root, path)
+                if os.path.isfile(abs_path):
+                    os.remove(abs_path)
+                self.out.append(f'Deleted {path}.')
+        self.save_db()
+
+    def cmd_move(self, args):
+        paths = self.path_args(args)
+        tgt_dir = paths.pop()
+        for path in paths:
+            self.relocate(path, os.path.join(tgt_dir, os.path.basename(path)))
+        self.save_db()
+
+    def cmd_rename(self, args):
+        paths = self.path_args(args)
+        self.relocate(paths[0], paths[1])
+        self.save_db()
+
+    def relocate(self, src_path, tgt_path):
+        if src_path not in self.db:
+            return
+        self.db[tgt_path] = self.db.pop(src_path)
+        self.db_order.append(tgt_path)
+        abs_src = os.path.join(self.wa_root, src_path)
+        if os.path.exists(abs_src):
+            abs_tgt = os.path.join(self.wa_root, tgt_path)
+            os.makedirs(os.path.dirname(abs_tgt), exist_ok=True)
+            shutil.move(abs_src, abs_tgt)
+        self.out.append(f'Moved {src_path} to {tgt_path}.')
+
+    def cmd_merge(self, args):
+        for path in self.path_args(args):
+            if path in self.db:
+                self.db[path][0] = self.db[path][1]
+                self.out.append(f'Recorded merge of {path}.')
+        self.save_db()
+
+    def cmd_update(self, args):
+        if '-i' in args: # fetch info only
+            self.out.append('Fetched revision info.')
+            return
+        scopes = self.path_args(args)
+        for path in self.db_order:
+            if path not in self.db or not self.in_scope(path, scopes):
+                continue
+            rev, latest, co = self.db[path]
+            if not co and rev < latest:
+                self.db[path][0] = latest
+                self.write_rev(path, latest)
+                self.out.append(f'Updated {path} to revision {latest}.')
+        self.save_db()
+
+    def cmd_usebranch(self, args):
+        self.out.append(f'Using branch {args[0] if args else "main"}.')
+
+    def cmd_newworkarea(self, args):
+        self.out.append('Created workarea.')
+
+    def cmd_deleteworkarea(self, args):
+        self.out.append('Deleted workarea.')
+
+    def cmd_help(self, args):
+        self.out.extend([f'soscmd help line {idx}' for idx in range(40)])
+
+    def cmd_history(self, args):
+        for path in self.path_args(args):
+            if path not in self.db:
+                continue
+            self.out.append(f'History of: {path}')
+            for rev in range(self.db[path][1], 0, -1):
+                change_time = self.change_time(path, rev).strftime('%Y/%m/%d %H:%M:%S')
+                action = 'create' if rev == 1 else 'ci'
+                self.out.append(f'Action: {action} | Revision: {rev} | At time: {change_time} | By: user{rev % 3} | Log: change {self.changeset(path, rev)}')
+
+    def cmd_audit(self, args):
+        from_time, to_time = None, None
+        for arg in args:
+            if arg.startswith('-from'):
+                from_time = self.parse_time(arg[5:])
+            elif arg.startswith('-to'):
+                to_time = self.parse_time(arg[3:])
+        if from_time and to_time and from_time > to_time: # sos swaps the window, see adjust_datetime_war
+            from_time, to_time = to_time, from_time
+        changesets = {}
+        for path in self.db_order:
+            if path not in self.db:
+                continue
+            for rev in range(1, self.db[path][1] + 1):
+                change_time = self.change_time(path, rev)
+                if (from_time and change_time < from_time) or (to_time and change_time > to_time):
+                    continue
+                changesets.setdefault(change_time, []).append((path, rev))
+        for change_time in sorted(changesets.keys(), reverse=True):
+            time_str = change_time.strftime('%Y/%m/%d %H:%M:%S')
+            path, rev = changesets[change_time][0]
+            user = f'user{rev % 3}'
+            self.out.append(f'{time_str} {user} checkin 1 change {self.changeset(path, rev)}')
+            for path, rev in changesets[change_time]:
+                self.out.append(f' {time_str} {user} ci {path} {rev} change {self.changeset(path, rev)}')
+
+    def changeset(self, path, rev):
+        return (rev - 1) * CHANGESETS_PER_REV + sum(path.encode()) % CHANGESETS_PER_REV
+
+    def change_time(self, path, rev):
+        return T0 + datetime.timedelta(hours=self.changeset(path, rev))
+
+    def parse_time(self, arg):
+        if arg.startswith('-') and arg[1:].isdigit():
+            return datetime.datetime.now() - datetime.timedelta(days=int(arg[1:]))
+        for fmt in ['%Y/%m/%d %H:%M:%S', '%Y/%m/%d']:
+            try:
+                return datetime.datetime.strptime(arg, fmt)
+            except ValueError:
+                pass
+        return None
+
+    def expand(self, paths):
+        if not paths:
+            return []
+        return [path for path in self.db_order if path in self.db and self.in_scope(path, paths)]
+
+    def write_rev(self, path, rev):
+        abs_path = os.path.join(self.wa_root, path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, 'w') as out_file:
+            out_file.write(self.rev_text(path, rev))
+
+if __name__ == '__main__':
+    sys.exit(FakeSOS().run(sys.argv[1:]))
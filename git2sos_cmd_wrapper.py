@@ -4,43 +4,331 @@
 ## follow a proxy authoritarian system where most things
 ## are passed on as-it-is but any unknown response is flagged
 
-import datetime
+import array
+import codecs
+import fcntl
 import json
 import os
-import random
-import shutil
-import string
+import re
+import signal
 import subprocess
 import sys
 import time
 
+class LazyModule:
+    # module imported on its first use. only a few commands need these modules,
+    # and asyncio takes longer to import than the rest of the script
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def load(self):
+        if self.module is None:
+            self.module = __import__(self.name)
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+asyncio = LazyModule('asyncio')
+datetime = LazyModule('datetime')
+difflib = LazyModule('difflib')
+gzip = LazyModule('gzip')
+hashlib = LazyModule('hashlib')
+math = LazyModule('math')
+mmap = LazyModule('mmap')
+random = LazyModule('random')
+select = LazyModule('select')
+shutil = LazyModule('shutil')
+socket = LazyModule('socket')
+string = LazyModule('string')
+traceback = LazyModule('traceback')
+
+class SOSCommandError(Exception):
+    pass
+
 class bcolors:
-    GRAY = '\033[90m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    RED = '\033[31m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    # GREEN = '\033[32m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    YELLOW = '\033[33m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    # BLUE = '\033[34m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    # MAGENTA = '\033[35m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    # CYAN = '\033[36m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    # BOLD = '\033[1m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    # UNDERLINE = '\033[4m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
-    ENDC = '\033[0m' if sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ else ''
+    GRAY = RED = YELLOW = ENDC = ''
+
+    @classmethod
+    def set_color(cls, use_color):
+        cls.GRAY = '\033[90m' if use_color else ''
+        cls.RED = '\033[31m' if use_color else ''
+        # cls.GREEN = '\033[32m' if use_color else ''
+        cls.YELLOW = '\033[33m' if use_color else ''
+        # cls.BLUE = '\033[34m' if use_color else ''
+        # cls.MAGENTA = '\033[35m' if use_color else ''
+        # cls.CYAN = '\033[36m' if use_color else ''
+        # cls.BOLD = '\033[1m' if use_color else ''
+        # cls.UNDERLINE = '\033[4m' if use_color else ''
+        cls.ENDC = '\033[0m' if use_color else ''
+
+bcolors.set_color(sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ)
+
+class IgnorePatterns:
+    # gitignore-style rules compiled into regexes. paths are relative to root. entry
+    # patterns match only the path itself, not the paths below it
+    def __init__(self, pattern_lines, root, entry_patterns=()):
+        self.root = root
+        entry_rules = []
+        for pattern in entry_patterns:
+            regex = self.glob_to_regex(pattern.lstrip('/'))
+            entry_rules.append(regex if '/' in pattern else '(?:.*/)?' + regex)
+        self.match_entry = self.compile_regex(entry_rules, '$')
+        rules = []
+        for line in pattern_lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            elif line.startswith('\\'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+            regex = self.glob_to_regex(line)
+            if not anchored and not line.startswith('**'):
+                regex = '(?:.*/)?' + regex
+            rules.append((negated, regex, dir_only))
+
+        self.has_negation = any(rule[0] for rule in rules)
+        # rules are evaluated as runs of same polarity, the last matching run wins
+        self.rule_runs = []
+        for negated, regex, dir_only in rules:
+            if not self.rule_runs or self.rule_runs[-1][0] != negated:
+                self.rule_runs.append((negated, [], []))
+            self.rule_runs[-1][2 if dir_only else 1].append(regex)
+        self.rule_runs = [(negated, self.compile_regex(any_rules, '$'), self.compile_regex(dir_rules, '$')) for negated, any_rules, dir_rules in self.rule_runs]
+
+        # a path is ignored if it or any parent matches, unless negated rules exist
+        any_rules = [regex for negated, regex, dir_only in rules if not negated and not dir_only]
+        dir_rules = [regex for negated, regex, dir_only in rules if not negated and dir_only]
+        self.match_path = None
+        if any_rules or dir_rules:
+            match_parts = []
+            if any_rules:
+                match_parts.append('(?:' + '|'.join(any_rules) + ')(?:/.*)?')
+            if dir_rules:
+                match_parts.append('(?:' + '|'.join(dir_rules) + ')/.*')
+            self.match_path = re.compile('(?:' + '|'.join(match_parts) + ')$', re.DOTALL)
+        self.match_dir = self.compile_regex(dir_rules, '$')
+
+    def glob_to_regex(self, pattern):
+        regex = ''
+        idx = 0
+        while idx < len(pattern):
+            char = pattern[idx]
+            if pattern.startswith('**/', idx) and (idx == 0 or pattern[idx - 1] == '/'):
+                regex += '(?:.*/)?'
+                idx += 3
+                continue
+            if pattern.startswith('**', idx) and idx + 2 == len(pattern) and (idx == 0 or pattern[idx - 1] == '/'):
+                regex += '.*'
+                idx += 2
+                continue
+            if char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[' and ']' in pattern[idx + 2:]:
+                class_end = pattern.index(']', idx + 2)
+                class_text = pattern[idx + 1:class_end]
+                if class_text.startswith('!'):
+                    class_text = '^' + class_text[1:]
+                regex += '[' + class_text.replace('\\', '\\\\') + ']'
+                idx = class_end
+            elif char == '\\' and idx + 1 < len(pattern):
+                idx += 1
+                regex += re.escape(pattern[idx])
+            else:
+                regex += re.escape(char)
+            idx += 1
+        return regex
+
+    def compile_regex(self, regex_list, suffix):
+        if not regex_list:
+            return None
+        return re.compile('(?:' + '|'.join(regex_list) + ')' + suffix, re.DOTALL)
+
+    def is_ignored(self, rel_path, is_dir=None):
+        # is_dir is checked on disk only if needed and not given
+        if self.match_entry and self.match_entry.match(rel_path):
+            return True
+        matched_path = self.match_path and self.match_path.match(rel_path)
+        if not self.has_negation:
+            if matched_path:
+                return True
+            if self.match_dir and self.match_dir.match(rel_path):
+                return is_dir if is_dir is not None else os.path.isdir(os.path.join(self.root, rel_path))
+            return False
+        if not matched_path and not (self.match_dir and self.match_dir.match(rel_path)):
+            return False
+        # files in an ignored directory cannot be re-included
+        parent_end = rel_path.find('/')
+        while parent_end > 0:
+            if self.match_rules(rel_path[:parent_end], True):
+                return True
+            parent_end = rel_path.find('/', parent_end + 1)
+        return self.match_rules(rel_path, is_dir)
+
+    def match_rules(self, rel_path, is_dir):
+        for negated, match_any, match_dir in reversed(self.rule_runs):
+            if match_any and match_any.match(rel_path):
+                return not negated
+            if match_dir and match_dir.match(rel_path):
+                if is_dir is None:
+                    is_dir = os.path.isdir(os.path.join(self.root, rel_path))
+                if is_dir:
+                    return not negated
+        return False
+
+class FileStatusTable:
+    # file status of a workarea, compact for workareas with many files. each file has
+    # a bitflag of its attributes, its name and an id of its interned directory path
+    attr_names = ['checkout', 'create', 'delete', 'deleted', 'move+', 'move-', 'rename+', 'rename-', 'resolve', 'unchanged', 'unmanaged']
+    attr_flags = {attr: 1 << idx for idx, attr in enumerate(attr_names)}
+    __slots__ = ['dir_ids', 'dir_paths', 'file_dirs', 'file_names', 'file_flags']
+
+    def __init__(self):
+        self.dir_ids = {'': 0}
+        self.dir_paths = ['']
+        self.file_dirs = array.array('I')
+        self.file_names = []
+        self.file_flags = array.array('H')
+
+    def add(self, file_path, flags):
+        dir_path, _, file_name = file_path.rpartition('/')
+        dir_id = self.dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self.intern_dir(dir_path)
+        self.file_dirs.append(dir_id)
+        self.file_names.append(sys.intern(file_name))
+        self.file_flags.append(flags)
+
+    def intern_dir(self, dir_path):
+        # parents are interned too, so that every path with entries below it is known as a directory
+        dir_id = len(self.dir_paths)
+        self.dir_ids[dir_path] = dir_id
+        self.dir_paths.append(dir_path)
+        parent_path = dir_path.rpartition('/')[0]
+        if parent_path not in self.dir_ids:
+            self.intern_dir(parent_path)
+        return dir_id
+
+    def get_path(self, idx):
+        dir_id = self.file_dirs[idx]
+        return f'{self.dir_paths[dir_id]}/{self.file_names[idx]}' if dir_id else self.file_names[idx]
+
+    def sorted_indexes(self):
+        return sorted(range(len(self.file_names)), key=self.get_path)
+
+    def get_attrs(self, flags):
+        return [attr for attr in self.attr_names if flags & self.attr_flags[attr]]
+
+class PathTrie:
+    # prefix tree of workarea relative paths, to get or remove the records under a
+    # directory in time proportional to the result
+    __slots__ = ['children', 'records']
+
+    def __init__(self):
+        self.children = {}
+        self.records = []
+
+    def split_path(self, path):
+        return [name for name in path.split('/') if name and name != '.']
+
+    def insert(self, path, record):
+        node = self
+        for name in self.split_path(path):
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = PathTrie()
+            node = child
+        node.records.append(record)
+
+    def find(self, names):
+        node = self
+        for name in names:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def items(self, path=''):
+        # (path, record) items at and below path
+        names = self.split_path(path)
+        node = self.find(names)
+        return node.walk('/'.join(names)) if node else []
+
+    def walk(self, node_path):
+        node_stack = [(node_path, self)]
+        while node_stack:
+            node_path, node = node_stack.pop()
+            for record in node.records:
+                yield node_path, record
+            for name, child in node.children.items():
+                node_stack.append((f'{node_path}/{name}' if node_path else name, child))
+
+    def remove(self, path):
+        # removes the records at and below path, and returns them as (path, record) items
+        names = self.split_path(path)
+        if not names:
+            removed_items = list(self.walk(''))
+            self.children, self.records = {}, []
+            return removed_items
+        parent = self.find(names[:-1])
+        if parent is None or names[-1] not in parent.children:
+            return []
+        return list(parent.children.pop(names[-1]).walk('/'.join(names)))
 
 class SOSWrapper:
     def __init__(self):
         self.cache_path = ''
+        self.wa_root = ''
         self.wa_data_file = 'wa_data.json'
+        self.wa_list_file = 'workareas.json'
+        self.co_index_file = 'co_index.json'
+        self.multi_wa_commands = ['fetch', 'pull', 'status']
         self.diff_tool = os.environ['GIT_DIFF_TOOL'] if 'GIT_DIFF_TOOL' in os.environ else 'tkdiff'
         self.merge_tool = os.environ['GIT_MERGE_TOOL'] if 'GIT_MERGE_TOOL' in os.environ else 'meld'
-        self.ign_file_suffix = ['/.gutctags', '/out', '.swp']
+        self.stash_patch_args = ['--merge=diff3', '--no-backup-if-mismatch', '-uNt']
+        self.ign_file_name = '.git2sosignore'
+        self.ign_default_patterns = ['/' + self.ign_file_name, '.gutctags', 'out', '*.swp']
+        self.ign_patterns = None
+        self.trace_record_path = os.environ['GIT2SOS_RECORD'] if 'GIT2SOS_RECORD' in os.environ else ''
+        self.trace_replay_path = os.environ['GIT2SOS_REPLAY'] if 'GIT2SOS_REPLAY' in os.environ else ''
+        self.trace_replay_timing = os.environ['GIT2SOS_REPLAY_TIMING'] if 'GIT2SOS_REPLAY_TIMING' in os.environ else 'none'
+        self.trace_replay_strict = 'GIT2SOS_REPLAY_STRICT' in os.environ
+        self.trace_replay_data = None
+        self.trace_call_idx = 0
+        self.max_jobs = int(os.environ['GIT2SOS_JOBS']) if 'GIT2SOS_JOBS' in os.environ else 8
+        self.push_retries = int(os.environ['GIT2SOS_PUSH_RETRIES']) if 'GIT2SOS_PUSH_RETRIES' in os.environ else 0
+        self.event_loop = None
+        self.job_semaphore = None
+        self.rev_cache_dir = 'revs'
+        self.rev_cache_info = None
+        self.prefetch_jobs = int(os.environ['GIT2SOS_PREFETCH_JOBS']) if 'GIT2SOS_PREFETCH_JOBS' in os.environ else 2
+        self.prefetch_rate = int(os.environ['GIT2SOS_PREFETCH_KBPS']) if 'GIT2SOS_PREFETCH_KBPS' in os.environ else 0
+        self.daemon_file = 'daemon.json'
+        self.daemon_sock_file = 'daemon.sock'
+        self.daemon_idle_time = int(os.environ['GIT2SOS_DAEMON_IDLE']) if 'GIT2SOS_DAEMON_IDLE' in os.environ else 1800
+        self.log_window_days = int(os.environ['GIT2SOS_LOG_WINDOW']) if 'GIT2SOS_LOG_WINDOW' in os.environ else 30
+        self.log_jobs = int(os.environ['GIT2SOS_LOG_JOBS']) if 'GIT2SOS_LOG_JOBS' in os.environ else 4
 
         self.commands = {
             '-h': self.help_myscript,
             'add': self.add_sos,            # extend sos command
-            #'blame': self.blame_sos,       # not a sos command
+            'bisect': self.bisect_sos,      # not a sos command
+            'blame': self.blame_sos,        # not a sos command
             'checkout': self.checkout_sos,  # aggregate SOS commands
             'cleanup': self.cleanup_sos,    # not a git command
             'clone': self.clone_sos,
+            'daemon': self.daemon_sos,      # not a git command
             'declone': self.declone_sos,    # not a git command
             'diff': self.diff_sos,          # aggregate SOS commands
             'discard': self.discard_sos,    # not a git command, extend SOS command
@@ -49,6 +337,7 @@ class SOSWrapper:
             'log': self.log_sos,            # aggregate SOS commands
             'merge': self.merge_sos,
             'mv': self.mv_sos,
+            'prefetch': self.prefetch_sos,  # not a git command
             'pull': self.pull_sos,
             'push': self.push_sos,          # aggregate sos commands
             'rm': self.rm_sos,
@@ -71,6 +360,7 @@ does not provide any other 'revision-id' with easy usage.
 
 List of possible usages:
   script.py add [<extra args ...>] <filename> <filename>
+  script.py add -r [<extra args ...>] <dir> <dir>
       Checkout a file from server for editing. In Git 'add' is done after
       editing a file. Here we must 'checkout' before editing a file. Any
       additional args given are passed to the checkout command of SOS.
@@ -82,16 +372,57 @@ List of possible usages:
       If more control is needed then separate script call for create and edit
       can be done.
 
+      With -r, all files in the given directories are added. Ignored paths
+      are skipped. Unmanaged files are listed for create and all other files
+      are checked out in bulk.
+
+      The content hash of each checked out file is saved, so that stash, diff
+      and merge can skip the files which are not modified after checkout.
+
+  script.py bisect start [<bad time> [<good time>]]
+  script.py bisect good|bad|skip [<time>]
+  script.py bisect run <command> [<args>]
+  script.py bisect log|reset
+      Finds the first check-in time at which the workarea turned bad, by a
+      binary search over the check-in times between a good and a bad time.
+      Times are entered as '<YYYY/MM/DD> <HH:MM:SS>'. Without a time, good,
+      bad and skip mark the workarea state being tested, and bad marks the
+      current time before the first step.
+      Each step sets the workarea to the next time to test. Only the files
+      which differ from the last step are written, from the revision cache
+      or exported in parallel. Checked out files are left as they are.
+      With run, the command is run at each step until the first bad
+      check-in is found. Exit code 0 marks good, 125 skips the step, and
+      other codes below 128 mark bad.
+      log shows the steps taken so far. reset restores the files to their
+      workarea revisions and ends the bisect.
+
+  script.py blame [-L <start>,<end>] <filename>
+      Shows the revision, author and time which last changed each line of
+      the file, for the revision in the workarea. Lines changed in a
+      checked-out file are shown as local.
+      With -L, only the given range of lines is shown, and revisions are
+      looked up only until all lines of the range are found.
+
+      Revisions are taken from the revision cache or exported in parallel.
+      The result is cached, so after a new check-in only the new revision is
+      needed.
+
   script.py checkout '<YYYY/MM/DD> <HH:MM:SS>'
   script.py checkout <branch>
   script.py checkout <label/tag> <label/tag>
       Change the RSO to new branch/tag/label.
       If time is provided as input, update workarea to given time.
 
-  script.py cleanup
+  script.py cleanup [--yes] [--dry-run]
       Clean up the workarea. Removes all unmanaged files and updates workspace
       with consistency checks enabled.
 
+      Untracked directories are removed as a whole, in parallel for each
+      top-level directory. With --yes the 5 second wait before removal is
+      skipped. With --dry-run only the count of files and bytes which would
+      be freed is reported.
+
       This is similar to Git hard reset and clean.
 
   script.py clone <workarea_path>
@@ -100,22 +431,46 @@ List of possible usages:
       If only the path is provided, then project/server names are taken
       from the environment.
 
+  script.py daemon [start|stop|status]
+      Starts, stops or shows the per-user daemon. While it runs, commands
+      given to the git2sos launcher are run by the daemon, which keeps the
+      script loaded and remembers the workarea roots. Commands start faster
+      and skip the SOS call to find the workarea root. The output goes
+      directly to the terminal of the launcher. Without a daemon, commands
+      run in-process as usual. push always runs in-process, since it opens
+      the editor.
+
+      The daemon exits after GIT2SOS_DAEMON_IDLE seconds without commands
+      (default 1800), and restarts itself when the script is changed.
+
   script.py declone [<extra args ...>]
       Deletes a workarea from SOS server's records. A SOS workarea should not
       be deleted without this step.
       After running this command the workspace directory should be manually
       removed.
 
-  script.py diff
-  script.py diff '<YYYY/MM/DD> <HH:MM:SS>'
-  script.py diff -r<rev> -r<rev> <filename>
-  script.py diff <filename> <filename>
+  script.py diff [--dir-diff|--stat|--name-only|--text]
+  script.py diff [--dir-diff|--stat|--name-only|--text] '<YYYY/MM/DD> <HH:MM:SS>'
+  script.py diff [--dir-diff|--stat|--name-only|--text] '<from time>..<to time>'
+  script.py diff [--dir-diff|--stat|--name-only|--text] -r<rev> -r<rev> <filename>
+  script.py diff [--dir-diff|--stat|--name-only|--text] <filename> <filename>
       Shows diff of current changes.
       If no argument is passed, shows diff of all files checked-out.
       If time is provided as input, then shows diff for the change(s) at given time.
+      If a range of times is provided, then shows the net change of each file
+      over all check-ins in the range, from the revision before the first to
+      the last one. A date without time includes the whole day.
       If a filename and two revisions are provided with -r argument, then the diff
       between the given versions of the file is shown.
       If some file names are passed, then shows diff for those files.
+      With --dir-diff, the old and new files are put in two temporary trees
+      and the diff tool is started once to compare the directories, instead of
+      once per file. Workarea files are hard-linked into the tree. The tool
+      needs a directory compare, e.g. GIT_DIFF_TOOL=meld.
+      With --stat, --name-only or --text, no diff tool is used. The changed
+      lines per file, the changed file names or a unified diff are shown
+      through less. Files are exported and compared in parallel, and the
+      output is shown in order as they are done.
 
       This is similar to Git diff/difftool.
 
@@ -124,8 +479,9 @@ List of possible usages:
       Any extra args are passed to the discardco SOS command.
       Works similar to the Git reset HEAD.
 
-  script.py fetch [<extra args ...>]
+  script.py fetch [--prefetch] [<extra args ...>]
       Retrieves new file info from server but does not update.
+      With --prefetch, the revision prefetch is started in background.
 
   script.py help
   script.py help [<extra args ...>]
@@ -146,8 +502,12 @@ List of possible usages:
       e.g. -from-7 shows log from last 7 days.
       e.g. -userprojeng shows log only from user 'projeng'.
 
+      A project log longer than GIT2SOS_LOG_WINDOW days (default 30) is
+      queried in windows of that size, GIT2SOS_LOG_JOBS at a time (default
+      4). The log is shown as soon as the newest windows are done.
+
   script.py merge
-  script.py merge <filename> <filename>
+  script.py merge [--no-gui] <filename> <filename>
       Merge checked-out files with latest revision, and record the merge so
       that these files can be checked-in to SOS.
 
@@ -155,6 +515,12 @@ List of possible usages:
       exists, will be tried for merge with latest revision of RSO.
       If some filenames are given, then only those will be merged.
 
+      Files which merge without conflicts are merged by the script and the
+      merge is recorded without opening the GUI. The merge tool is opened only
+      for files with conflicts.
+      With --no-gui, conflict markers are written to the files instead and
+      the merge is not recorded for them.
+
 
   script.py mv <filename> <filename> <target>
   script.py mv <filename> <new_filename>
@@ -167,16 +533,49 @@ List of possible usages:
       No file validity checks are done and it is assumed that the SOS command
       will error out if invalid paths are provided.
 
-  script.py pull [<extra args ...>]
+  script.py pull [--prefetch] [<extra args ...>]
+  script.py pull --parallel <count> [--prefetch]
       Updates the workspace with changes from server.
-
-  script.py push
+      With --prefetch, the revision prefetch is started in background.
+
+      With --parallel, new revision info is fetched first and only the
+      subtrees with new revisions are updated, with the given count of
+      updates running in parallel. Progress and the time taken for each
+      subtree are shown. Extra update args are not valid with --parallel,
+      since the new revisions are found for the workarea configuration.
+
+  script.py prefetch [--background] [--interval <seconds>]
+      Exports the base revisions of checked-out files, and the RSO revisions
+      of those with newer versions, to the local revision cache. Later diff
+      and merge commands use the cached files instead of exporting them.
+      Revisions by label such as the RSO are cached until the next fetch.
+
+      The prefetch runs with low priority and GIT2SOS_PREFETCH_JOBS exports
+      in parallel (default 2). GIT2SOS_PREFETCH_KBPS limits the export rate.
+      With --background, it runs detached and logs to the cache directory.
+      With --interval, it keeps running and fetches new revision info at the
+      given interval.
+
+  script.py push [--background]
+  script.py push --status
+  script.py push --resume [--background]
+  script.py push --abort
       Submits the changes in current workspace to the server.
       The list of changed files is shown to the user for review and getting
       the change description. The changes are then sent to server in the order
       of check-in, delete, move and then create.
       The script's internal cache state is also updated.
 
+      The SOS commands for the push are saved to a journal in the cache
+      directory and the cache state is updated as each of them is done. If a
+      push fails or is interrupted, it can be continued from the failed
+      command with --resume, or dropped with --abort.
+      With --background, the commands are run by a detached process after
+      the description is entered, and each failed command is retried a few
+      times. --status shows the progress of the last push.
+      Set GIT2SOS_PUSH_RETRIES to the number of times a failed command is
+      retried in one run. Default is 0, and 2 for background pushes.
+
   script.py rm <filename> <filename>
       Saves the state of the given files for delete. Later when the push
       command is executed then the deletion in SOS server is actually
@@ -197,12 +596,18 @@ List of possible usages:
       Passing no argument acts as stash create.
       Arguments passed while creating stash are used as stash description.
       The current status of files is used to create the stash.
+      Files listed for create are stored as they are, binary files too, with
+      their sha1, which is checked when the stash is applied.
 
       For preview, the given stash_id is previewed without changing any local
       files.
 
       For apply, the given stash_id is applied to the current workspace. If
       no stash_id is given, then the latest stash is used.
+      The changes of all checked out files are first tried in parallel, and
+      the clean, conflicting and missing files are listed. The clean files
+      are checked out and patched together, then the conflicts are resolved
+      one by one.
 
       For drop, the given stash_id are deleted. If no argument is given, then
       the latest stash is dropped.
@@ -218,11 +623,54 @@ List of possible usages:
       create/delete/move are listed. Any args are passed to the SOS command to
       list files.
 
+Multiple workareas:
+  script.py --all-workareas <command> [<extra args ...>]
+  script.py -C <workarea> -C <workarea> <command> [<extra args ...>]
+      Runs the fetch, pull or status command in many workareas in parallel.
+      The output of each workarea is printed as one block once it is done,
+      followed by a summary of the results.
+
+      With --all-workareas, the command is run in all workareas which were
+      cloned or changed with this script, and in the workareas in the
+      GIT2SOS_WA_ROOT directory.
+
+Ignored files:
+  The paths listed in '.git2sosignore' at the workarea root are ignored by
+  the status and cleanup commands. The file uses the .gitignore syntax, such
+  as '*.log', 'simv.daidir/', '/build/' and '!keep.log'. The paths
+  '.git2sosignore', '.gutctags', 'out' and '*.swp' are always ignored, but
+  not the paths below an 'out' directory that is managed by SOS. Like in
+  git, the rules apply only to unmanaged files, never to managed ones.
+
+Environment variables:
+  GIT2SOS_RECORD=<trace_file>
+      Records every command run by the script, with its args, output, return
+      code and latency, to the trace file. Files exported with -out are saved
+      too. The trace is gzip compressed if the file name ends with '.gz'.
+
+  GIT2SOS_REPLAY=<trace_file>
+      Answers SOS calls from a recorded trace instead of the server. Other
+      commands such as diff and patch are still run. Calls are matched by
+      their args, with temp file names ignored.
+      GIT2SOS_REPLAY_TIMING=original sleeps for the recorded latency of each
+      call. By default there is no delay.
+      GIT2SOS_REPLAY_STRICT=1 fails if the order of SOS calls differs from
+      the recorded order.
+
+  GIT2SOS_JOBS=<count>
+      Number of commands, such as revision exports, which are run in
+      parallel. Default is 8. Ctrl-C stops all running commands.
+
+  GIT2SOS_DAEMON=1
+      Starts the daemon in background when a command is run without it, so
+      that later commands are run by the daemon. See the daemon command.
+
 Bye.''')
 
     def add_sos(self, args):
         self.check_args_count(args, min=1)
         self.setup_user_cache()
+        wa_data_lock = self.lock_wa_data()
         wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
         wa_data = {}
 
@@ -233,15 +681,24 @@ Bye.''')
         self.init_json_hier(wa_data, list, ['file_status', 'create'])
 
         new_args = []
+        if '-r' in args:
+            new_args = self.add_recursive([arg for arg in args if arg != '-r'], wa_root, wa_data)
+            args = []
+
+        # status of all files is queried in parallel
+        file_args = [arg for arg in args if not arg.startswith('-')]
+        obj_status_list = self.run_parallel([self.execute_sos_command_async(['soscmd', 'objstatus'], [arg], ret_text=True, quiet=True) for arg in file_args])
+        obj_status_map = dict(zip(file_args, obj_status_list))
         for arg in args:
             if arg.startswith('-'):
                 new_args.append(arg)
                 continue
 
-            obj_status = self.execute_sos_command(['soscmd', 'objstatus'], [arg], ret_text=True, quiet=True)
+            obj_status = obj_status_map[arg]
             obj_status = obj_status[0].split() if len(obj_status) == 1 else []
             if len(obj_status) != 2: # cmd returns file status and type
                 print(f'Skipping \'{arg}\' for add because stat returned unexpected status.')
+                continue
 
             if obj_status[0] in ['2']: # unmanaged file
                 rel_path = os.path.relpath(arg, wa_root)
@@ -259,11 +716,525 @@ Bye.''')
                 print(f'Skipping \'{arg}\' for add as the file is not valid.')
 
         # save file status data
-        with open(wa_data_file_path, 'w') as cache_file:
-            json.dump(wa_data, cache_file, indent=2)
+        self.save_wa_data(wa_data_file_path, wa_data, wa_root)
+        wa_data_lock.close()
+
+        co_args = [arg for arg in new_args if arg.startswith('-')]
+        co_paths = [arg for arg in new_args if not arg.startswith('-')]
+        for co_paths_chunk in self.chunk_paths(co_paths):
+            self.execute_sos_command(['soscmd', 'co'], ['-C'] + co_args + co_paths_chunk)
+        if co_paths:
+            self.record_base_hashes(wa_root, co_paths)
+
+    def record_base_hashes(self, wa_root, co_paths):
+        # right after checkout the files have the content of their base revision
+        co_filelist = []
+        for status_list in self.run_parallel([self.execute_sos_command_async(['soscmd', 'status'], ['-f%V %P', '-sco'] + co_paths_chunk, ret_text=True, quiet=True) for co_paths_chunk in self.chunk_paths(co_paths)]):
+            co_filelist.extend(self.parse_rev_status(status_list))
+        hash_list = self.run_async(self.hash_files_async([os.path.join(wa_root, file_path) for _, file_path in co_filelist]))
+
+        co_index = self.load_co_index()
+        wa_index = {file_path: entry for file_path, entry in co_index.get(wa_root, {}).items() if os.path.isfile(os.path.join(wa_root, file_path))}
+        for (file_rev, file_path), hash_data in zip(co_filelist, hash_list):
+            if hash_data:
+                wa_index[file_path] = [file_rev, hash_data[0], hash_data[1]]
+        co_index[wa_root] = wa_index
+        co_index_file_path = os.path.join(self.cache_path, self.co_index_file)
+        tmp_filepath = f'{co_index_file_path}.{os.getpid()}'
+        with open(tmp_filepath, 'w') as cache_file:
+            json.dump(co_index, cache_file)
+        os.replace(tmp_filepath, co_index_file_path)
+
+    def load_co_index(self):
+        # maps workarea root and file path to [<base rev>, <size>, <sha1>] saved at checkout
+        self.setup_user_cache()
+        co_index_file_path = os.path.join(self.cache_path, self.co_index_file)
+        if os.path.isfile(co_index_file_path) and os.path.getsize(co_index_file_path):
+            with open(co_index_file_path, 'r') as cache_file:
+                return json.load(cache_file)
+        return {}
+
+    def parse_rev_status(self, status_list):
+        # '-f%V %P' status lines as (<rev>, <wa relative path>) items, as the co index keys them
+        rev_filelist = []
+        for file_data in status_list:
+            file_data = file_data.split(None, 1)
+            if len(file_data) == 2 and file_data[0].isdigit():
+                rev_filelist.append((file_data[0], self.remove_prefix(file_data[1].strip(), './')))
+        return rev_filelist
+
+    def get_unmodified_files(self, wa_root, co_filelist):
+        # co_filelist has (<rev>, <wa relative path>) items. returns the paths whose content
+        # still matches the hash of the same base revision saved at checkout
+        wa_index = self.load_co_index().get(wa_root, {})
+        check_list = []
+        for file_rev, file_path in co_filelist:
+            entry = wa_index.get(file_path)
+            if not entry or entry[0] != file_rev:
+                continue
+            try:
+                if os.stat(os.path.join(wa_root, file_path)).st_size != entry[1]:
+                    continue
+            except OSError:
+                continue
+            check_list.append((file_path, entry[2]))
+        hash_list = self.run_async(self.hash_files_async([os.path.join(wa_root, file_path) for file_path, _ in check_list]))
+        return {file_path for (file_path, file_hash), hash_data in zip(check_list, hash_list) if hash_data and hash_data[1] == file_hash}
 
-        if new_args:
-            self.execute_sos_command(['soscmd', 'co'], ['-C'] + new_args)
+    async def hash_files_async(self, file_paths):
+        return await self.gather_tasks([self.run_blocking(self.hash_file, file_path) for file_path in file_paths])
+
+    def hash_file(self, file_path):
+        # returns size and sha1 of the file, or None if it cannot be read
+        try:
+            with open(file_path, 'rb') as in_file:
+                file_size = os.fstat(in_file.fileno()).st_size
+                if not file_size:
+                    return file_size, hashlib.sha1().hexdigest()
+                with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+                    return file_size, hashlib.sha1(file_map).hexdigest()
+        except (OSError, ValueError):
+            return None
+
+    def add_recursive(self, args, wa_root, wa_data):
+        # classify all files in the given dirs with a single walk and a single status call
+        dir_args = [arg for arg in args if not arg.startswith('-')]
+        new_args = [arg for arg in args if arg.startswith('-')]
+        if not dir_args:
+            print(f'{bcolors.RED}Error: At least 1 directory needed for add -r.{bcolors.ENDC}')
+            exit(1)
+        ign_patterns = self.get_ignore_patterns(wa_root)
+        unm_paths, co_paths = set(), set()
+        cur_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%S %P', '-sunm', '-sco'] + dir_args, ret_text=True, quiet=True)
+        for file_info in cur_filelist:
+            if file_info.startswith('*'):
+                continue
+            file_info = file_info.split(None, 1)
+            if len(file_info) != 2:
+                continue
+            file_path = self.remove_prefix(file_info[1], './')
+            if file_info[0] == '?':
+                unm_paths.add(file_path)
+            else:
+                co_paths.add(file_path)
+
+        # the ignore rules only prune unmanaged paths, files in untracked directories are untracked
+        walk_files = []
+        for dir_arg in dir_args:
+            dir_relpath = os.path.relpath(dir_arg, wa_root)
+            dir_relpath = '' if dir_relpath == '.' else dir_relpath
+            dir_unmanaged = self.is_below_paths(dir_relpath, unm_paths) or dir_relpath in unm_paths
+            if not os.path.isdir(dir_arg):
+                walk_files.append((dir_relpath, dir_unmanaged))
+                continue
+            dir_stack = [(os.path.join(wa_root, dir_relpath), dir_relpath, dir_unmanaged)]
+            while dir_stack:
+                dir_path, rel_dir, dir_unmanaged = dir_stack.pop()
+                with os.scandir(dir_path) as dir_entries:
+                    for entry in dir_entries:
+                        entry_relpath = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                        entry_is_dir = entry.is_dir(follow_symlinks=False)
+                        entry_unmanaged = dir_unmanaged or entry_relpath in unm_paths
+                        if entry_unmanaged and ign_patterns.is_ignored(entry_relpath, entry_is_dir):
+                            continue
+                        if entry_is_dir:
+                            dir_stack.append((entry.path, entry_relpath, entry_unmanaged))
+                        else:
+                            walk_files.append((entry_relpath, entry_unmanaged))
+
+        create_set = set(wa_data['file_status']['create'])
+        create_count, co_count, skip_count = (0,) * 3
+        for file_path, is_unmanaged in walk_files:
+            if is_unmanaged:
+                if file_path not in create_set:
+                    create_set.add(file_path)
+                    wa_data['file_status']['create'].append(file_path)
+                    create_count += 1
+                else:
+                    skip_count += 1
+            elif file_path in co_paths:
+                skip_count += 1
+            else:
+                new_args.append(os.path.relpath(os.path.join(wa_root, file_path), os.getcwd()))
+                co_count += 1
+        print(f'Adding {create_count} files for create and {co_count} files for checkout. Skipping {skip_count} files already listed or checked out.')
+        return new_args
+
+    def bisect_sos(self, args):
+        self.check_args_count(args, min=1)
+        self.setup_user_cache()
+        wa_root = self.get_wa_root_path()
+        state_path = os.path.join(self.cache_path, f'bisect_{hashlib.sha1(wa_root.encode()).hexdigest()[:16]}.json')
+        state = None
+        if os.path.isfile(state_path):
+            with open(state_path, 'r') as state_file:
+                state = json.load(state_file)
+        sub_cmd = args.pop(0)
+        if sub_cmd == 'start':
+            self.check_args_count(args, max=2)
+            if state:
+                print(f'{bcolors.RED}Error: A bisect is already in progress. Use bisect reset to end it.{bcolors.ENDC}')
+                exit(1)
+            state = {'wa_root': wa_root, 'good': None, 'bad': None, 'skipped': [], 'log': ['start']}
+            for mark, arg in zip(['bad', 'good'], args):
+                self.bisect_mark(state, mark, self.get_bisect_time(arg))
+            self.bisect_next(wa_root, state_path, state)
+            return
+        if not state:
+            print(f'{bcolors.RED}Error: No bisect in progress. Use bisect start.{bcolors.ENDC}')
+            exit(1)
+        if sub_cmd in ['good', 'bad', 'skip']:
+            self.check_args_count(args, max=1)
+            if args:
+                mark_time = self.get_bisect_time(args[0])
+            elif state.get('current'):
+                mark_time = state['current']
+            elif sub_cmd != 'skip' and 'file_revs' not in state:
+                # before the first step the workarea is taken as up to date
+                mark_time = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+            else:
+                print(f'{bcolors.RED}Error: No workarea state is being tested. Enter the time to mark.{bcolors.ENDC}')
+                exit(1)
+            self.bisect_mark(state, sub_cmd, mark_time)
+            self.bisect_next(wa_root, state_path, state)
+        elif sub_cmd == 'run':
+            self.check_args_count(args, min=1)
+            if not state.get('current'):
+                self.bisect_next(wa_root, state_path, state)
+            while state.get('current'):
+                print(f'Running \'{" ".join(args)}\' at \'{state["current"]}\'.')
+                ret_code = subprocess.call(args)
+                state['log'].append(f'# run exited with {ret_code}')
+                # as in git, 125 is for a state which can not be tested
+                if ret_code < 0 or ret_code >= 128:
+                    self.save_bisect_state(state_path, state)
+                    print(f'{bcolors.RED}Error: \'{" ".join(args)}\' exited with {ret_code}. Stopped the bisect run.{bcolors.ENDC}')
+                    exit(1)
+                self.bisect_mark(state, 'good' if ret_code == 0 else 'skip' if ret_code == 125 else 'bad', state['current'])
+                self.bisect_next(wa_root, state_path, state)
+        elif sub_cmd == 'log':
+            self.check_args_count(args, max=0)
+            print('\n'.join(state['log']))
+        elif sub_cmd == 'reset':
+            self.check_args_count(args, max=0)
+            if 'file_revs' in state:
+                changed_count = self.bisect_update(wa_root, state_path, state, state['base_revs'])
+                print(f'Restored {changed_count} files to their workarea revisions.')
+            os.remove(state_path)
+        else:
+            print(f'{bcolors.RED}Error: Invalid bisect command \'{sub_cmd}\'. Run with -h for script help.{bcolors.ENDC}')
+            exit(1)
+
+    def get_bisect_time(self, arg):
+        datetime_object = self.get_datetime_from_str(arg)
+        if not datetime_object:
+            print(f'{bcolors.RED}Error: Invalid time \'{arg}\'. Enter as: \'<YYYY/MM/DD> <HH:MM:SS>\'{bcolors.ENDC}')
+            exit(1)
+        return datetime_object.strftime('%Y/%m/%d %H:%M:%S')
+
+    def bisect_mark(self, state, mark, mark_time):
+        # times are kept as '<YYYY/MM/DD> <HH:MM:SS>' strings, which sort in time order
+        if mark == 'skip':
+            state['skipped'].append(mark_time)
+        else:
+            if mark == 'good' and state['bad'] and mark_time >= state['bad'] or mark == 'bad' and state['good'] and mark_time <= state['good']:
+                print(f'{bcolors.RED}Error: The good time must be before the bad time.{bcolors.ENDC}')
+                exit(1)
+            if mark == 'good' and 'file_revs' in state and mark_time < state['from']:
+                print(f'{bcolors.RED}Error: Changes before \'{state["from"]}\' are not loaded. Start a new bisect for an earlier good time.{bcolors.ENDC}')
+                exit(1)
+            state[mark] = mark_time
+        state['log'].append(f'{mark} {mark_time}')
+
+    def bisect_next(self, wa_root, state_path, state):
+        # moves the workarea to the middle of the check-in times left to test, or reports the first bad one
+        if not state['good'] or not state['bad']:
+            self.save_bisect_state(state_path, state)
+            print(f'Waiting for the {"good" if not state["good"] else "bad"} time.')
+            return
+        if 'file_revs' not in state:
+            self.bisect_load(wa_root, state)
+        times = sorted({change_time for changes in state['file_changes'].values() for change_time, _ in changes if state['good'] < change_time <= state['bad']})
+        if not times:
+            self.save_bisect_state(state_path, state)
+            print(f'{bcolors.RED}Error: No check-ins between \'{state["good"]}\' and \'{state["bad"]}\'.{bcolors.ENDC}')
+            exit(1)
+        # the workarea at the bad time has the last check-in before it
+        untested = [change_time for change_time in times[:-1] if change_time not in state['skipped']]
+        if not untested:
+            state.pop('current', None)
+            suspects = [change_time for change_time in times[:-1] if change_time in state['skipped']] + times[-1:]
+            state['log'].append(f'# first bad {" or ".join(suspects)}')
+            self.save_bisect_state(state_path, state)
+            if len(suspects) > 1:
+                print(f'Skipped check-ins leave {len(suspects)} candidates for the first bad check-in.')
+            for change_time in suspects:
+                print(f'First bad check-in is at \'{change_time}\':')
+                for file_path, file_changes in sorted(state['file_changes'].items()):
+                    for file_time, rev in file_changes:
+                        if file_time == change_time:
+                            print(f'  {os.path.relpath(os.path.join(wa_root, file_path), os.getcwd())} {rev}')
+            print('Use bisect reset to restore the workarea.')
+            return
+
+        test_time = untested[len(untested) // 2]
+        changed_count = self.bisect_update(wa_root, state_path, state, {file_path: self.get_bisect_rev(state, file_path, test_time) for file_path in state['file_revs']})
+        state['current'] = test_time
+        state['log'].append(f'# testing {test_time}, {changed_count} files changed')
+        self.save_bisect_state(state_path, state)
+        print(f'Bisecting: {len(untested)} check-in times left to test, roughly {math.ceil(math.log2(len(untested) + 1))} steps.')
+        print(f'Workarea is at \'{test_time}\' with {changed_count} files changed. Test it and use bisect good or bisect bad.')
+
+    def bisect_load(self, wa_root, state):
+        # the revisions of each file checked in after the good time. sos shifts the audit window
+        # (see adjust_datetime_war), so it starts a day early and the times are filtered here
+        state['from'] = state['good']
+        from_time = (self.get_datetime_from_str(state['good']) - datetime.timedelta(days=1)).strftime('%Y/%m/%d %H:%M:%S')
+        log_data = self.execute_sos_command(['soscmd', 'audit'], ['-f%date %user %cmd %obj %rev %summary', '-sfo', '-group', '-cmdci', '-cmdcreate', f'-from{from_time}'], ret_text=True, quiet=True)
+        file_changes = {}
+        for line in log_data:
+            line = line.split()
+            if len(line) < 6 or not line[5].isdigit() or not line[0][:1].isdigit():
+                continue
+            change_time = f'{line[0]} {line[1]}'
+            if change_time > state['good']:
+                file_changes.setdefault(self.remove_prefix(line[4], './'), []).append([change_time, int(line[5])])
+        for changes in file_changes.values():
+            changes.sort(key=lambda change: change[1])
+
+        # files are set to revisions directly, so checked out files are left as they are
+        rel_paths = [os.path.relpath(os.path.join(wa_root, file_path), os.getcwd()) for file_path in file_changes]
+        status_lists = self.run_parallel([self.execute_sos_command_async(['soscmd', 'status'], status_args + paths_chunk, ret_text=True, quiet=True) for paths_chunk in self.chunk_paths(rel_paths) for status_args in [['-f%V %P'], ['-f%P', '-sco']]])
+        base_revs = {}
+        co_paths = set()
+        for status_idx, status_list in enumerate(status_lists):
+            for file_data in status_list:
+                if file_data.startswith('*'):
+                    continue
+                if status_idx % 2:
+                    co_paths.add(self.remove_prefix(file_data.strip(), './'))
+                    continue
+                file_data = file_data.split(None, 1)
+                if len(file_data) == 2 and file_data[0].isdigit():
+                    base_revs[self.remove_prefix(file_data[1], './')] = int(file_data[0])
+        for file_path in sorted(co_paths & file_changes.keys()):
+            print(f'{bcolors.YELLOW}Warning: Skipping \'{file_path}\' as it is checked out.{bcolors.ENDC}')
+            del file_changes[file_path]
+        # files not in the workarea have revision 0
+        state['file_changes'] = file_changes
+        state['base_revs'] = {file_path: base_revs.get(file_path, 0) for file_path in file_changes}
+        state['file_revs'] = dict(state['base_revs'])
+
+    def get_bisect_rev(self, state, file_path, change_time):
+        # the last revision checked in by the given time. before the first one of the changes it has the
+        # previous revision, which is 0 for a file created after the good time
+        changes = state['file_changes'][file_path]
+        file_rev = changes[0][1] - 1
+        for file_time, rev in changes:
+            if file_time <= change_time:
+                file_rev = rev
+        return file_rev
+
+    def bisect_update(self, wa_root, state_path, state, target_revs):
+        # writes only the files with a different revision, from the revision cache
+        update_revs = {file_path: rev for file_path, rev in target_revs.items() if state['file_revs'][file_path] != rev}
+        rel_paths = {file_path: os.path.relpath(os.path.join(wa_root, file_path), os.getcwd()) for file_path in update_revs}
+        rev_filepaths = self.get_revision_filepaths(wa_root, [(rel_paths[file_path], rev) for file_path, rev in update_revs.items() if rev])
+        try:
+            for file_path, rev in update_revs.items():
+                abs_path = os.path.join(wa_root, file_path)
+                if rev:
+                    # replaced as a new file, so the mode of the read-only file is kept
+                    file_mode = os.stat(abs_path).st_mode & 0o7777 if os.path.exists(abs_path) else 0o444
+                    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+                    tmp_filepath = f'{abs_path}.{os.getpid()}.tmp'
+                    with self.open_revision((rel_paths[file_path], rev), rev_filepaths[(rel_paths[file_path], rev)]) as rev_file, open(tmp_filepath, 'wb') as out_file:
+                        shutil.copyfileobj(rev_file, out_file)
+                    os.chmod(tmp_filepath, file_mode)
+                    os.replace(tmp_filepath, abs_path)
+                elif os.path.lexists(abs_path):
+                    os.remove(abs_path)
+                state['file_revs'][file_path] = rev
+        finally:
+            if self.trace_record_path or self.trace_replay_path:
+                for rev_filepath in rev_filepaths.values():
+                    if os.path.exists(rev_filepath):
+                        os.remove(rev_filepath)
+            self.save_bisect_state(state_path, state)
+        return len(update_revs)
+
+    def save_bisect_state(self, state_path, state):
+        with open(f'{state_path}.{os.getpid()}', 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(f'{state_path}.{os.getpid()}', state_path)
+
+    def blame_sos(self, args):
+        line_range = None
+        file_args = []
+        while args:
+            arg = args.pop(0)
+            if arg.startswith('-L'):
+                range_arg = arg[2:] if len(arg) > 2 else (args.pop(0) if args else '')
+                range_arg = range_arg.split(',')
+                if len(range_arg) != 2 or not range_arg[0].isdigit() or not range_arg[1].isdigit() or not 0 < int(range_arg[0]) <= int(range_arg[1]):
+                    print(f'{bcolors.RED}Error: Invalid line range. Enter as: -L <start>,<end>{bcolors.ENDC}')
+                    exit(1)
+                line_range = (int(range_arg[0]), int(range_arg[1]))
+            else:
+                file_args.append(arg)
+        self.check_args_count(file_args, min=1, max=1)
+        file_path = file_args[0]
+        if not os.path.isfile(file_path):
+            print(f'{bcolors.RED}Error: \'{file_path}\' is not a file.{bcolors.ENDC}')
+            exit(1)
+        wa_root = self.get_wa_root_path()
+        hist_data, file_status = self.run_parallel([
+            self.execute_sos_command_async(['soscmd', 'history'], ['-fs', '-cmdcreate', '-cmdci', file_path], ret_text=True, quiet=True),
+            self.execute_sos_command_async(['soscmd', 'status'], ['-f%V', file_path], ret_text=True, quiet=True),
+        ])
+        file_status = [line.strip() for line in file_status if not line.startswith('*')]
+        if len(file_status) != 1 or not file_status[0].isdigit():
+            print(f'{bcolors.RED}Error: \'{file_path}\' is not managed in SOS.{bcolors.ENDC}')
+            exit(1)
+        base_rev = int(file_status[0])
+        rev_info = {}
+        for line in hist_data:
+            if not line.startswith('Action:'):
+                continue
+            log_attrs = {}
+            for file_attr in line.split(' | '):
+                attr = file_attr.split(':', 1)
+                if len(attr) == 2:
+                    log_attrs[attr[0].strip()] = attr[1].strip()
+            if log_attrs.get('Revision', '').isdigit() and int(log_attrs['Revision']) <= base_rev:
+                rev_info[int(log_attrs['Revision'])] = (log_attrs.get('By', ''), log_attrs.get('At time', ''))
+        revs = sorted(rev_info)
+        if not revs or revs[-1] != base_rev:
+            print(f'{bcolors.RED}Error: History of \'{file_path}\' has no revision {base_rev}.{bcolors.ENDC}')
+            exit(1)
+
+        with open(file_path, 'rb') as in_file:
+            local_text = in_file.read()
+        if b'\0' in local_text:
+            print(f'{bcolors.RED}Error: \'{file_path}\' is a binary file.{bcolors.ENDC}')
+            exit(1)
+        local_lines = local_text.decode(errors='surrogateescape').splitlines(keepends=True)
+        if line_range and line_range[0] > len(local_lines):
+            print(f'{bcolors.RED}Error: \'{file_path}\' has only {len(local_lines)} lines.{bcolors.ENDC}')
+            exit(1)
+        out_range = range(line_range[0] - 1, min(line_range[1], len(local_lines))) if line_range else range(len(local_lines))
+        blame_data = self.load_blame_data(wa_root, file_path, revs)
+        if blame_data and blame_data['rev'] == base_rev:
+            base_lines = blame_data['lines']
+        else:
+            base_lines = self.get_revision_lines(wa_root, file_path, [base_rev])[base_rev]
+
+        # lines of the file are matched to the base revision, the others are local changes.
+        # without a range all lines of the base revision are looked up, to cache the result
+        if local_lines == base_lines:
+            base_out_idxs = {out_idx: out_idx for out_idx in out_range}
+        else:
+            base_out_idxs = self.match_lines(base_lines, local_lines, {out_idx: out_idx for out_idx in out_range})
+        base_idxs = range(len(base_lines)) if not line_range else base_out_idxs.keys()
+        base_origins = self.blame_lines(wa_root, file_path, revs, base_lines, {base_idx: base_idx for base_idx in base_idxs}, blame_data, 1 if line_range else self.max_jobs)
+        if not line_range:
+            self.save_blame_data(wa_root, file_path, {'rev': base_rev, 'lines': base_lines, 'origins': [base_origins[base_idx] for base_idx in base_idxs]})
+        origins = {out_idx: None for out_idx in out_range}
+        for base_idx, out_idx in base_out_idxs.items():
+            origins[out_idx] = base_origins[base_idx]
+
+        num_width = len(str(out_range.stop))
+        user_width = max([len(rev_info[rev][0]) for rev in set(origins.values()) if rev] + [5])
+        blame_text = ''
+        for out_idx in out_range:
+            rev = origins[out_idx]
+            user, change_time = rev_info[rev] if rev else ('local', '')
+            line_text = local_lines[out_idx].rstrip('\r\n')
+            blame_text += f'{rev or "-":>4} ({user:{user_width}} {change_time:19} {out_idx + 1:>{num_width}}) {line_text}\n'
+        if sys.stdout.isatty():
+            tmp_filepath = self.generate_temp_filename()
+            with open(tmp_filepath, 'w', errors='surrogateescape') as tmp_file:
+                tmp_file.write(blame_text)
+            subprocess.call(['less', '-R', tmp_filepath])
+            os.remove(tmp_filepath)
+        else:
+            sys.stdout.write(blame_text)
+
+    def blame_lines(self, wa_root, file_path, revs, lines, pending, blame_data, fetch_count):
+        # walks back from the last of revs, which has the given lines. pending maps line indexes
+        # of the current revision to keys, until each key has reached the revision that added it.
+        # revisions are exported fetch_count at a time, doubling up to the parallel job count
+        origins = {}
+        rev_lines = {}
+        rev_idx = len(revs) - 1
+        while pending:
+            rev = revs[rev_idx]
+            if blame_data and blame_data['rev'] == rev:
+                for line_idx, key in pending.items():
+                    origins[key] = blame_data['origins'][line_idx]
+                break
+            if rev_idx == 0:
+                for key in pending.values():
+                    origins[key] = rev
+                break
+            prev_rev = revs[rev_idx - 1]
+            if blame_data and blame_data['rev'] == prev_rev:
+                prev_lines = blame_data['lines']
+            else:
+                if prev_rev not in rev_lines:
+                    # the next revisions back are exported in parallel, down to the cached one
+                    fetch_revs = revs[max(0, rev_idx - fetch_count):rev_idx]
+                    if blame_data:
+                        fetch_revs = [fetch_rev for fetch_rev in fetch_revs if fetch_rev > blame_data['rev']]
+                    rev_lines = self.get_revision_lines(wa_root, file_path, fetch_revs)
+                    fetch_count = min(fetch_count * 2, self.max_jobs)
+                prev_lines = rev_lines.pop(prev_rev)
+            prev_pending = self.match_lines(prev_lines, lines, pending)
+            for key in set(pending.values()) - set(prev_pending.values()):
+                origins[key] = rev
+            pending = prev_pending
+            lines = prev_lines
+            rev_idx -= 1
+        return origins
+
+    def match_lines(self, old_lines, new_lines, pending):
+        # maps the pending line indexes of new_lines to the indexes of the same lines in old_lines
+        matched = {}
+        for old_idx, new_idx, size in difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_matching_blocks():
+            for offset in range(size):
+                if new_idx + offset in pending:
+                    matched[old_idx + offset] = pending[new_idx + offset]
+        return matched
+
+    def get_blame_filepath(self, wa_root, file_path):
+        # kept apart from the revisions, which the prefetch removes when they are not needed
+        file_relpath = os.path.relpath(os.path.abspath(file_path), wa_root)
+        return os.path.join(self.get_rev_cache_path(wa_root), 'blame', hashlib.sha1(file_relpath.encode()).hexdigest() + '.json')
+
+    def load_blame_data(self, wa_root, file_path, revs):
+        # cached blame of the file for one of revs. traces must see every export, so it is not used then
+        if self.trace_record_path or self.trace_replay_path:
+            return None
+        blame_filepath = self.get_blame_filepath(wa_root, file_path)
+        if not os.path.isfile(blame_filepath):
+            return None
+        try:
+            with open(blame_filepath, 'r', errors='surrogateescape') as blame_file:
+                blame_data = json.load(blame_file)
+        except ValueError:
+            return None
+        if blame_data.get('rev') not in revs or len(blame_data['lines']) != len(blame_data['origins']):
+            return None
+        return blame_data
+
+    def save_blame_data(self, wa_root, file_path, blame_data):
+        if self.trace_record_path or self.trace_replay_path:
+            return
+        blame_filepath = self.get_blame_filepath(wa_root, file_path)
+        os.makedirs(os.path.dirname(blame_filepath), exist_ok=True)
+        with open(f'{blame_filepath}.{os.getpid()}', 'w', errors='surrogateescape') as blame_file:
+            json.dump(blame_data, blame_file)
+        os.replace(f'{blame_filepath}.{os.getpid()}', blame_filepath)
 
     def checkout_sos(self, args):
         branches = self.execute_sos_command(['soscmd', 'query'], ['branches'], ret_text=True, quiet=True)
@@ -280,35 +1251,133 @@ Bye.''')
         self.execute_sos_command(['soscmd', 'update'], ['-rso'] + new_args)
 
     def cleanup_sos(self, args):
+        skip_wait, dry_run = (False,) * 2
+        if '--yes' in args:
+            skip_wait = True
+            args = [arg for arg in args if arg != '--yes']
+        if '--dry-run' in args:
+            dry_run = True
+            args = [arg for arg in args if arg != '--dry-run']
         self.check_args_count(args, max=0)
 
         # remove untracked files
-        print('Waiting for 5 seconds.')
-        print(f'{bcolors.RED}All untracked files will be deleted.{bcolors.ENDC}')
-        time.sleep(5)
+        if not skip_wait and not dry_run:
+            print('Waiting for 5 seconds.')
+            print(f'{bcolors.RED}All untracked files will be deleted.{bcolors.ENDC}')
+            time.sleep(5)
         wa_root = self.get_wa_root_path()
-        unm_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%P', '-sunm'], ret_text=True, quiet=True)
+        unm_filelist = self.execute_sos_command_iter(['soscmd', 'status'], ['-f%P', '-sunm'], quiet=True)
+        unm_filelist = sorted(self.remove_prefix(file_path, './') for file_path in unm_filelist if not file_path.startswith('*'))
+
+        # untracked directories are removed or kept as a whole, so skip the paths inside them
+        ign_patterns = self.get_ignore_patterns(wa_root)
+        root_groups = {}
+        last_root = None
         for file_path in unm_filelist:
-            if file_path.startswith('*') or file_path.endswith(tuple(self.ign_file_suffix)):
+            if last_root and file_path.startswith(last_root + '/'):
                 continue
-            print(f'Removing file #\'{file_path}\'.')
-            file_path = os.path.join(wa_root, file_path)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-            else:
-                os.rmdir(file_path)
+            last_root = file_path
+            if ign_patterns.is_ignored(file_path):
+                continue
+            # the files at the workarea root are removed in one group, each directory in its own
+            top_dir = file_path.split('/', 1)[0] if '/' in file_path or os.path.isdir(os.path.join(wa_root, file_path)) else ''
+            if top_dir not in root_groups:
+                root_groups[top_dir] = []
+            root_groups[top_dir].append(file_path)
+
+        # the groups are removed on worker threads, their messages are printed here in group order
+        group_stats = self.run_parallel([self.run_blocking(self.remove_untracked, wa_root, root_groups[top_dir], ign_patterns, dry_run) for top_dir in sorted(root_groups)])
+        for group_msgs, _ in group_stats:
+            for msg in group_msgs:
+                print(msg)
+        file_count, dir_count, byte_count = [sum(stats) for stats in zip((0, 0, 0), *[stats for _, stats in group_stats])]
+        if dry_run:
+            print(f'Would remove {file_count} files and {dir_count} directories, freeing {byte_count} bytes.')
+            return
+        print(f'Removed {file_count} files and {dir_count} directories, freed {byte_count} bytes.')
 
         # update workspace
         self.execute_sos_command(['soscmd', 'update'], ['-ccw'] + args)
 
+    def remove_untracked(self, wa_root, root_list, ign_patterns, dry_run):
+        # returns the messages, and the count of files, directories and bytes removed. ignored paths are kept
+        file_count, dir_count, byte_count = (0,) * 3
+        msg_list = []
+        for rel_root in root_list:
+            msg_list.append(f'{"Would remove" if dry_run else "Removing"} #\'{rel_root}\'.')
+            root_path = os.path.join(wa_root, rel_root)
+            if not os.path.isdir(root_path) or os.path.islink(root_path):
+                if os.path.lexists(root_path):
+                    byte_count += os.lstat(root_path).st_size
+                    file_count += 1
+                    if not dry_run:
+                        os.remove(root_path)
+                continue
+            # walk top-down and remove directories bottom-up once emptied
+            dir_stack = [(root_path, rel_root, False)]
+            while dir_stack:
+                dir_path, dir_relpath, visited = dir_stack.pop()
+                if visited:
+                    dir_count += 1
+                    if not dry_run:
+                        try:
+                            os.rmdir(dir_path)
+                        except OSError: # has ignored paths
+                            dir_count -= 1
+                    continue
+                dir_stack.append((dir_path, dir_relpath, True))
+                with os.scandir(dir_path) as dir_entries:
+                    for entry in dir_entries:
+                        entry_relpath = f'{dir_relpath}/{entry.name}'
+                        entry_is_dir = entry.is_dir(follow_symlinks=False)
+                        if ign_patterns.is_ignored(entry_relpath, entry_is_dir): # prunes ignored directories
+                            continue
+                        if entry_is_dir:
+                            dir_stack.append((entry.path, entry_relpath, False))
+                        else:
+                            byte_count += entry.stat(follow_symlinks=False).st_size
+                            file_count += 1
+                            if not dry_run:
+                                os.remove(entry.path)
+        return msg_list, (file_count, dir_count, byte_count)
+
     def clone_sos(self, args):
         if len(args) == 1:
+            wa_path = args[0]
             self.execute_sos_command(['soscmd', 'newworkarea'], [os.environ['MRVL_PROJECT'], os.environ['MRVL_PROJECT'], args[0], '-LCACHED'])
         elif len(args) >= 3:
+            wa_path = args[2]
             self.execute_sos_command(['soscmd', 'newworkarea'], [args.pop(0), args.pop(0), args.pop(0), '-LCACHED'] + args)
         else:
             print(f'{bcolors.RED}Error: Invalid args. Enter args after command: <server> <project> <path> <extra args ...>{bcolors.ENDC}')
             exit(1)
+        self.register_workarea(os.path.abspath(wa_path))
+
+    def daemon_sos(self, args):
+        action = args[0] if args else 'status'
+        if len(args) > 1 or action not in ['start', 'stop', 'status', '--serve']:
+            print(f'{bcolors.RED}Error: Invalid args. Enter one of: start, stop, status{bcolors.ENDC}')
+            exit(1)
+        self.setup_user_cache()
+        if action == '--serve':
+            self.serve_daemon()
+            return
+        daemon_info = self.get_daemon_info()
+        if action == 'start':
+            if daemon_info:
+                print(f'Daemon is already running with pid {daemon_info["pid"]}.')
+            else:
+                self.start_daemon_process()
+        elif not daemon_info:
+            print('No daemon is running.')
+        elif action == 'stop':
+            os.kill(daemon_info['pid'], signal.SIGTERM)
+            print(f'Stopped daemon with pid {daemon_info["pid"]}.')
+        else:
+            print(f'Daemon is running with pid {daemon_info["pid"]} since {daemon_info["started"]}.')
+            print(f'Socket: \'{daemon_info["socket"]}\', idle timeout: {self.daemon_idle_time}s')
+            if daemon_info['version'] != self.get_script_version():
+                print('The script has changed, the daemon restarts with it on the next command.')
 
     def declone_sos(self, args):
         self.check_args_count(args, max=0)
@@ -316,9 +1385,15 @@ Bye.''')
         print(f'{bcolors.RED}The workspace will be deleted.{bcolors.ENDC}')
         time.sleep(5)
 
+        wa_root = self.get_wa_root_path()
         self.execute_sos_command(['soscmd', 'deleteworkarea'], ['-F'] + args)
+        self.register_workarea(wa_root, register=False)
+        self.wa_root = ''
 
     def diff_sos(self, args):
+        dir_diff = '--dir-diff' in args
+        text_mode = ([arg for arg in args if arg in ['--stat', '--name-only', '--text']] or [None])[-1]
+        args = [arg for arg in args if arg not in ['--dir-diff', '--stat', '--name-only', '--text']]
         co_filelist = []
         wa_root = self.get_wa_root_path()
         get_co_files = False
@@ -329,6 +1404,8 @@ Bye.''')
                 rev1 = self.remove_prefix(args[0], '-r')
                 rev2 = self.remove_prefix(args[1], '-r')
                 co_filelist.append(f'{args[2]} {rev1} {rev2}')
+            elif len(args) == 1 and args[0][:1].isdigit() and '..' in args[0]:
+                co_filelist = self.get_range_filelist(wa_root, *args[0].split('..', 1))
             elif len(args) == 1 and args[0][:1].isdigit():
                 datetime_object = self.get_datetime_from_str(args[0])
                 if not datetime_object:
@@ -348,37 +1425,245 @@ Bye.''')
                 raise Exception()
         except Exception as e:
             get_co_files = True
+        base_revs = {}
         if get_co_files:
-            co_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%P', '-sco'] + args, ret_text=True, quiet=True)
-            co_filelist = [os.path.relpath(os.path.join(wa_root, file), os.getcwd()) for file in co_filelist if not file.startswith('*')]
+            co_filelist = []
+            status_list = self.parse_rev_status(self.execute_sos_command(['soscmd', 'status'], ['-f%V %P', '-sco'] + args, ret_text=True, quiet=True))
+            unmodified_paths = self.get_unmodified_files(wa_root, status_list)
+            for file_rev, file_path in status_list:
+                if file_path in unmodified_paths:
+                    continue
+                file_path = os.path.relpath(os.path.join(wa_root, file_path), os.getcwd())
+                base_revs[file_path] = file_rev
+                co_filelist.append(file_path)
+
+        # export all revisions before showing the first diff
+        diff_list = []
+        export_list = []
+        tmp_dirpath = self.generate_temp_filename() if dir_diff else ''
+        try:
+            for file_data in co_filelist:
+                file_data = file_data.split() # has file path and revisions
+                file_path = file_data[0]
+                if os.path.isdir(file_path):
+                    print(f'Skipping \'{file_path}\' as it is a directory.')
+                    continue
+                file_name = os.path.basename(file_path)
+
+                tmp_filepath1, tmp_filepath2 = ('',) * 2
+                if dir_diff:
+                    # both sides go to trees with the workarea layout, for one directory compare
+                    file_relpath = os.path.relpath(os.path.abspath(file_path), wa_root)
+                    tmp_filepath1 = os.path.join(tmp_dirpath, 'before', file_relpath)
+                    tmp_filepath2 = os.path.join(tmp_dirpath, 'after', file_relpath)
+                    os.makedirs(os.path.dirname(tmp_filepath1), exist_ok=True)
+                    os.makedirs(os.path.dirname(tmp_filepath2), exist_ok=True)
+                    if len(file_data) > 2:
+                        export_list.append((f'{file_path}/#/{file_data[1]}', tmp_filepath1, self.get_rev_cache_filepath(wa_root, file_path, file_data[1])))
+                        export_list.append((f'{file_path}/#/{file_data[2]}', tmp_filepath2, self.get_rev_cache_filepath(wa_root, file_path, file_data[2])))
+                    else:
+                        export_list.append((file_path, tmp_filepath1, self.get_rev_cache_filepath(wa_root, file_path, base_revs[file_path]) if file_path in base_revs else None))
+                        # the workarea file is hard-linked instead of copied
+                        try:
+                            os.link(file_path, tmp_filepath2)
+                        except OSError:
+                            shutil.copyfile(file_path, tmp_filepath2)
+                elif len(file_data) > 2:
+                    tmp_filepath1 = self.generate_temp_filename() + f'__{file_name}.{file_data[1]}'
+                    tmp_filepath2 = self.generate_temp_filename() + f'__{file_name}.{file_data[2]}'
+                    export_list.append((f'{file_path}/#/{file_data[1]}', tmp_filepath1, self.get_rev_cache_filepath(wa_root, file_path, file_data[1])))
+                    export_list.append((f'{file_path}/#/{file_data[2]}', tmp_filepath2, self.get_rev_cache_filepath(wa_root, file_path, file_data[2])))
+                else:
+                    tmp_filepath1 = self.generate_temp_filename() + f'__{file_name}'
+                    tmp_filepath2 = file_path
+                    export_list.append((file_path, tmp_filepath1, self.get_rev_cache_filepath(wa_root, file_path, base_revs[file_path]) if file_path in base_revs else None))
+                diff_list.append((file_path, tmp_filepath1, tmp_filepath2, len(file_data) > 2))
+            # files created in a range have no revision before it
+            for export_item in [export_item for export_item in export_list if export_item[0].endswith('/#/0')]:
+                open(export_item[1], 'w').close()
+                export_list.remove(export_item)
+            if text_mode:
+                self.show_text_diffs(diff_list, {export_item[1]: export_item for export_item in export_list}, text_mode)
+                return
+            self.export_revisions(export_list)
+            if dir_diff:
+                if diff_list:
+                    print(f'Diff for {len(diff_list)} files.')
+                    subprocess.call([self.diff_tool, os.path.join(tmp_dirpath, 'before'), os.path.join(tmp_dirpath, 'after')], stdout=subprocess.DEVNULL)
+                return
 
-        for file_data in co_filelist:
-            file_data = file_data.split() # has file path and revisions
-            file_path = file_data[0]
-            if os.path.isdir(file_path):
-                print(f'Skipping \'{file_path}\' as it is a directory.')
-                continue
-            file_name = os.path.basename(file_path)
-
-            tmp_filepath1, tmp_filepath2 = ('',) * 2
-            print(f'Diff for \'{file_path}\'.')
-            if len(file_data) > 2:
-                tmp_filepath1 = self.generate_temp_filename() + f'__{file_name}.{file_data[1]}'
-                tmp_filepath2 = self.generate_temp_filename() + f'__{file_name}.{file_data[2]}'
-                self.execute_sos_command(['soscmd', 'exportrev'], [f'{file_path}/#/{file_data[1]}', f'-out{tmp_filepath1}'], quiet=True)
-                self.execute_sos_command(['soscmd', 'exportrev'], [f'{file_path}/#/{file_data[2]}', f'-out{tmp_filepath2}'], quiet=True)
+            for file_path, tmp_filepath1, tmp_filepath2, is_rev_diff in diff_list:
+                print(f'Diff for \'{file_path}\'.')
+                subprocess.call([self.diff_tool, tmp_filepath1, tmp_filepath2], stdout=subprocess.DEVNULL)
+                os.remove(tmp_filepath1)
+                if is_rev_diff:
+                    os.remove(tmp_filepath2)
+        finally:
+            # temp files are left when a diff fails or is interrupted, and the dir-diff trees always
+            if dir_diff:
+                shutil.rmtree(tmp_dirpath, ignore_errors=True)
             else:
-                tmp_filepath1 = self.generate_temp_filename() + f'__{file_name}'
-                tmp_filepath2 = file_path
-                self.execute_sos_command(['soscmd', 'exportrev'], [file_path, f'-out{tmp_filepath1}'], quiet=True)
-            subprocess.call([self.diff_tool, tmp_filepath1, tmp_filepath2], stdout=subprocess.DEVNULL)
-            os.remove(tmp_filepath1)
-            if len(file_data) > 2:
-                os.remove(tmp_filepath2)
+                for _, tmp_filepath1, tmp_filepath2, is_rev_diff in diff_list:
+                    for tmp_filepath in [tmp_filepath1, tmp_filepath2] if is_rev_diff else [tmp_filepath1]:
+                        if os.path.exists(tmp_filepath):
+                            os.remove(tmp_filepath)
+
+    def get_range_filelist(self, wa_root, from_arg, to_arg):
+        # the net change of each file over the check-ins in the range, from the revision before its first one
+        # to its last one. the audit lists the newest first, so the last revisions are exported to the
+        # revision cache while it is read, and are then copied like the ones already cached
+        from_datetime, to_datetime = self.get_datetime_from_str(from_arg), self.get_datetime_from_str(to_arg)
+        if not from_datetime or not to_datetime:
+            raise Exception()
+        if ' ' not in to_arg.strip(): # a date includes the whole day
+            to_datetime += datetime.timedelta(days=1, seconds=-1)
+        from_time, to_time = from_datetime.strftime('%Y/%m/%d %H:%M:%S'), to_datetime.strftime('%Y/%m/%d %H:%M:%S')
+        # sos shifts the audit window (see adjust_datetime_war), so it is widened and the times are filtered here
+        adj_from_time = (from_datetime - datetime.timedelta(days=1)).strftime('%Y/%m/%d %H:%M:%S')
+        adj_to_time = (to_datetime + datetime.timedelta(days=1)).strftime('%Y/%m/%d %H:%M:%S')
+        use_cache = not self.trace_record_path and not self.trace_replay_path
+        file_revs = {}
+        change_times = set()
+
+        async def cache_rev(rev_path, cache_filepath):
+            try:
+                await self.add_to_rev_cache_async(rev_path, cache_filepath)
+            except SOSCommandError:
+                pass # the export for the diff reports it
+        async def read_audit():
+            cache_tasks = []
+            try:
+                async for line_chunk in self.stream_sos_command_async(['soscmd', 'audit'], ['-f%date %user %cmd %obj %rev %summary', '-sfo', '-group', '-cmdci', '-cmdcreate', f'-from{adj_from_time}', f'-to{adj_to_time}'], quiet=True):
+                    for line in line_chunk:
+                        line = line.split()
+                        if len(line) < 6 or not line[5].isdigit() or not line[0][:1].isdigit() or not from_time <= f'{line[0]} {line[1]}' <= to_time:
+                            continue
+                        change_times.add(f'{line[0]} {line[1]}')
+                        rel_filepath = os.path.relpath(os.path.join(wa_root, self.remove_prefix(line[4], './')), os.getcwd())
+                        rev = int(line[5])
+                        if rel_filepath in file_revs:
+                            file_revs[rel_filepath] = [min(file_revs[rel_filepath][0], rev), max(file_revs[rel_filepath][1], rev)]
+                            continue
+                        file_revs[rel_filepath] = [rev, rev]
+                        cache_filepath = self.get_rev_cache_filepath(wa_root, rel_filepath, rev)
+                        if use_cache and not os.path.isfile(cache_filepath):
+                            cache_tasks.append(asyncio.ensure_future(cache_rev(f'{rel_filepath}/#/{rev}', cache_filepath)))
+                await asyncio.gather(*cache_tasks)
+            except BaseException:
+                for task in cache_tasks:
+                    task.cancel()
+                await asyncio.gather(*cache_tasks, return_exceptions=True)
+                raise
+        self.run_async(read_audit())
+        print(f'Found {len(change_times)} changes from \'{from_time}\' to \'{to_time}\' in {len(file_revs)} files.')
+        return [f'{rel_filepath} {first_rev - 1} {last_rev}' for rel_filepath, (first_rev, last_rev) in sorted(file_revs.items())]
+
+    def show_text_diffs(self, diff_list, exports, text_mode):
+        # each file is exported and compared in its own task. the output is written in file order as
+        # the tasks finish, through less on a terminal
+        async def diff_file(file_path, tmp_filepath1, tmp_filepath2, is_rev_diff):
+            try:
+                await self.export_revisions_async([exports[tmp_filepath] for tmp_filepath in [tmp_filepath1, tmp_filepath2] if tmp_filepath in exports])
+                return await self.run_blocking(self.get_text_diff, file_path, tmp_filepath1, tmp_filepath2, text_mode)
+            finally:
+                for tmp_filepath in [tmp_filepath1, tmp_filepath2] if is_rev_diff else [tmp_filepath1]:
+                    if os.path.exists(tmp_filepath):
+                        os.remove(tmp_filepath)
+
+        tasks = [self.start_task(diff_file(*diff_data)) for diff_data in diff_list]
+        pager, out_file = self.start_pager()
+        stat_list = []
+        try:
+            for (file_path, _, _, _), task in zip(diff_list, tasks):
+                added, removed, diff_text = self.run_async(task)
+                if added == 0 and removed == 0:
+                    continue
+                if text_mode == '--stat':
+                    stat_list.append((file_path, added, removed))
+                elif text_mode == '--name-only':
+                    out_file.write(f'{file_path}\n'.encode(errors='surrogateescape'))
+                else:
+                    out_file.write(diff_text.encode(errors='surrogateescape'))
+                out_file.flush()
+            if stat_list:
+                out_file.write(self.format_diff_stat(stat_list).encode(errors='surrogateescape'))
+                out_file.flush()
+        except BrokenPipeError: # less was closed
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.run_async(asyncio.gather(*tasks, return_exceptions=True))
+            self.stop_pager(pager)
+
+    def start_pager(self):
+        # output written while it is produced goes through less on a terminal. the stream takes bytes
+        if not sys.stdout.isatty():
+            return None, sys.stdout.buffer
+        pager = subprocess.Popen(['less', '-R'], stdin=subprocess.PIPE)
+        return pager, pager.stdin
+
+    def stop_pager(self, pager):
+        if not pager:
+            return
+        try:
+            pager.stdin.close()
+        except BrokenPipeError:
+            pass
+        pager.wait()
+
+    def get_text_diff(self, file_path, tmp_filepath1, tmp_filepath2, text_mode):
+        # returns the added and removed line counts, which are None for binary files, and the unified diff
+        old_data, new_data = self.read_file_data(tmp_filepath1), self.read_file_data(tmp_filepath2)
+        if old_data == new_data:
+            return 0, 0, ''
+        if text_mode == '--name-only':
+            return None, None, ''
+        if b'\0' in old_data or b'\0' in new_data:
+            return None, None, f'Binary files a/{file_path} and b/{file_path} differ\n'
+        old_lines = old_data.decode(errors='surrogateescape').splitlines(keepends=True)
+        new_lines = new_data.decode(errors='surrogateescape').splitlines(keepends=True)
+        added, removed = 0, 0
+        diff_text = ''
+        for line in difflib.unified_diff(old_lines, new_lines, f'a/{file_path}', f'b/{file_path}', n=0 if text_mode == '--stat' else 3):
+            if line[:1] == '+' and not line.startswith('+++ '):
+                added += 1
+            elif line[:1] == '-' and not line.startswith('--- '):
+                removed += 1
+            if text_mode == '--text':
+                diff_text += line if line.endswith('\n') else line + '\n\\ No newline at end of file\n'
+        return added, removed, diff_text
+
+    def read_file_data(self, file_path):
+        with open(file_path, 'rb') as in_file:
+            if not os.fstat(in_file.fileno()).st_size:
+                return b''
+            with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+                return file_map[:]
+
+    def format_diff_stat(self, stat_list):
+        # as git diff --stat, the bars are scaled down to fit the widest one in 50 columns
+        name_width = max(len(file_path) for file_path, _, _ in stat_list)
+        max_changes = max([added + removed for _, added, removed in stat_list if added is not None] + [1])
+        count_width = len(str(max_changes))
+        scale = min(1, 50 / max_changes)
+        stat_text = ''
+        for file_path, added, removed in stat_list:
+            if added is None:
+                stat_text += f' {file_path:{name_width}} | {"Bin":>{count_width}}\n'
+                continue
+            added_width = max(1, round(added * scale)) if added else 0
+            removed_width = max(1, round(removed * scale)) if removed else 0
+            stat_text += f' {file_path:{name_width}} | {added + removed:>{count_width}} {"+" * added_width}{"-" * removed_width}\n'
+        total_added = sum(added for _, added, _ in stat_list if added)
+        total_removed = sum(removed for _, _, removed in stat_list if removed)
+        stat_text += f' {len(stat_list)} file{"s" if len(stat_list) > 1 else ""} changed, {total_added} insertion{"s" if total_added != 1 else ""}(+), {total_removed} deletion{"s" if total_removed != 1 else ""}(-)\n'
+        return stat_text
 
     def discard_sos(self, args):
         self.check_args_count(args, min=1)
         self.setup_user_cache()
+        wa_data_lock = self.lock_wa_data()
         wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
         wa_data = {}
 
@@ -390,8 +1675,8 @@ Bye.''')
 
         new_args = []
         new_dir_args = []
-        files_to_remove = []
-        dirs_to_remove = []
+        pending_trie = self.get_pending_trie(wa_data['file_status'])
+        removed_records = []
         for arg in args:
             if arg.startswith('-'):
                 new_args.append(arg)
@@ -401,8 +1686,7 @@ Bye.''')
             obj_status = obj_status[0].split() if len(obj_status) == 1 else []
             if len(obj_status) != 2: # cmd returns file status and type
                 print(f'Skipping \'{arg}\' because stat returned unexpected status.')
-
-            if obj_status[1] in ['2']: # add directory
+            elif obj_status[1] in ['2']: # add directory
                 if not new_dir_args:
                     new_dir_args = ['-sr', '-sco']
                 new_args.append(arg)
@@ -411,49 +1695,39 @@ Bye.''')
                 new_args.append(arg)
                 print(f'Adding \'{arg}\' for discarding checkout.')
 
-            rel_path = os.path.relpath(arg, wa_root)
-            if os.path.isdir(rel_path):
-                rel_path += '/'
-                dirs_to_remove.append(rel_path)
-            else:
-                files_to_remove.append(rel_path)
+            # records of a directory are all the records below it
+            removed_records.extend(pending_trie.remove(os.path.relpath(arg, wa_root)))
 
         # clean up the local file status
+        removed_paths = {}
+        for file, (key, target) in sorted(removed_records, key=lambda item: item[0]):
+            print(f'Removing #\'{file}\' from {key} list.')
+            removed_paths.setdefault(key, set()).add((file, target))
+        file_status = wa_data['file_status']
         for key in ['create', 'delete']:
-            if key not in wa_data['file_status']:
-                continue
-            for file in wa_data['file_status'][key]:
-                if file in files_to_remove or file.startswith(tuple(dirs_to_remove)):
-                    print(f'Removing #\'{file}\' from {key} list.')
-                    wa_data['file_status'][key].remove(file)
-        for key in ['move']: # live with the 4 level nest below
-            if key not in wa_data['file_status']:
-                continue
-            for subpath in wa_data['file_status'][key]:
-                for file in wa_data['file_status'][key][subpath]:
-                    if file in files_to_remove or file.startswith(tuple(dirs_to_remove)):
-                        print(f'Removing #\'{file}\' from {key} list.')
-                        wa_data['file_status'][key][subpath].remove(file)
-        for key in ['rename']:
-            if key not in wa_data['file_status']:
-                continue
-            files_to_del = []
-            for file in wa_data['file_status'][key]:
-                if file in files_to_remove or file.startswith(tuple(dirs_to_remove)):
-                    print(f'Removing #\'{file}\' from {key} list.')
-                    files_to_del.append(file)
-            for file in files_to_del:
-                del wa_data['file_status'][key][file]
+            if key in removed_paths and key in file_status:
+                file_status[key] = [file for file in file_status[key] if (file, None) not in removed_paths[key]]
+        if 'move' in removed_paths and 'move' in file_status:
+            for tgt_dir in list(file_status['move']):
+                file_status['move'][tgt_dir] = [file for file in file_status['move'][tgt_dir] if (file, tgt_dir) not in removed_paths['move']]
+                if not file_status['move'][tgt_dir]:
+                    del file_status['move'][tgt_dir]
+        if 'rename' in removed_paths and 'rename' in file_status:
+            for file, _ in removed_paths['rename']:
+                file_status['rename'].pop(file, None)
 
         # save file status data
-        with open(wa_data_file_path, 'w') as cache_file:
-            json.dump(wa_data, cache_file, indent=2)
+        self.save_wa_data(wa_data_file_path, wa_data, wa_root)
+        wa_data_lock.close()
 
         if new_args:
             self.execute_sos_command(['soscmd', 'discardco'], ['-F'] + new_dir_args + new_args)
 
     def fetch_sos(self, args):
+        start_prefetch = '--prefetch' in args
+        args = [arg for arg in args if arg != '--prefetch']
         self.execute_sos_command(['soscmd', 'update'], ['-i', '-pr'] + args)
+        self.rev_cache_fetched(start_prefetch)
 
     def help_sos(self, args):
         help_txt = self.execute_sos_command(['soscmd', 'help'], args, ret_text=True, quiet=True)
@@ -502,7 +1776,7 @@ Bye.''')
         if arg_has_file and not arg_has_nonfile:
             if not user_set_arg_cmd:
                 args[:0] = ['-cmdcreate', '-cmdci']
-            hist_data = self.execute_sos_command(['soscmd', 'history'], ['-fs'] + args, ret_text=True, quiet=True)
+            hist_data = self.execute_sos_command_iter(['soscmd', 'history'], ['-fs'] + args, quiet=True)
             log_data_d = {}
             file_name = None
             for line in hist_data:
@@ -535,59 +1809,182 @@ Bye.''')
                 args[:0] = ['-cmdcreate', '-cmdci', '-cmddelete', '-cmdrename', '-cmdmerge', '-cmdmove']
             if not user_set_arg_from:
                 args[:0] = ['-from-5']
-            log_data = self.execute_sos_command(['soscmd', 'audit'], ['-f%date %user %cmd %obj %rev %summary', '-sfo', '-group'] + args, ret_text=True, quiet=True)
+            log_data = self.execute_audit_iter(['-f%date %user %cmd %obj %rev %summary', '-sfo', '-group'] + args)
 
+        # each changeset is written when the next one starts, so a long log is shown while it is read
+        pager, out_file = self.start_pager()
         log_text = ''
-        for line in log_data:
-            if line[:1].isdigit():
-                line = line.split()
-                if log_text:
-                    log_text += f'\n'
-                log_text += f'{bcolors.YELLOW}Date:    {line[0]} {line[1]} {"-"*30}{bcolors.ENDC}\n'
-                log_text += f'Log:     {" ".join(line[5:])}\n'
-                log_text += f'Author:  {line[2]}\n'
-                log_text += f'Files:\n'
-            elif line.startswith(' '):
-                line = line.split()
-                log_text += f'... {line[3]:10} {line[4]}/{line[5]}\n'
-        if sys.stdout.isatty():
-            tmp_filepath = self.generate_temp_filename()
-            with open(tmp_filepath, 'w') as tmp_file:
-                tmp_file.write(log_text)
-            subprocess.call(['less', '-R', tmp_filepath])
-            os.remove(tmp_filepath)
-        else:
-            print(log_text, end='')
+        is_first = True
+        try:
+            for line in log_data:
+                if line[:1].isdigit():
+                    line = line.split()
+                    if log_text:
+                        out_file.write(log_text.encode(errors='surrogateescape'))
+                        out_file.flush()
+                        log_text = ''
+                    if not is_first:
+                        log_text += f'\n'
+                    is_first = False
+                    log_text += f'{bcolors.YELLOW}Date:    {line[0]} {line[1]} {"-"*30}{bcolors.ENDC}\n'
+                    log_text += f'Log:     {" ".join(line[5:])}\n'
+                    log_text += f'Author:  {line[2]}\n'
+                    log_text += f'Files:\n'
+                elif line.startswith(' '):
+                    line = line.split()
+                    log_text += f'... {line[3]:10} {line[4]}/{line[5]}\n'
+            out_file.write(log_text.encode(errors='surrogateescape'))
+            out_file.flush()
+        except BrokenPipeError: # less was closed
+            pass
+        finally:
+            self.stop_pager(pager)
+
+    def execute_audit_iter(self, args):
+        # yields the audit lines, newest first. a range longer than GIT2SOS_LOG_WINDOW days is queried in
+        # windows of that size, GIT2SOS_LOG_JOBS at a time, and each window is yielded once it and the
+        # newer ones are done. a changeset at the edge of two windows is in both, and is yielded once
+        now = datetime.datetime.now()
+        from_datetime, to_datetime = None, now
+        for arg in args:
+            if arg.startswith('-from'):
+                from_datetime = self.get_audit_datetime(arg[5:], now)
+            elif arg.startswith('-to'):
+                to_datetime = self.get_audit_datetime(arg[3:], now)
+        log_window = datetime.timedelta(days=self.log_window_days)
+        if not from_datetime or not to_datetime or to_datetime - from_datetime <= log_window:
+            yield from self.execute_sos_command_iter(['soscmd', 'audit'], args, quiet=True)
+            return
+
+        args = [arg for arg in args if not arg.startswith(('-from', '-to'))]
+        windows = []
+        while to_datetime > from_datetime:
+            windows.append((max(from_datetime, to_datetime - log_window), to_datetime))
+            to_datetime -= log_window
+        self.get_event_loop()
+        window_semaphore = asyncio.Semaphore(self.log_jobs)
+        async def query_window(window_from, window_to):
+            async with window_semaphore:
+                return await self.execute_sos_command_async(['soscmd', 'audit'], args + [f'-from{window_from:%Y/%m/%d %H:%M:%S}', f'-to{window_to:%Y/%m/%d %H:%M:%S}'], ret_text=True, quiet=True)
+        tasks = [self.start_task(query_window(*window)) for window in windows]
+        last_group = []
+        try:
+            for task in tasks:
+                groups = []
+                for line in self.run_async(task):
+                    if line[:1].isdigit() or not groups:
+                        groups.append([])
+                    groups[-1].append(line)
+                if not groups:
+                    continue
+                # the oldest changeset of a window is held back until the next window is done
+                if last_group and groups[0][0] == last_group[0]:
+                    groups[0] = last_group + [line for line in groups[0][1:] if line not in last_group]
+                else:
+                    yield from last_group
+                last_group = groups.pop()
+                for group in groups:
+                    yield from group
+            yield from last_group
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.run_async(asyncio.gather(*tasks, return_exceptions=True))
+
+    def get_audit_datetime(self, arg, now):
+        # -from and -to take a time or the number of days back as -<days>
+        if arg[:1] == '-' and arg[1:].isdigit():
+            return now - datetime.timedelta(days=int(arg[1:]))
+        return self.get_datetime_from_str(arg)
 
     def merge_sos(self, args):
+        use_gui = True
+        if '--no-gui' in args:
+            use_gui = False
+            args = [arg for arg in args if arg != '--no-gui']
         wa_root = self.get_wa_root_path()
-        cur_rso = self.execute_sos_command(['soscmd', 'query'], ['rso'], ret_text=True, quiet=True)
+        cur_rso, cur_filelist = self.run_parallel([
+            self.execute_sos_command_async(['soscmd', 'query'], ['rso'], ret_text=True, quiet=True),
+            self.execute_sos_command_async(['soscmd', 'status'], ['-f%V %P', '-sco', '-sand', '-snt'] + args, ret_text=True, quiet=True),
+        ])
         cur_rso = cur_rso[0] if len(cur_rso) else 'main'
         print(f'Merging files with \'{cur_rso}\'.')
 
-        cur_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%V %P', '-sco', '-sand', '-snt'] + args, ret_text=True, quiet=True)
-        for file_data in cur_filelist:
-            if file_data.startswith('*'):
-                continue
-            file_data = file_data.split()
-            file_ver = file_data[0]
-            file_relpath = file_data[1]
+        cur_filelist = self.parse_rev_status(cur_filelist)
+        unmodified_paths = self.get_unmodified_files(wa_root, cur_filelist)
+        rso_revs = self.get_rso_revs(wa_root, [os.path.relpath(os.path.join(wa_root, file_relpath), os.getcwd()) for _, file_relpath in cur_filelist])
+        merge_list = []
+        for file_ver, file_relpath in cur_filelist:
+            is_unmodified = file_relpath in unmodified_paths
+            # merged and recorded with the revision number, so the cached RSO revision cannot be stale
+            rso_rev = rso_revs.get(file_relpath, cur_rso)
             file_relpath = os.path.relpath(os.path.join(wa_root, file_relpath), os.getcwd())
             file_name = os.path.basename(file_relpath)
 
-            base_filepath = self.generate_temp_filename() + f'__{file_name}.{file_ver}'
-            remote_filepath = self.generate_temp_filename() + f'__{file_name}.{cur_rso}'
-            self.execute_sos_command(['soscmd', 'exportrev'], [f'{file_relpath}', f'-out{base_filepath}'], quiet=True)
-            self.execute_sos_command(['soscmd', 'exportrev'], [f'{file_relpath}/#/{cur_rso}', f'-out{remote_filepath}'], quiet=True)
-            print(f'Merging \'{file_relpath}\'.')
-            subprocess.call([self.merge_tool, base_filepath, file_relpath, remote_filepath, '--auto-merge'], stdout=subprocess.DEVNULL)
+            base_filepath = None if is_unmodified else self.generate_temp_filename() + f'__{file_name}.{file_ver}'
+            remote_filepath = self.generate_temp_filename() + f'__{file_name}.{rso_rev}'
+            merge_list.append((file_relpath, file_ver, rso_rev, base_filepath, remote_filepath))
+
+        # prefetch base and RSO revisions of all files. unmodified files take the RSO revision as is
+        export_list = []
+        for file_relpath, file_ver, rso_rev, base_filepath, remote_filepath in merge_list:
+            if base_filepath:
+                export_list.append((f'{file_relpath}', base_filepath, self.get_rev_cache_filepath(wa_root, file_relpath, file_ver)))
+            export_list.append((f'{file_relpath}/#/{rso_rev}', remote_filepath, self.get_rev_cache_filepath(wa_root, file_relpath, rso_rev) if rso_rev != cur_rso else None))
+        self.export_revisions(export_list)
+
+        clean_filelists = {}
+        for file_relpath, file_ver, rso_rev, base_filepath, remote_filepath in merge_list:
+            if not base_filepath:
+                shutil.copyfile(remote_filepath, file_relpath)
+                os.remove(remote_filepath)
+                clean_filelists.setdefault(rso_rev, []).append(file_relpath)
+                print(f'Merged \'{file_relpath}\' without conflicts, as it is not modified.')
+                continue
+            merged_text, has_conflict = self.merge_files(base_filepath, file_relpath, remote_filepath, rso_rev)
+            if merged_text is not None and not has_conflict:
+                with open(file_relpath, 'wb') as merged_file:
+                    merged_file.write(merged_text)
+                clean_filelists.setdefault(rso_rev, []).append(file_relpath)
+                print(f'Merged \'{file_relpath}\' without conflicts.')
+            elif merged_text is not None and not use_gui:
+                with open(file_relpath, 'wb') as merged_file:
+                    merged_file.write(merged_text)
+                print(f'{bcolors.RED}Merged \'{file_relpath}\' with conflict markers.{bcolors.ENDC} After resolving, record the merge with: soscmd merge -mm -rev{rso_rev} {file_relpath}')
+            elif use_gui:
+                print(f'Merging \'{file_relpath}\'.')
+                subprocess.call([self.merge_tool, base_filepath, file_relpath, remote_filepath, '--auto-merge'], stdout=subprocess.DEVNULL)
+                self.execute_sos_command(['soscmd', 'merge'], ['-mm', f'-rev{rso_rev}', file_relpath])
+            else:
+                print(f'{bcolors.RED}Skipping \'{file_relpath}\' as binary files can only be merged with GUI.{bcolors.ENDC}')
             os.remove(base_filepath)
             os.remove(remote_filepath)
-            self.execute_sos_command(['soscmd', 'merge'], ['-mm', f'-rev{cur_rso}', file_relpath])
+
+        for rso_rev, clean_filelist in clean_filelists.items():
+            for clean_filelist_chunk in self.chunk_paths(clean_filelist):
+                self.execute_sos_command(['soscmd', 'merge'], ['-mm', f'-rev{rso_rev}'] + clean_filelist_chunk)
+
+    def get_rso_revs(self, wa_root, file_paths):
+        # newest revision numbers of the given files, which are the ones selected with -snt.
+        # files missing in the history are left out
+        rso_revs = {}
+        hist_chunks = self.run_parallel([self.execute_sos_command_async(['soscmd', 'history'], ['-fs', '-cmdcreate', '-cmdci'] + paths_chunk, ret_text=True, quiet=True) for paths_chunk in self.chunk_paths(file_paths)])
+        for hist_data in hist_chunks:
+            file_relpath = None
+            for line in hist_data:
+                if line.startswith('History of:'):
+                    file_relpath = os.path.relpath(os.path.join(wa_root, self.remove_prefix(line.split(':', 1)[1].strip(), './')), wa_root)
+                elif line.startswith('Action:') and file_relpath:
+                    for file_attr in line.split(' | '):
+                        attr = file_attr.split(':', 1)
+                        if len(attr) == 2 and attr[0].strip() == 'Revision' and attr[1].strip().isdigit():
+                            rso_revs[file_relpath] = max(rso_revs.get(file_relpath, 0), int(attr[1].strip()))
+        return rso_revs
 
     def mv_sos(self, args):
         self.check_args_count(args, min=2)
         self.setup_user_cache()
+        wa_data_lock = self.lock_wa_data()
         wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
         wa_data = {}
 
@@ -598,8 +1995,8 @@ Bye.''')
         target_dir_relpath = args[-1]
         if os.path.isdir(target_dir_relpath): # process move to dir
             args.pop()
-            self.init_json_hier(wa_data, list, ['file_status', 'move', target_dir])
             target_dir = os.path.relpath(target_dir_relpath, wa_root)
+            self.init_json_hier(wa_data, list, ['file_status', 'move', target_dir])
 
             for arg in args:
                 rel_path = os.path.relpath(arg, wa_root)
@@ -626,37 +2023,409 @@ Bye.''')
             print(f'Adding \'{src_file}\' for rename to \'./{tgt_file}\'.')
 
         # save file status data
-        with open(wa_data_file_path, 'w') as cache_file:
-            json.dump(wa_data, cache_file, indent=2)
+        self.save_wa_data(wa_data_file_path, wa_data, wa_root)
+        wa_data_lock.close()
 
     def pull_sos(self, args):
-        self.execute_sos_command(['soscmd', 'update'], args)
+        parallel = 0
+        start_prefetch = False
+        new_args = []
+        while args:
+            arg = args.pop(0)
+            if arg == '--prefetch':
+                start_prefetch = True
+            elif arg == '--parallel' and args and args[0].isdigit():
+                parallel = int(args.pop(0))
+            elif arg.startswith('--parallel=') and arg[11:].isdigit():
+                parallel = int(arg[11:])
+            else:
+                new_args.append(arg)
+        if parallel > 1:
+            if new_args:
+                print(f'{bcolors.RED}Error: Extra update args are not valid with --parallel.{bcolors.ENDC}')
+                exit(1)
+            self.pull_parallel(parallel)
+        else:
+            self.execute_sos_command(['soscmd', 'update'], new_args)
+        self.rev_cache_fetched(start_prefetch)
+
+    def pull_parallel(self, parallel):
+        wa_root = self.get_wa_root_path()
+        self.fetch_sos([])
+
+        # changed directories have new revisions too, so new and deleted files are covered.
+        # checked out files are left alone by update and so do not need a subtree update
+        nt_filelist, co_filelist = self.run_parallel([
+            self.execute_sos_command_async(['soscmd', 'status'], ['-f%P', '-snt'], ret_text=True, quiet=True),
+            self.execute_sos_command_async(['soscmd', 'status'], ['-f%P', '-sco'], ret_text=True, quiet=True),
+        ])
+        co_paths = {self.remove_prefix(file_path, './') for file_path in co_filelist if not file_path.startswith('*')}
+        changed_paths = []
+        for file_path in nt_filelist:
+            if file_path.startswith('*'):
+                continue
+            file_path = self.remove_prefix(file_path, './').rstrip('/')
+            if file_path not in co_paths:
+                changed_paths.append(file_path)
+        if not changed_paths:
+            print('Workarea is already up to date.')
+            return
+        if any(file_path in ['', '.'] for file_path in changed_paths):
+            print('Workarea root has a new revision, running a single update.')
+            self.execute_sos_command(['soscmd', 'update'], [])
+            return
+
+        subtrees = self.split_subtrees(changed_paths, parallel)
+        print(f'Updating {len(subtrees)} subtrees with {len(changed_paths)} new revisions, {parallel} in parallel.')
+        done_list = []
+
+        async def update_subtree(subtree, semaphore):
+            start_time = time.perf_counter()
+            subtree_relpath = os.path.relpath(os.path.join(wa_root, subtree), os.getcwd())
+            returncode, out_lines = await self.execute_sos_command_async(['soscmd', 'update'], [subtree_relpath], ret_text=True, ret_code=True, chk_err=False, quiet=True, semaphore=semaphore)
+            elapsed = time.perf_counter() - start_time
+            done_list.append((subtree, returncode, elapsed))
+            if returncode:
+                print(f'{bcolors.RED}[{len(done_list)}/{len(subtrees)}] Failed to update \'{subtree}\':{bcolors.ENDC}')
+                print('\n'.join(out_lines))
+            else:
+                print(f'[{len(done_list)}/{len(subtrees)}] Updated \'{subtree}\' in {elapsed:.1f}s.')
+
+        async def update_all():
+            # own limit for the subtree updates, the other commands keep GIT2SOS_JOBS
+            semaphore = asyncio.Semaphore(parallel)
+            await self.gather_tasks([update_subtree(subtree, semaphore) for subtree in sorted(subtrees)])
+        self.run_async(update_all())
+
+        print(f'\n{bcolors.YELLOW}Update time per subtree:{bcolors.ENDC}')
+        failed_count = 0
+        for subtree, returncode, elapsed in sorted(done_list, key=lambda done: done[2], reverse=True):
+            failed_count += 1 if returncode else 0
+            result = f' {bcolors.RED}failed ({returncode}){bcolors.ENDC}' if returncode else ''
+            print(f'  {elapsed:8.1f}s  {len(subtrees[subtree]):6} revisions  ./{subtree}{result}')
+        if failed_count:
+            exit(1)
+
+    def split_subtrees(self, paths, min_groups):
+        # group paths by top-level directory, then split the largest groups deeper
+        # while there are fewer groups than wanted. changed directories are not split
+        path_set = set(paths)
+        subtrees = {}
+        for path in paths:
+            subtree = path.split('/', 1)[0]
+            if subtree not in subtrees:
+                subtrees[subtree] = []
+            subtrees[subtree].append(path)
+        while len(subtrees) < min_groups:
+            split_root = None
+            for subtree in sorted(subtrees, key=lambda subtree: len(subtrees[subtree]), reverse=True):
+                if subtree not in path_set and len(subtrees[subtree]) > 1:
+                    split_root = subtree
+                    break
+            if split_root is None:
+                break
+            depth = split_root.count('/') + 2
+            for path in subtrees.pop(split_root):
+                subtree = '/'.join(path.split('/')[:depth])
+                if subtree not in subtrees:
+                    subtrees[subtree] = []
+                subtrees[subtree].append(path)
+        return subtrees
+
+    def prefetch_sos(self, args):
+        background = False
+        interval = 0
+        while args:
+            arg = args.pop(0)
+            if arg == '--background':
+                background = True
+            elif arg == '--interval' and args and args[0].isdigit():
+                interval = int(args.pop(0))
+            elif arg.startswith('--interval=') and arg[11:].isdigit():
+                interval = int(arg[11:])
+            else:
+                print(f'{bcolors.RED}Error: Unknown prefetch argument: {arg}{bcolors.ENDC}')
+                exit(1)
+        wa_root = self.get_wa_root_path()
+        if background:
+            self.start_prefetch_process(wa_root, ['--interval', str(interval)] if interval else [])
+            return
+
+        # only one prefetch runs for a workarea, the lock is held until exit
+        rev_cache_path = self.get_rev_cache_path(wa_root, create=True)
+        lock_file = open(os.path.join(rev_cache_path, 'prefetch.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print('Revision prefetch is already running for this workarea.')
+            return
+        try:
+            os.nice(10)
+        except OSError:
+            pass
+        self.max_jobs = self.prefetch_jobs
+        self.job_semaphore = None
+        while True:
+            self.prefetch_revisions(wa_root)
+            if not interval:
+                break
+            time.sleep(interval)
+            self.fetch_sos([])
+
+    def prefetch_revisions(self, wa_root):
+        start_time = time.perf_counter()
+        co_filelist, nt_filelist = self.run_parallel([
+            self.execute_sos_command_async(['soscmd', 'status'], ['-f%V %P', '-sco'], ret_text=True, quiet=True),
+            self.execute_sos_command_async(['soscmd', 'status'], ['-f%P', '-sco', '-sand', '-snt'], ret_text=True, quiet=True),
+        ])
+        nt_paths = [os.path.relpath(os.path.join(wa_root, self.remove_prefix(file_path, './')), os.getcwd()) for file_path in nt_filelist if not file_path.startswith('*')]
+        rso_revs = self.get_rso_revs(wa_root, nt_paths) if nt_paths else {}
+
+        # base revisions of checked out files, and RSO revisions of the ones with newer versions
+        self.rev_cache_info = None
+        rev_cache_path = self.get_rev_cache_path(wa_root, create=True)
+        cache_list = {}
+        for file_rev, file_relpath in self.parse_rev_status(co_filelist):
+            file_path = os.path.relpath(os.path.join(wa_root, file_relpath), os.getcwd())
+            if os.path.isdir(file_path):
+                continue
+            cache_list[self.get_rev_cache_filepath(wa_root, file_path, file_rev)] = f'{file_path}/#/{file_rev}'
+            if file_relpath in rso_revs:
+                cache_list[self.get_rev_cache_filepath(wa_root, file_path, rso_revs[file_relpath])] = f'{file_path}/#/{rso_revs[file_relpath]}'
+
+        # revisions prefetched before which are no longer needed are removed. the ones cached by
+        # other commands are kept, readers export a revision again if it is removed while in use
+        manifest_path = os.path.join(rev_cache_path, 'prefetch.json')
+        prefetched = []
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                prefetched = json.load(manifest_file)
+        for cache_filename in prefetched:
+            cache_filepath = os.path.join(rev_cache_path, cache_filename)
+            if cache_filepath not in cache_list and os.path.isfile(cache_filepath):
+                os.remove(cache_filepath)
+        prefetched = {os.path.basename(cache_filepath) for cache_filepath in cache_list if os.path.basename(cache_filepath) in prefetched}
+
+        rate_time = time.monotonic()
+        async def prefetch_rev(rev_path, cache_filepath):
+            nonlocal rate_time
+            tmp_filepath = f'{cache_filepath}.{os.getpid()}.tmp'
+            returncode = await self.execute_sos_command_async(['soscmd', 'exportrev'], [rev_path, f'-out{tmp_filepath}'], ret_code=True, chk_err=False, quiet=True)
+            if returncode or not os.path.isfile(tmp_filepath):
+                print(f'{bcolors.RED}Could not prefetch \'{rev_path}\'.{bcolors.ENDC}')
+                if os.path.isfile(tmp_filepath):
+                    os.remove(tmp_filepath)
+                return 0
+            os.replace(tmp_filepath, cache_filepath)
+            prefetched.add(os.path.basename(cache_filepath))
+            if self.prefetch_rate:
+                rate_time = max(rate_time, time.monotonic()) + os.path.getsize(cache_filepath) / (self.prefetch_rate * 1024)
+                await asyncio.sleep(rate_time - time.monotonic())
+            return 1
+        missing_list = [(rev_path, cache_filepath) for cache_filepath, rev_path in cache_list.items() if not os.path.isfile(cache_filepath)]
+        try:
+            done_count = sum(self.run_parallel([prefetch_rev(rev_path, cache_filepath) for rev_path, cache_filepath in missing_list]))
+        finally:
+            with open(f'{manifest_path}.{os.getpid()}', 'w') as manifest_file:
+                json.dump(sorted(prefetched), manifest_file)
+            os.replace(f'{manifest_path}.{os.getpid()}', manifest_path)
+        print(f'{datetime.datetime.now():%Y/%m/%d %H:%M:%S} Prefetched {done_count} revisions in {time.perf_counter() - start_time:.1f}s, {len(cache_list) - len(missing_list)} were already cached.')
 
     def push_sos(self, args):
-        # prepare data structures
+        background = '--background' in args
+        args = [arg for arg in args if arg != '--background']
         self.setup_user_cache()
+        wa_root = self.get_wa_root_path()
+        journal_path = os.path.join(self.cache_path, f'push_{hashlib.sha1(wa_root.encode()).hexdigest()[:16]}.json')
+        if '--status' in args:
+            self.push_status(journal_path, self.load_push_journal(journal_path))
+            return
+
+        # the journal lock is held from reading the journal until the push is done, so that a push runs only once
+        lock_file = open(journal_path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print(f'{bcolors.RED}Error: The push is still running. Check with push --status.{bcolors.ENDC}')
+            exit(1)
+        journal = self.load_push_journal(journal_path)
+        if '--abort' in args or '--resume' in args:
+            if not journal or journal['status'] == 'done':
+                print('No push to continue.')
+            elif '--abort' in args:
+                os.remove(journal_path)
+                print('Dropped the push. Commands which were done are not reverted.')
+            else:
+                self.push_run(journal_path, journal, lock_file, background)
+            return
+        if journal and journal['status'] != 'done':
+            print(f'{bcolors.RED}Error: Last push is not complete. Check with push --status, then use push --resume or push --abort.{bcolors.ENDC}')
+            exit(1)
+        self.check_args_count(args, max=0) # all changes are pushed at once
+
+        # prepare data structures. the file status is read under its lock, later changes stay pending
+        wa_data_lock = self.lock_wa_data()
         wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
         wa_data = {}
 
         if os.path.isfile(wa_data_file_path) and os.path.getsize(wa_data_file_path):
             with open(wa_data_file_path, 'r') as cache_file:
                 wa_data = json.load(cache_file)
-        wa_root = self.get_wa_root_path()
         self.init_json_hier(wa_data, dict, ['file_status'])
 
         ## prepare check-in
         tmp_filepath = self.generate_temp_filename()
         self.push_prepare(args, wa_root, wa_data, tmp_filepath)
+        wa_data_lock.close()
 
         # get description from user
         subprocess.call(['vi', tmp_filepath])
 
         #process user's data
-        self.push_action(args, wa_root, wa_data, tmp_filepath)
+        user_desc, push_steps = self.push_action(args, wa_root, wa_data, tmp_filepath)
+        journal = {
+            'wa_root': wa_root,
+            'created': datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
+            'description': user_desc,
+            'status': 'queued',
+            'steps': push_steps,
+        }
+        self.save_push_journal(journal_path, journal)
+        self.push_run(journal_path, journal, lock_file, background)
+
+    def push_run(self, journal_path, journal, lock_file, background):
+        if background:
+            lock_file.close() # taken again by the detached process
+            log_filepath = self.remove_suffix(journal_path, '.json') + '.log'
+            push_env = dict(os.environ)
+            push_env.pop('GIT2SOS_RECORD', None)
+            push_env.setdefault('GIT2SOS_PUSH_RETRIES', '2')
+            with open(log_filepath, 'a') as log_file:
+                subprocess.Popen([sys.executable, self.get_script_path(), 'push', '--resume'], cwd=os.getcwd(), env=push_env, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+            print(f'Started push in background, logging to \'{log_filepath}\'. Check progress with push --status.')
+            return
 
-        # save file status data
-        with open(wa_data_file_path, 'w') as cache_file:
+        os.chdir(journal['wa_root']) # paths in the journal are relative to the workarea root
+        journal['status'] = 'running'
+        journal['pid'] = os.getpid()
+        self.save_push_journal(journal_path, journal)
+
+        for step in journal['steps']:
+            if step['done']:
+                self.apply_push_state(step['state']) # may not be saved if stopped before
+                continue
+            for attempt in range(self.push_retries + 1):
+                if attempt:
+                    time.sleep(5 * 2 ** (attempt - 1))
+                step['attempts'] += 1
+                returncode = self.execute_sos_command(['soscmd'], step['args'], ret_code=True, chk_err=False)
+                if not returncode:
+                    break
+                step['error'] = f'soscmd {step["args"][0]} returned {returncode}'
+                self.save_push_journal(journal_path, journal)
+            else:
+                journal['status'] = 'failed'
+                self.save_push_journal(journal_path, journal)
+                print(f'{bcolors.RED}Error: Push failed: {step["error"]}. Continue with push --resume after fixing the issue, or drop it with push --abort.{bcolors.ENDC}')
+                exit(1)
+            # the step is saved as done before the state, since the state update can be repeated
+            step['done'] = True
+            step['error'] = ''
+            self.save_push_journal(journal_path, journal)
+            self.apply_push_state(step['state'])
+        journal['status'] = 'done'
+        self.save_push_journal(journal_path, journal)
+        print('Push is complete.')
+
+    def push_status(self, journal_path, journal):
+        if not journal:
+            print('No push was done in this workarea.')
+            return
+        status = journal['status']
+        if status in ['queued', 'running'] and not self.is_push_running(journal_path):
+            status = 'interrupted'
+        done_count = sum(1 for step in journal['steps'] if step['done'])
+        print(f'Push created at {journal["created"]}: {status}, {done_count} of {len(journal["steps"])} commands done.')
+        print(f'    {journal["description"].splitlines()[0]}')
+        for step in journal['steps']:
+            step_paths = [arg for arg in step['args'][1:] if not arg.startswith('-')]
+            step_text = ' '.join(['soscmd', step['args'][0]] + step_paths[:3]) + (f' ... ({len(step_paths)} paths)' if len(step_paths) > 3 else '')
+            if step['done']:
+                print(f'  {bcolors.GRAY}[done   ]{bcolors.ENDC} {step_text}')
+            elif step['error']:
+                print(f'  {bcolors.RED}[failed ]{bcolors.ENDC} {step_text} {bcolors.RED}({step["error"]}, {step["attempts"]} attempts){bcolors.ENDC}')
+            else:
+                print(f'  [pending] {step_text}')
+        log_filepath = self.remove_suffix(journal_path, '.json') + '.log'
+        if os.path.isfile(log_filepath):
+            print(f'Background push log: \'{log_filepath}\'')
+
+    def is_push_running(self, journal_path):
+        with open(journal_path + '.lock', 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+        return False
+
+    def load_push_journal(self, journal_path):
+        if not os.path.isfile(journal_path):
+            return None
+        with open(journal_path, 'r') as journal_file:
+            return json.load(journal_file)
+
+    def save_push_journal(self, journal_path, journal):
+        # written to a temp file and synced before replacing, so a crash keeps the last complete journal
+        tmp_filepath = f'{journal_path}.{os.getpid()}'
+        with open(tmp_filepath, 'w') as journal_file:
+            json.dump(journal, journal_file, indent=2)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_filepath, journal_path)
+
+    def apply_push_state(self, state):
+        # removes pushed files from the cache state. repeating it has no effect
+        if not state:
+            return
+        self.setup_user_cache()
+        wa_data_lock = self.lock_wa_data()
+        wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
+        wa_data = {}
+        if os.path.isfile(wa_data_file_path) and os.path.getsize(wa_data_file_path):
+            with open(wa_data_file_path, 'r') as cache_file:
+                wa_data = json.load(cache_file)
+        self.init_json_hier(wa_data, dict, ['file_status'])
+        file_status = wa_data['file_status']
+        if state[0] in ['delete', 'create'] and state[0] in file_status:
+            pushed_files = set(state[1])
+            file_status[state[0]] = [file for file in file_status[state[0]] if file not in pushed_files]
+        elif state[0] == 'move' and 'move' in file_status:
+            if state[1] in file_status['move']:
+                pushed_files = set(state[2])
+                file_status['move'][state[1]] = [file for file in file_status['move'][state[1]] if file not in pushed_files]
+            for tgt_dir in [tgt_dir for tgt_dir in file_status['move'] if not file_status['move'][tgt_dir]]:
+                del file_status['move'][tgt_dir]
+        elif state[0] == 'rename' and 'rename' in file_status:
+            for file in state[1]:
+                file_status['rename'].pop(file, None)
+        self.save_wa_data(wa_data_file_path, wa_data)
+        wa_data_lock.close()
+
+    def lock_wa_data(self):
+        # held from loading the file status until it is saved, as a background push
+        # updates it while other commands run
+        lock_file = open(os.path.join(self.cache_path, self.wa_data_file + '.lock'), 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def save_wa_data(self, wa_data_file_path, wa_data, wa_root=None):
+        # replaced as a whole, so that commands reading it without the lock get a complete file
+        tmp_filepath = f'{wa_data_file_path}.{os.getpid()}'
+        with open(tmp_filepath, 'w') as cache_file:
             json.dump(wa_data, cache_file, indent=2)
+        os.replace(tmp_filepath, wa_data_file_path)
+        if wa_root:
+            self.register_workarea(wa_root)
 
     def push_prepare(self, args, wa_root, wa_data, tmp_filepath):
         commit_text  = '''
@@ -671,7 +2440,7 @@ Bye.''')
 #
 #
 '''
-        cur_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%P', '-sco'], ret_text=True, quiet=True)
+        cur_filelist = self.execute_sos_command_iter(['soscmd', 'status'], ['-f%P', '-sco'], quiet=True)
         sel_filelist = []
         for file in cur_filelist:
             if file.startswith('*'):
@@ -794,61 +2563,50 @@ Bye.''')
             exit(1)
         user_desc = '\n'.join(user_desc)
 
-        # process operations and commit files
+        # plan the SOS commands, with paths relative to workarea root. each
+        # command has the cache state update to do once it is done
+        for list_mode in ['checkin', 'delete', 'create']:
+            sel_filelist[list_mode] = [os.path.relpath(file, wa_root) for file in sel_filelist[list_mode]]
+        push_steps = []
         if sel_filelist['checkin']:
-            self.execute_sos_command(['soscmd', 'ci'], ['-D', f'-aLog={user_desc}'] + sel_filelist['checkin'])
+            push_steps.append(self.new_push_step(['ci', '-D', f'-aLog={user_desc}'] + sel_filelist['checkin']))
         if sel_filelist['delete']:
-            self.execute_sos_command(['soscmd', 'delete'], sel_filelist['delete'])
-            for file in sel_filelist['delete']:
-                file = os.path.relpath(file, wa_root)
-                if file in wa_data['file_status']['delete']:
-                    wa_data['file_status']['delete'].remove(file)
-        if sel_filelist['move']:
-            for tgt_dir in sel_filelist['move']:
-                co_dir_list = [tgt_dir]
-                for file in sel_filelist['move'][tgt_dir]:
-                    dir_of_file = os.path.dirname(file)
-                    if dir_of_file not in co_dir_list:
-                        co_dir_list.append(dir_of_file)
-                self.execute_sos_command(['soscmd', 'co'], ['-C'] + co_dir_list)
-                self.execute_sos_command(['soscmd', 'move'], sel_filelist['move'][tgt_dir] + [tgt_dir])
-                self.execute_sos_command(['soscmd', 'ci'], [f'-aLog={user_desc}'] + co_dir_list)
-                for file in sel_filelist['move'][tgt_dir]:
-                    file = os.path.relpath(file, wa_root)
-                    tgt_dir_rel = os.path.relpath(tgt_dir, wa_root)
-                    if file in wa_data['file_status']['move'][tgt_dir_rel]:
-                        wa_data['file_status']['move'][tgt_dir_rel].remove(file)
-        if 'move' in wa_data['file_status']:
-            rem_list = []
-            for tgt_dir in wa_data['file_status']['move']:
-                if not wa_data['file_status']['move'][tgt_dir]:
-                    rem_list.append(tgt_dir)
-            for tgt_dir in rem_list:
-                del wa_data['file_status']['move'][tgt_dir]
+            push_steps.append(self.new_push_step(['delete'] + sel_filelist['delete'], ['delete', sel_filelist['delete']]))
+        for tgt_dir in sel_filelist['move']:
+            move_filelist = [os.path.relpath(file, wa_root) for file in sel_filelist['move'][tgt_dir]]
+            tgt_dir = os.path.relpath(tgt_dir, wa_root)
+            if not move_filelist:
+                continue
+            co_dir_list = [tgt_dir]
+            for file in move_filelist:
+                dir_of_file = os.path.dirname(file) or '.'
+                if dir_of_file not in co_dir_list:
+                    co_dir_list.append(dir_of_file)
+            push_steps.append(self.new_push_step(['co', '-C'] + co_dir_list))
+            push_steps.append(self.new_push_step(['move'] + move_filelist + [tgt_dir]))
+            push_steps.append(self.new_push_step(['ci', f'-aLog={user_desc}'] + co_dir_list, ['move', tgt_dir, move_filelist]))
         if sel_filelist['rename']:
+            rename_filelist = {os.path.relpath(src_file, wa_root): os.path.relpath(tgt_file, wa_root) for src_file, tgt_file in sel_filelist['rename'].items()}
             co_dir_list = []
-            for src_file in sel_filelist['rename']:
-                dir_of_file = os.path.dirname(src_file)
-                if dir_of_file and dir_of_file not in co_dir_list:
+            for src_file in rename_filelist:
+                dir_of_file = os.path.dirname(src_file) or '.'
+                if dir_of_file not in co_dir_list:
                     co_dir_list.append(dir_of_file)
-            self.execute_sos_command(['soscmd', 'co'], ['-C'] + co_dir_list)
-            for src_file in sel_filelist['rename']:
-                self.execute_sos_command(['soscmd', 'rename'], [src_file, sel_filelist['rename'][src_file]])
-            self.execute_sos_command(['soscmd', 'ci'], [f'-aLog={user_desc}'] + co_dir_list)
-            for file in sel_filelist['rename']:
-                file = os.path.relpath(file, wa_root)
-                if file in wa_data['file_status']['rename']:
-                    del wa_data['file_status']['rename'][file]
+            push_steps.append(self.new_push_step(['co', '-C'] + co_dir_list))
+            for src_file in rename_filelist:
+                push_steps.append(self.new_push_step(['rename', src_file, rename_filelist[src_file]]))
+            push_steps.append(self.new_push_step(['ci', f'-aLog={user_desc}'] + co_dir_list, ['rename', list(rename_filelist.keys())]))
         if sel_filelist['create']:
-            self.execute_sos_command(['soscmd', 'create'], [f'-aDescription={user_desc}'] + sel_filelist['create'])
-            for file in sel_filelist['create']:
-                file = os.path.relpath(file, wa_root)
-                if file in wa_data['file_status']['create']:
-                    wa_data['file_status']['create'].remove(file)
+            push_steps.append(self.new_push_step(['create', f'-aDescription={user_desc}'] + sel_filelist['create'], ['create', sel_filelist['create']]))
+        return user_desc, push_steps
+
+    def new_push_step(self, step_args, state=None):
+        return {'args': step_args, 'state': state, 'done': False, 'attempts': 0, 'error': ''}
 
     def rm_sos(self, args):
         self.check_args_count(args, min=1)
         self.setup_user_cache()
+        wa_data_lock = self.lock_wa_data()
         wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
         wa_data = {}
 
@@ -867,8 +2625,8 @@ Bye.''')
                 print(f'Skipping \'{arg}\' for delete as it is already listed.')
 
         # save file status data
-        with open(wa_data_file_path, 'w') as cache_file:
-            json.dump(wa_data, cache_file, indent=2)
+        self.save_wa_data(wa_data_file_path, wa_data, wa_root)
+        wa_data_lock.close()
 
     def stash_sos(self, args):
         if len(args):
@@ -907,32 +2665,48 @@ Bye.''')
 
         # process checked out files
         co_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%V %P', '-sco'], ret_text=True, quiet=True)
+        co_filelist = self.parse_rev_status(co_filelist)
+        unmodified_paths = self.get_unmodified_files(wa_root, co_filelist)
+        diff_paths = [file_data[1] for file_data in co_filelist if file_data[1] not in unmodified_paths]
+        diff_data_list = self.run_parallel([self.stash_diff_file(os.path.relpath(os.path.join(wa_root, file_path), os.getcwd())) for file_path in diff_paths])
+        diff_data_map = dict(zip(diff_paths, diff_data_list))
         for file_data in co_filelist:
-            if file_data.startswith('*'):
-                continue
-            file_data = file_data.split()
             file_rev = file_data[0]
             file_path = file_data[1]
-            file_relpath = os.path.relpath(os.path.join(wa_root, file_path), os.getcwd())
-            tmp_filepath = self.generate_temp_filename()
-            self.execute_sos_command(['soscmd', 'exportrev'], [file_relpath, f'-out{tmp_filepath}'], quiet=True)
-            diff_data = self.execute_sos_command(['diff'], ['-au', tmp_filepath, file_relpath], ret_text=True, chk_err=False, quiet=True)
-            os.remove(tmp_filepath)
+            diff_data = diff_data_map.get(file_path, [])
             stash_txt += f'# checkout ./{file_path} {file_rev}\n'
             stash_txt += '\n'.join(diff_data)
             stash_txt += '\n'
             print(f'  {bcolors.GRAY}[checkout ]{bcolors.ENDC} \'{file_path}\'')
 
+        # the stash is written to a temp file, and files for create are copied into it as raw bytes
+        # after a header with their size and sha1
+        tmp_stash_path = os.path.join(self.cache_path, f'.{stash_file_name}.{os.getpid()}')
+        tmp_stash_file = open(tmp_stash_path, 'wb')
+        tmp_stash_file.write(stash_txt.encode(errors='surrogateescape'))
+        stash_txt = ''
+
         #process cached data of files
         if 'create' in wa_data['file_status']:
             for file_path in wa_data['file_status']['create']:
                 file_relpath = os.path.relpath(os.path.join(wa_root, file_path), os.getcwd())
-                with open(file_relpath, 'r') as cr_file:
-                    file_text = cr_file.read()
-                    line_count = file_text.count('\n')
-                    stash_txt += f'# create ./{file_path} {line_count}\n'
-                    stash_txt += file_text
-                    print(f'  {bcolors.GRAY}[create   ]{bcolors.ENDC} \'./{file_path}\'')
+                hash_data = self.hash_file(file_relpath)
+                if not hash_data:
+                    print(f'{bcolors.RED}Error: Could not read \'{file_relpath}\' for create.{bcolors.ENDC}')
+                    tmp_stash_file.close()
+                    os.remove(tmp_stash_path)
+                    exit(1)
+                tmp_stash_file.write(f'# create ./{file_path} {hash_data[0]} {hash_data[1]}\n'.encode(errors='surrogateescape'))
+                tmp_stash_file.flush()
+                try:
+                    with open(file_relpath, 'rb') as cr_file:
+                        self.copy_file_data(cr_file.fileno(), tmp_stash_file.fileno(), hash_data[0], 0)
+                except BaseException:
+                    tmp_stash_file.close()
+                    os.remove(tmp_stash_path)
+                    raise
+                tmp_stash_file.write(b'\n')
+                print(f'  {bcolors.GRAY}[create   ]{bcolors.ENDC} \'./{file_path}\'')
         if 'delete' in wa_data['file_status']:
             for file_path in wa_data['file_status']['delete']:
                 stash_txt += f'# delete ./{file_path}\n'
@@ -949,9 +2723,45 @@ Bye.''')
         stash_txt += f'# info Marker : End of stash\n'
 
         # save the stash data
-        with open(stash_file_path, 'w') as tmp_file:
-            tmp_file.write(stash_txt)
-            print(f'Created stash \'{stash_file_name}\'')
+        tmp_stash_file.write(stash_txt.encode(errors='surrogateescape'))
+        tmp_stash_file.close()
+        os.replace(tmp_stash_path, stash_file_path)
+        print(f'Created stash \'{stash_file_name}\'')
+
+    def copy_file_data(self, src_fd, dst_fd, size, src_offset):
+        # copies size bytes from src_offset to the current position of dst_fd inside the kernel, without
+        # reading them into python. sendfile and then plain reads are used where copy_file_range is not supported
+        copied = 0
+        while copied < size:
+            try:
+                count = os.copy_file_range(src_fd, dst_fd, size - copied, src_offset + copied)
+            except (AttributeError, OSError):
+                try:
+                    count = os.sendfile(dst_fd, src_fd, src_offset + copied, size - copied)
+                except OSError:
+                    count = os.write(dst_fd, os.pread(src_fd, min(size - copied, 1 << 20), src_offset + copied))
+            if not count:
+                raise OSError(f'File is shorter than {size} bytes.')
+            copied += count
+
+    def stash_copy_created(self, ctx_data, dest_file_path):
+        # copies a created file out of the stash and checks its sha1
+        with open(ctx_data['stash_path'], 'rb') as stash_file, open(dest_file_path, 'wb') as dest_file:
+            self.copy_file_data(stash_file.fileno(), dest_file.fileno(), ctx_data['size'], ctx_data['offset'])
+        hash_data = self.hash_file(dest_file_path)
+        if not hash_data or hash_data[1] != ctx_data['hash']:
+            print(f'{bcolors.RED}Error: Checksum of #\'{ctx_data["file"]}\' does not match the stash.{bcolors.ENDC}')
+            os.remove(dest_file_path)
+            ctx_data['has_error'] = True
+            return False
+        return True
+
+    async def stash_diff_file(self, file_relpath):
+        tmp_filepath = self.generate_temp_filename()
+        await self.execute_sos_command_async(['soscmd', 'exportrev'], [file_relpath, f'-out{tmp_filepath}'], quiet=True)
+        diff_data = await self.execute_sos_command_async(['diff'], ['-au', tmp_filepath, file_relpath], ret_text=True, chk_err=False, quiet=True)
+        os.remove(tmp_filepath)
+        return diff_data
 
     def stash_list(self, args):
         self.setup_user_cache()
@@ -962,9 +2772,9 @@ Bye.''')
             if not os.path.isfile(file_path) or not file_name.startswith('stash_'):
                 continue
             stash_time, stash_desc = ('',) * 2
-            with open(file_path) as stash_file:
+            with open(file_path, errors='surrogateescape') as stash_file:
                 for line in stash_file:
-                    if not line.startswith('#'):
+                    if not line.startswith('# info '): # created files can be binary
                         break
                     if line.startswith('# info Created '):
                         stash_time = ' '.join(line.split()[4:])
@@ -1014,18 +2824,16 @@ Bye.''')
         wa_root = self.get_wa_root_path()
         pop_has_error = False # may use this for cleanup
         merge_mode = 'user'
-        with open(stash_path) as stash_file:
+        ctx_list = []
+        with open(stash_path, 'rb') as stash_file:
             ctx_data = {}
             txt_counter = 0
-            for line in stash_file:
+            for line in iter(stash_file.readline, b''):
+                line = line.decode(errors='surrogateescape')
                 if not txt_counter and line.startswith('#'):
-                    # process previous command
+                    # the previous command is complete
                     if ctx_data:
-                        self.stash_pop_process(ctx_data)
-                        if ctx_data['has_error']:
-                            pop_has_error = True
-                        if ctx_data['merge_mode'] in ['sa', 'ga', 'wa']:
-                            merge_mode = ctx_data['merge_mode']
+                        ctx_list.append(ctx_data)
 
                     # start next command
                     line_parts = line.strip().split()
@@ -1037,15 +2845,21 @@ Bye.''')
                         'file': line_parts[2],
                         'txt': '',
                         'wa_root': wa_root,
+                        'stash_path': stash_path,
                         'apply': apply,
                         'has_error': False,
-                        'merge_mode': merge_mode
                     }
                     if line_parts[1] == 'info':
                         ctx_data['info'] = ' '.join(line_parts[4:])
                     elif line_parts[1] == 'checkout':
                         ctx_data['rev'] = line_parts[3]
-                    elif line_parts[1] == 'create':
+                    elif line_parts[1] == 'create' and len(line_parts) > 4:
+                        # the file is read from the stash when it is applied
+                        ctx_data['size'] = int(line_parts[3])
+                        ctx_data['hash'] = line_parts[4]
+                        ctx_data['offset'] = stash_file.tell()
+                        stash_file.seek(ctx_data['size'] + 1, os.SEEK_CUR)
+                    elif line_parts[1] == 'create': # text with a line count, from older stashes
                         ctx_data['count'] = line_parts[3]
                         txt_counter = int(ctx_data['count'])
                     elif line_parts[1] == 'move':
@@ -1057,56 +2871,104 @@ Bye.''')
                     if txt_counter > 0:
                         txt_counter -= 1
 
+        prescan_done = not apply
+        for ctx_data in ctx_list:
+            if ctx_data['mode'] == 'checkout' and not prescan_done:
+                self.stash_prescan([ctx_data for ctx_data in ctx_list if ctx_data['mode'] == 'checkout'])
+                prescan_done = True
+            ctx_data['merge_mode'] = merge_mode
+            self.stash_pop_process(ctx_data)
+            if ctx_data['has_error']:
+                pop_has_error = True
+            if ctx_data['merge_mode'] in ['sa', 'ga', 'wa']:
+                merge_mode = ctx_data['merge_mode']
+
+    def stash_prescan(self, ctx_list):
+        # dry-runs the patches of all checked out files in parallel and applies the clean ones together, so
+        # that only the files with conflicts are left for stash_pop_process. each ctx_data gets its 'scan' result
+        scan_list = []
+        for ctx_data in ctx_list:
+            dest_file_path = os.path.relpath(os.path.join(ctx_data['wa_root'], ctx_data['file']), os.getcwd())
+            if not os.path.exists(dest_file_path):
+                ctx_data['scan'] = 'missing'
+                continue
+            scan_list.append((ctx_data, dest_file_path))
+            if not ctx_data['txt'].strip(): # checked out without changes, there is nothing to patch
+                ctx_data['scan'] = 'clean'
+                continue
+            ctx_data['diff_file'] = self.generate_temp_filename()
+            with open(ctx_data['diff_file'], 'w', errors='surrogateescape') as tmp_file:
+                tmp_file.write(ctx_data['txt'])
+        patch_list = [(ctx_data, dest_file_path) for ctx_data, dest_file_path in scan_list if 'diff_file' in ctx_data]
+        ret_codes = self.run_parallel([self.execute_sos_command_async(['patch'], self.stash_patch_args + ['--dry-run', dest_file_path, ctx_data['diff_file']], ret_code=True, chk_err=False, quiet=True) for ctx_data, dest_file_path in patch_list])
+        for (ctx_data, _), ret_code in zip(patch_list, ret_codes):
+            ctx_data['scan'] = 'conflict' if ret_code else 'clean'
+
+        scan_counts = {scan: len([ctx_data for ctx_data in ctx_list if ctx_data['scan'] == scan]) for scan in ['clean', 'conflict', 'missing']}
+        print(f'Checked out files in stash: {scan_counts["clean"]} clean, {scan_counts["conflict"]} with conflicts, {scan_counts["missing"]} missing.')
+        for ctx_data in ctx_list:
+            if ctx_data['scan'] == 'conflict':
+                print(f'  {bcolors.GRAY}[conflict ]{bcolors.ENDC} \'{ctx_data["file"]}\'')
+            elif ctx_data['scan'] == 'missing':
+                print(f'  {bcolors.GRAY}[missing  ]{bcolors.ENDC} \'{ctx_data["file"]}\'')
+
+        clean_list = [(ctx_data, dest_file_path) for ctx_data, dest_file_path in scan_list if ctx_data['scan'] == 'clean']
+        if clean_list:
+            self.add_sos([dest_file_path for _, dest_file_path in clean_list]) # make files writable
+            clean_list = [(ctx_data, dest_file_path) for ctx_data, dest_file_path in clean_list if 'diff_file' in ctx_data]
+            ret_codes = self.run_parallel([self.execute_sos_command_async(['patch'], self.stash_patch_args + [dest_file_path, ctx_data['diff_file']], ret_code=True, chk_err=False, quiet=True) for ctx_data, dest_file_path in clean_list])
+            for (ctx_data, _), ret_code in zip(clean_list, ret_codes):
+                if ret_code:
+                    print(f'{bcolors.RED}Error: Could not apply changes in #\'{ctx_data["file"]}\'.{bcolors.ENDC}')
+                    ctx_data['has_error'] = True
+                else:
+                    print(f'Merged changes in #\'{ctx_data["file"]}\'.')
+                os.remove(ctx_data['diff_file'])
+
     def stash_pop_process(self, ctx_data):
         if   ctx_data['mode'] == 'info':
             print(f'{bcolors.YELLOW}{ctx_data["file"]:15} : {ctx_data["info"]}{bcolors.ENDC}')
         elif ctx_data['mode'] == 'checkout':
-            patch_args = ['--merge=diff3', '--no-backup-if-mismatch', '-uNt']
+            patch_args = self.stash_patch_args
             if ctx_data['apply']:
-                dest_file_path = os.path.relpath(os.path.join(ctx_data['wa_root'], ctx_data['file']), os.getcwd())
-                if not os.path.exists(dest_file_path):
-                    print(f'Skipping checkout for #\'{ctx_data["file"]}\' as it does not exist.')
+                # stash_prescan applied the clean files, the ones left have conflicts
+                if ctx_data['scan'] != 'conflict':
                     return
+                dest_file_path = os.path.relpath(os.path.join(ctx_data['wa_root'], ctx_data['file']), os.getcwd())
                 self.add_sos([dest_file_path]) # make file writable
 
-                diff_file_path = self.generate_temp_filename()
-                with open(diff_file_path, 'w') as tmp_file:
-                    tmp_file.write(ctx_data['txt'])
-                ret_code = self.execute_sos_command(['patch'], patch_args + ['--dry-run', dest_file_path, diff_file_path], ret_code=True, chk_err=False, quiet=True)
-                if ret_code:
-                    print(f'Merging #\'{ctx_data["file"]}\' returned conflict(s).')
-                    ctx_data['has_error'] = True
-                    user_merge_opt = None
-                    if ctx_data['merge_mode'] == 'user':
-                       merge_opt_prompt  = f'\nSelect the mode to resolve merge conflict(s):\n'
-                       merge_opt_prompt += f'{bcolors.YELLOW}g{bcolors.ENDC}  : Use GUI to resolve conflicts (default).\n'
-                       merge_opt_prompt += f'{bcolors.YELLOW}ga{bcolors.ENDC} : Use GUI to resolve all files with conflicts.\n'
-                       merge_opt_prompt += f'{bcolors.YELLOW}w{bcolors.ENDC}  : Write merge markers to file.\n'
-                       merge_opt_prompt += f'{bcolors.YELLOW}wa{bcolors.ENDC} : Write merge markers for all files with conflicts.\n'
-                       merge_opt_prompt += f'{bcolors.YELLOW}s{bcolors.ENDC}  : Skip resolving this file.\n'
-                       merge_opt_prompt += f'{bcolors.YELLOW}sa{bcolors.ENDC} : Skip resolving for all files with conflicts.\n'
-                       merge_opt_prompt += f'Select mode (g): '
-                       ctx_data['merge_mode'] = input(merge_opt_prompt)
-                    ctx_data['merge_mode'] = ctx_data['merge_mode'].strip()
-                    if   ctx_data['merge_mode'] in ['s', 'sa']:
-                        print(f'Skipping #\'{ctx_data["file"]}\' for merge.')
-                    elif ctx_data['merge_mode'] in ['w', 'wa']:
-                        self.execute_sos_command(['patch'], patch_args + [dest_file_path, diff_file_path], chk_err=False, quiet=True)
-                        print(f'Merged #\'{ctx_data["file"]}\' with conflicts.')
-                    else:
-                        file_name = os.path.basename(ctx_data['file'])
-                        base_filepath = self.generate_temp_filename() + f'__{file_name}.base'
-                        remote_filepath = self.generate_temp_filename() + f'__{file_name}.stash'
-                        self.execute_sos_command(['soscmd', 'exportrev'], [f'{dest_file_path}', f'-out{base_filepath}'], quiet=True)
-                        self.execute_sos_command(['soscmd', 'exportrev'], [f'{dest_file_path}/#/{ctx_data["rev"]}', f'-out{remote_filepath}'], quiet=True)
-                        self.execute_sos_command(['patch'], patch_args + [remote_filepath, diff_file_path], chk_err=False, quiet=True)
-
-                        subprocess.call([self.merge_tool, base_filepath, dest_file_path, remote_filepath, '--auto-merge'], stdout=subprocess.DEVNULL)
-                        os.remove(base_filepath)
-                        os.remove(remote_filepath)
-                        print(f'Merged #\'{ctx_data["file"]}\'.')
+                diff_file_path = ctx_data['diff_file']
+                print(f'Merging #\'{ctx_data["file"]}\' returned conflict(s).')
+                ctx_data['has_error'] = True
+                user_merge_opt = None
+                if ctx_data['merge_mode'] == 'user':
+                   merge_opt_prompt  = f'\nSelect the mode to resolve merge conflict(s):\n'
+                   merge_opt_prompt += f'{bcolors.YELLOW}g{bcolors.ENDC}  : Use GUI to resolve conflicts (default).\n'
+                   merge_opt_prompt += f'{bcolors.YELLOW}ga{bcolors.ENDC} : Use GUI to resolve all files with conflicts.\n'
+                   merge_opt_prompt += f'{bcolors.YELLOW}w{bcolors.ENDC}  : Write merge markers to file.\n'
+                   merge_opt_prompt += f'{bcolors.YELLOW}wa{bcolors.ENDC} : Write merge markers for all files with conflicts.\n'
+                   merge_opt_prompt += f'{bcolors.YELLOW}s{bcolors.ENDC}  : Skip resolving this file.\n'
+                   merge_opt_prompt += f'{bcolors.YELLOW}sa{bcolors.ENDC} : Skip resolving for all files with conflicts.\n'
+                   merge_opt_prompt += f'Select mode (g): '
+                   ctx_data['merge_mode'] = input(merge_opt_prompt)
+                ctx_data['merge_mode'] = ctx_data['merge_mode'].strip()
+                if   ctx_data['merge_mode'] in ['s', 'sa']:
+                    print(f'Skipping #\'{ctx_data["file"]}\' for merge.')
+                elif ctx_data['merge_mode'] in ['w', 'wa']:
+                    self.execute_sos_command(['patch'], patch_args + [dest_file_path, diff_file_path], chk_err=False, quiet=True)
+                    print(f'Merged #\'{ctx_data["file"]}\' with conflicts.')
                 else:
-                    print(f'Merged changes in #\'{ctx_data["file"]}\'.')
+                    file_name = os.path.basename(ctx_data['file'])
+                    base_filepath = self.generate_temp_filename() + f'__{file_name}.base'
+                    remote_filepath = self.generate_temp_filename() + f'__{file_name}.stash'
+                    self.execute_sos_command(['soscmd', 'exportrev'], [f'{dest_file_path}', f'-out{base_filepath}'], quiet=True)
+                    self.execute_sos_command(['soscmd', 'exportrev'], [f'{dest_file_path}/#/{ctx_data["rev"]}', f'-out{remote_filepath}'], quiet=True)
+                    self.execute_sos_command(['patch'], patch_args + [remote_filepath, diff_file_path], chk_err=False, quiet=True)
+
+                    subprocess.call([self.merge_tool, base_filepath, dest_file_path, remote_filepath, '--auto-merge'], stdout=subprocess.DEVNULL)
+                    os.remove(base_filepath)
+                    os.remove(remote_filepath)
+                    print(f'Merged #\'{ctx_data["file"]}\'.')
                 os.remove(diff_file_path)
             else:
                 file_name = os.path.basename(ctx_data['file'])
@@ -1117,11 +2979,12 @@ Bye.''')
                 self.execute_sos_command(['soscmd', 'exportrev'], [f'{dest_relpath}/#/{ctx_data["rev"]}', f'-out{tmp_ref_file_path}'], quiet=True)
                 shutil.copyfile(tmp_ref_file_path, dest_file_path)
 
-                diff_file_path = self.generate_temp_filename()
-                with open(diff_file_path, 'w') as tmp_file:
-                    tmp_file.write(ctx_data['txt'])
-                ret_code = self.execute_sos_command(['patch'], patch_args + [dest_file_path, diff_file_path], ret_code=True, quiet=True)
-                os.remove(diff_file_path)
+                if ctx_data['txt'].strip():
+                    diff_file_path = self.generate_temp_filename()
+                    with open(diff_file_path, 'w', errors='surrogateescape') as tmp_file:
+                        tmp_file.write(ctx_data['txt'])
+                    ret_code = self.execute_sos_command(['patch'], patch_args + [dest_file_path, diff_file_path], ret_code=True, quiet=True)
+                    os.remove(diff_file_path)
 
                 print(f'Preview #\'{ctx_data["file"]}\' for edit.')
                 subprocess.call([self.diff_tool, tmp_ref_file_path, dest_file_path], stdout=subprocess.DEVNULL)
@@ -1133,14 +2996,22 @@ Bye.''')
                 if os.path.exists(dest_file_path):
                     print(f'Skipping create for #\'{ctx_data["file"]}\' as it already exists.')
                     return
-                with open(dest_file_path, 'w') as tmp_file:
-                    tmp_file.write(ctx_data['txt'])
+                if 'offset' in ctx_data:
+                    if not self.stash_copy_created(ctx_data, dest_file_path):
+                        return
+                else:
+                    with open(dest_file_path, 'w', errors='surrogateescape') as tmp_file:
+                        tmp_file.write(ctx_data['txt'])
                 self.add_sos([dest_file_path])
             else:
                 file_name = os.path.basename(ctx_data['file'])
                 dest_file_path = self.generate_temp_filename() + f'__{file_name}'
-                with open(dest_file_path, 'w') as tmp_file:
-                    tmp_file.write(ctx_data['txt'])
+                if 'offset' in ctx_data:
+                    if not self.stash_copy_created(ctx_data, dest_file_path):
+                        return
+                else:
+                    with open(dest_file_path, 'w', errors='surrogateescape') as tmp_file:
+                        tmp_file.write(ctx_data['txt'])
                 print(f'Preview #\'{ctx_data["file"]}\' for create.')
                 subprocess.call([self.diff_tool, dest_file_path, dest_file_path], stdout=subprocess.DEVNULL)
                 os.remove(dest_file_path)
@@ -1190,9 +3061,6 @@ Bye.''')
     def status_sos(self, args):
         wa_root = self.get_wa_root_path()
 
-        last_update_time = self.execute_sos_command(['soscmd', 'query'], ['last_update_time'], ret_text=True, quiet=True)
-        print(f'{bcolors.YELLOW}Workarea last updated at {last_update_time[0]}{bcolors.ENDC}')
-
         # check args
         scope_paths = []
         user_set_arg_sel = False
@@ -1204,35 +3072,6 @@ Bye.''')
         if not user_set_arg_sel:
             args[:0] = ['-sunm', '-sco']
 
-        # get file info from SOS
-        file_status = {}
-        cur_filelist = self.execute_sos_command(['soscmd', 'status'], ['-f%C%S%R %P'] + args, ret_text=True, quiet=True)
-        for file_info in cur_filelist:
-            if file_info.startswith('*'):
-                continue
-            file_info = file_info.split()
-            file_info_change_sts = file_info[0][0]
-            file_info_state = file_info[0][1]
-            file_info_rev = file_info[0][2]
-            file_path = file_info[1]
-
-            if file_path.endswith(tuple(self.ign_file_suffix)):
-                continue
-            file_path = self.remove_prefix(file_path, './')
-
-            file_attr = []
-            if file_info_change_sts == '-': # check if changed
-                file_attr.append('unchanged')
-            elif file_info_change_sts == '!': # check if deleted
-                file_attr.append('deleted')
-            if file_info_state == '?': # check if unmanaged
-                file_attr.append('unmanaged')
-            else:
-                file_attr.append('checkout')
-            if file_info_rev == 'R': # check if latest version in RSO
-                file_attr.append('resolve')
-            file_status[file_path] = file_attr
-
         # get file info from local cache
         self.setup_user_cache()
         wa_data_file_path = os.path.join(self.cache_path, self.wa_data_file)
@@ -1243,83 +3082,109 @@ Bye.''')
                 wa_data = json.load(cache_file)
         self.init_json_hier(wa_data, dict, ['file_status'])
 
-        for key in ['create', 'delete']:
-            if key not in wa_data['file_status']:
+        # attributes from the cache are merged into the SOS status as it is read
+        attr_flags = FileStatusTable.attr_flags
+        pending_flags = {}
+        for item, (key, target) in self.get_pending_records(wa_data['file_status'], scope_paths):
+            if key in ['create', 'delete']:
+                pending_flags[item] = pending_flags.get(item, 0) | attr_flags[key]
                 continue
-            for item in wa_data['file_status'][key]:
-                if not scope_paths or item.startswith(tuple(scope_paths)):
-                    file_attr = []
-                    if item in file_status:
-                        file_attr = file_status[item]
-                    file_attr.append(key)
-                    file_status[item] = file_attr
-        for key in ['move']:
-            if key not in wa_data['file_status']:
-                continue
-            for item in wa_data['file_status'][key]:
-                for subpath in wa_data['file_status'][key][item]:
-                    if not scope_paths or subpath.startswith(tuple(scope_paths)):
-                        file_attr = []
-                        if subpath in file_status:
-                            file_attr = file_status[subpath]
-                        if key == 'move':
-                            file_attr.append(f'{key}-')
-                            file_status[subpath] = file_attr
-
-                            target_file_path = os.path.join(item, os.path.basename(subpath))
-                            file_attr = []
-                            if target_file_path in file_status:
-                                file_attr = file_status[target_file_path]
-                            file_attr.append(f'{key}+')
-                            file_status[target_file_path] = file_attr
-        for key in ['rename']:
-            if key not in wa_data['file_status']:
+            target_file_path = os.path.join(target, os.path.basename(item)) if key == 'move' else target
+            pending_flags[item] = pending_flags.get(item, 0) | attr_flags[f'{key}-']
+            pending_flags[target_file_path] = pending_flags.get(target_file_path, 0) | attr_flags[f'{key}+']
+
+        # get file info from SOS
+        ign_patterns = self.get_ignore_patterns(wa_root)
+        ign_dirs = set()
+        file_table = FileStatusTable()
+        change_flags = {'-': attr_flags['unchanged'], '!': attr_flags['deleted']}
+        last_update_task = self.start_task(self.execute_sos_command_async(['soscmd', 'query'], ['last_update_time'], ret_text=True, quiet=True))
+        cur_filelist = self.execute_sos_command_iter(['soscmd', 'status'], ['-f%C%S%R %P'] + args, quiet=True)
+        for file_info in cur_filelist:
+            if file_info.startswith('*'):
                 continue
-            for item in wa_data['file_status'][key]:
-                if not scope_paths or item.startswith(tuple(scope_paths)):
-                    file_attr = []
-                    if item in file_status:
-                        file_attr = file_status[item]
-                    if key == 'rename':
-                        file_attr.append(f'{key}-')
-                        file_status[item] = file_attr
-
-                        target_file_path = wa_data['file_status'][key][item]
-                        file_attr = []
-                        if target_file_path in file_status:
-                            file_attr = file_status[target_file_path]
-                        file_attr.append(f'{key}+')
-                        file_status[target_file_path] = file_attr
-
-        unmanaged_files = []
-        hdr_printed = False
-        for file in sorted(file_status.keys()):
-            file_attr = sorted(file_status[file])
-            if 'unmanaged' in file_attr and 'create' not in file_attr:
-                unmanaged_files.append(file)
+            file_info = file_info.split()
+            file_path = self.remove_prefix(file_info[1], './')
+            file_info = file_info[0]
+            if file_info[1] == '?':
+                # paths below an ignored unmanaged directory are unmanaged too
+                if ign_patterns.is_ignored(file_path) or self.is_below_paths(file_path, ign_dirs):
+                    ign_dirs.add(file_path)
+                    continue
+                flags = attr_flags['unmanaged']
+            else:
+                flags = attr_flags['checkout']
+            flags |= change_flags.get(file_info[0], 0) # unchanged or deleted
+            flags |= attr_flags['resolve'] if file_info[2] == 'R' else 0 # not latest version in RSO
+            if pending_flags:
+                flags |= pending_flags.pop(file_path, 0)
+            file_table.add(file_path, flags)
+        for file_path, flags in pending_flags.items():
+            file_table.add(file_path, flags)
+        last_update_time = self.run_async(last_update_task)
+        print(f'{bcolors.YELLOW}Workarea last updated at {last_update_time[0]}{bcolors.ENDC}')
+        self.print_status_table(file_table, wa_root)
+
+    def print_status_table(self, file_table, wa_root):
+        # directories are known from the status paths below them. other entries are
+        # checked with a single scandir of their parent, not a stat for each path
+        dir_ids = file_table.dir_ids
+        dir_paths = file_table.dir_paths
+        file_dirs = file_table.file_dirs
+        file_names = file_table.file_names
+        file_flags = file_table.file_flags
+        dir_prefixes = {}
+        subdir_names = {}
+        def get_rel_path(idx):
+            dir_id = file_dirs[idx]
+            if dir_id not in dir_prefixes:
+                dir_relpath = os.path.relpath(os.path.join(wa_root, dir_paths[dir_id]), os.getcwd())
+                dir_prefixes[dir_id] = '' if dir_relpath == '.' else dir_relpath + '/'
+            file_path = file_table.get_path(idx)
+            if file_path not in dir_ids:
+                if dir_id not in subdir_names:
+                    try:
+                        with os.scandir(os.path.join(wa_root, dir_paths[dir_id])) as dir_entries:
+                            subdir_names[dir_id] = {entry.name for entry in dir_entries if entry.is_dir()}
+                    except OSError:
+                        subdir_names[dir_id] = set()
+                if file_names[idx] not in subdir_names[dir_id]:
+                    return dir_prefixes[dir_id] + file_names[idx]
+            return dir_prefixes[dir_id] + file_names[idx] + '/'
+
+        # the text for each combination of flags is made once
+        unmanaged_flag = FileStatusTable.attr_flags['unmanaged']
+        create_flag = FileStatusTable.attr_flags['create']
+        flags_text = {}
+        for flags in set(file_flags):
+            file_attr = [attr for attr in file_table.get_attrs(flags) if attr != 'unmanaged']
+            if flags & unmanaged_flag and not flags & create_flag:
+                suffix = f' {bcolors.GRAY}(' + ' '.join(file_attr) + f'){bcolors.ENDC}' if file_attr else ''
+                flags_text[flags] = (f'  {bcolors.GRAY}[untracked]{bcolors.ENDC} ./', suffix)
                 continue
-            if not hdr_printed:
-                hdr_printed = True
-                print(f'\nTracked files:')
-            rel_path = os.path.relpath(os.path.join(wa_root, file), os.getcwd())
-            if os.path.isdir(rel_path):
-                rel_path += '/'
-            file_attr = [attr for attr in file_attr if attr not in ['unmanaged']]
             prefix = file_attr.pop(0)
             file_attr = [f'{bcolors.RED}{attr}{bcolors.ENDC}' if attr in ['resolve'] else f'{bcolors.GRAY}{attr}{bcolors.ENDC}' for attr in file_attr]
             suffix = f' {bcolors.GRAY}({bcolors.ENDC}' + ' '.join(file_attr) + f'{bcolors.GRAY}){bcolors.ENDC}' if file_attr else ''
-            print(f'  {bcolors.GRAY}[{prefix:9}]{bcolors.ENDC} ./{rel_path}{suffix}')
-
-        if unmanaged_files:
-            print(f'\nUntracked files:')
-            for file in sorted(unmanaged_files):
-                rel_path = os.path.relpath(os.path.join(wa_root, file), os.getcwd())
-                file_attr = sorted(file_status[file])
-                file_attr = [attr for attr in file_attr if attr not in ['unmanaged']]
-                suffix = f' {bcolors.GRAY}(' + ' '.join(file_attr) + f'){bcolors.ENDC}' if file_attr else ''
-                if os.path.isdir(rel_path):
-                    rel_path += '/'
-                print(f'  {bcolors.GRAY}[untracked]{bcolors.ENDC} ./{rel_path}{suffix}')
+            flags_text[flags] = (f'  {bcolors.GRAY}[{prefix:9}]{bcolors.ENDC} ./', suffix)
+
+        # lines are written in batches
+        sorted_idx = file_table.sorted_indexes()
+        untracked_idx = [idx for idx in sorted_idx if file_flags[idx] & unmanaged_flag and not file_flags[idx] & create_flag]
+        tracked_idx = [idx for idx in sorted_idx if not file_flags[idx] & unmanaged_flag or file_flags[idx] & create_flag] if untracked_idx else sorted_idx
+        sys.stdout.flush()
+        for header, idx_list in [('\nTracked files:', tracked_idx), ('\nUntracked files:', untracked_idx)]:
+            if not idx_list:
+                continue
+            out_lines = [header]
+            for idx in idx_list:
+                prefix, suffix = flags_text[file_flags[idx]]
+                out_lines.append(prefix + get_rel_path(idx) + suffix)
+                if len(out_lines) >= 4096:
+                    sys.stdout.write('\n'.join(out_lines) + '\n')
+                    out_lines = []
+            if out_lines:
+                sys.stdout.write('\n'.join(out_lines) + '\n')
+        sys.stdout.flush()
 
     def check_args_count(self, args, min=-1, max=-1):
         len_args = len(args)
@@ -1331,47 +3196,815 @@ Bye.''')
             exit(1)
 
     def run_command(self, command, args):
-        if command in self.commands:
+        if command == '--all-workareas' or command.startswith('-C'):
+            self.run_workareas_command([command] + args)
+        elif command in self.commands:
             self.commands[command](args)
         else:
             print(f'{bcolors.RED}Error: Unsupported command: {command}. Run with -h for script help.{bcolors.ENDC}')
             exit(1)
 
+    def get_ignore_patterns(self, wa_root):
+        if self.ign_patterns is None:
+            pattern_lines = []
+            ign_file_path = os.path.join(wa_root, self.ign_file_name)
+            if os.path.isfile(ign_file_path):
+                with open(ign_file_path) as ign_file:
+                    pattern_lines = ign_file.readlines()
+            self.ign_patterns = IgnorePatterns(pattern_lines, wa_root, self.ign_default_patterns)
+        return self.ign_patterns
+
+    def is_below_paths(self, file_path, dir_paths):
+        # checks the parents of the path against a set of directory paths
+        if not dir_paths:
+            return False
+        parent_end = file_path.rfind('/')
+        while parent_end > 0:
+            if file_path[:parent_end] in dir_paths:
+                return True
+            parent_end = file_path.rfind('/', 0, parent_end)
+        return False
+
+    def get_pending_trie(self, file_status):
+        # create, delete, move and rename records by path, as (<key>, <target>) records
+        pending_trie = PathTrie()
+        for key in ['create', 'delete']:
+            for file_path in file_status.get(key, []):
+                pending_trie.insert(file_path, (key, None))
+        for tgt_dir, file_list in file_status.get('move', {}).items():
+            for file_path in file_list:
+                pending_trie.insert(file_path, ('move', tgt_dir))
+        for file_path, tgt_path in file_status.get('rename', {}).items():
+            pending_trie.insert(file_path, ('rename', tgt_path))
+        return pending_trie
+
+    def get_pending_records(self, file_status, scope_paths):
+        # (path, record) items of the records under the scope paths, or all if there is no scope
+        pending_trie = self.get_pending_trie(file_status)
+        scope_paths = sorted(set(os.path.normpath(scope_path) for scope_path in scope_paths))
+        if not scope_paths or '.' in scope_paths:
+            return list(pending_trie.items())
+        pending_records = []
+        prev_scope = None
+        for scope_path in scope_paths:
+            if prev_scope and scope_path.startswith(prev_scope + '/'): # already covered by the parent scope
+                continue
+            pending_records.extend(pending_trie.items(scope_path))
+            prev_scope = scope_path
+        return pending_records
+
+    def run_workareas_command(self, argv):
+        wa_paths = []
+        while argv and (argv[0] == '--all-workareas' or argv[0].startswith('-C')):
+            arg = argv.pop(0)
+            if arg == '--all-workareas':
+                wa_paths.extend(self.get_workarea_list())
+            elif arg == '-C' and argv:
+                wa_paths.append(os.path.abspath(argv.pop(0)))
+            elif arg != '-C':
+                wa_paths.append(os.path.abspath(self.remove_prefix(arg, '-C')))
+        if not argv or argv[0] not in self.multi_wa_commands:
+            print(f'{bcolors.RED}Error: Only {", ".join(self.multi_wa_commands)} commands can be run for multiple workareas.{bcolors.ENDC}')
+            exit(1)
+        wa_paths = list(dict.fromkeys(wa_paths))
+        if not wa_paths:
+            print(f'{bcolors.RED}Error: No workareas found.{bcolors.ENDC}')
+            exit(1)
+
+        # each workarea runs in its own process, output is printed as one block when done
+        async def run_all():
+            wa_results = {}
+            wa_tasks = [asyncio.ensure_future(self.run_in_workarea(wa_path, argv)) for wa_path in wa_paths]
+            try:
+                for wa_task in asyncio.as_completed(wa_tasks):
+                    wa_path, returncode, output, elapsed = await wa_task
+                    wa_results[wa_path] = (returncode, elapsed)
+                    print(f'{bcolors.YELLOW}==> {wa_path} {"=" * 30}{bcolors.ENDC}')
+                    sys.stdout.write(output.decode(errors='replace'))
+                    sys.stdout.flush()
+            except BaseException:
+                for wa_task in wa_tasks:
+                    wa_task.cancel()
+                await asyncio.gather(*wa_tasks, return_exceptions=True)
+                raise
+            return wa_results
+        wa_results = self.run_async(run_all())
+
+        print(f'\n{bcolors.YELLOW}Summary of \'{argv[0]}\':{bcolors.ENDC}')
+        failed_count = 0
+        for wa_path in wa_paths:
+            returncode, elapsed = wa_results[wa_path]
+            failed_count += 1 if returncode else 0
+            result = 'ok' if not returncode else f'{bcolors.RED}failed ({returncode}){bcolors.ENDC}'
+            print(f'  {elapsed:8.1f}s  {result:6}  {wa_path}')
+        if failed_count:
+            exit(1)
+
+    async def run_in_workarea(self, wa_path, argv):
+        if self.job_semaphore is None:
+            self.job_semaphore = asyncio.Semaphore(self.max_jobs)
+        async with self.job_semaphore:
+            start_time = time.perf_counter()
+            try:
+                proc = await asyncio.create_subprocess_exec(sys.executable, self.get_script_path(), *argv, cwd=wa_path, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            except OSError as e:
+                return wa_path, 1, f'Error: Could not run in workarea: {e}\n'.encode(), time.perf_counter() - start_time
+            try:
+                output, _ = await proc.communicate()
+            except asyncio.CancelledError:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                raise
+            return wa_path, proc.returncode, output, time.perf_counter() - start_time
+
+    def get_workarea_list(self):
+        # workareas used with this script, and the workareas in GIT2SOS_WA_ROOT
+        self.setup_user_cache()
+        wa_list = []
+        wa_list_file_path = os.path.join(self.cache_path, self.wa_list_file)
+        if os.path.isfile(wa_list_file_path) and os.path.getsize(wa_list_file_path):
+            with open(wa_list_file_path, 'r') as cache_file:
+                wa_list = json.load(cache_file)
+        if 'GIT2SOS_WA_ROOT' in os.environ and os.path.isdir(os.environ['GIT2SOS_WA_ROOT']):
+            with os.scandir(os.environ['GIT2SOS_WA_ROOT']) as dir_entries:
+                wa_list.extend(sorted(entry.path for entry in dir_entries if entry.is_dir()))
+        return [wa_path for wa_path in wa_list if os.path.isdir(wa_path)]
+
+    def register_workarea(self, wa_root, register=True):
+        # done by the commands which create or change a workarea, not on every lookup of its root
+        self.setup_user_cache()
+        wa_list = []
+        wa_list_file_path = os.path.join(self.cache_path, self.wa_list_file)
+        if os.path.isfile(wa_list_file_path) and os.path.getsize(wa_list_file_path):
+            with open(wa_list_file_path, 'r') as cache_file:
+                wa_list = json.load(cache_file)
+        if (wa_root in wa_list) == register:
+            return
+        wa_list = [wa_path for wa_path in wa_list if os.path.isdir(wa_path) and wa_path != wa_root] + ([wa_root] if register else [])
+        tmp_filepath = f'{wa_list_file_path}.{os.getpid()}' # commands may run in many workareas at once
+        with open(tmp_filepath, 'w') as cache_file:
+            json.dump(wa_list, cache_file, indent=2)
+        os.replace(tmp_filepath, wa_list_file_path)
+
     def get_wa_root_path(self):
+        if self.wa_root:
+            return self.wa_root
         wa_root = self.execute_sos_command(['soscmd', 'findwaroot'], [], ret_text=True, quiet=True)
         wa_root = wa_root[0] if len(wa_root) else ''
         if not os.path.exists(wa_root):
             print(f'{bcolors.RED}Error: WA path could not be found.{bcolors.ENDC}')
             exit(1)
+        self.wa_root = wa_root
         return wa_root
 
     def execute_sos_command(self, sos_command, args, ret_text=False, ret_code=False, chk_err=True, quiet=False):
+        if self.event_loop is None and not self.trace_record_path and not self.trace_replay_path:
+            return self.execute_first_command(sos_command + args, ret_text, ret_code, chk_err, quiet)
+        return self.run_async(self.execute_sos_command_async(sos_command, args, ret_text, ret_code, chk_err, quiet))
+
+    def execute_first_command(self, command, ret_text, ret_code, chk_err, quiet):
+        # the first command of a run is started without the event loop, which is set up while it runs
+        if not quiet:
+            print(f'{bcolors.GRAY}Run cmd: {" ".join(command)}{bcolors.ENDC}')
+        try:
+            proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as e:
+            print(f'{bcolors.RED}Error: Invalid environment: {e}{bcolors.ENDC}')
+            exit(1)
+        try:
+            self.get_event_loop()
+            stdout, stderr = proc.communicate()
+        except KeyboardInterrupt:
+            proc.kill()
+            proc.wait()
+            print(f'{bcolors.RED}Error: Interrupted.{bcolors.ENDC}')
+            exit(130)
+        if chk_err and proc.returncode:
+            print(f'{bcolors.RED}Error: Failed to execute command: {subprocess.CalledProcessError(proc.returncode, command, stdout, stderr)}{bcolors.ENDC}')
+            exit(1)
+        return self.get_command_output(subprocess.CompletedProcess(command, proc.returncode, stdout, stderr), ret_text, ret_code, quiet)
+
+    async def execute_sos_command_async(self, sos_command, args, ret_text=False, ret_code=False, chk_err=True, quiet=False, semaphore=None):
         command = sos_command + args
         if not quiet:
             print(f'{bcolors.GRAY}Run cmd: {" ".join(command)}{bcolors.ENDC}')
         #if sos_command[0] in 'soscmd' and sos_command[1] in ['co', 'ci', 'create', 'delete', 'move', 'merge', 'usebranch', 'update', 'newworkarea', 'discardco', 'deleteworkarea', 'rename']:
         #    return
         try:
-            result = subprocess.run(command, check=chk_err, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out_str = result.stdout.decode()
-            if not quiet:
-                print(out_str)
-            if ret_text:
-                out_str_a = out_str.splitlines()
-                while out_str_a and (not out_str_a[0] or out_str_a[0].isspace() or out_str_a[0].startswith(tuple(['Invoking SOS', '!! Warning:', '** The flags']))):
-                    out_str_a.pop(0)
-                if ret_code:
-                    return result.returncode, out_str_a
-                else:
-                    return out_str_a
-            if ret_code:
-                return result.returncode
+            result = await self.run_traced_command(command, chk_err, semaphore)
         except subprocess.CalledProcessError as e:
-            print(f'{bcolors.RED}Error: Failed to execute command: {e}{bcolors.ENDC}')
-            exit(1)
+            raise SOSCommandError(f'Failed to execute command: {e}')
         except FileNotFoundError as e:
-            print(f'{bcolors.RED}Error: Invalid environment: {e}{bcolors.ENDC}')
+            raise SOSCommandError(f'Invalid environment: {e}')
+        return self.get_command_output(result, ret_text, ret_code, quiet)
+
+    def get_command_output(self, result, ret_text, ret_code, quiet):
+        out_str = result.stdout.decode()
+        if not quiet:
+            print(out_str)
+        if ret_text:
+            out_str_a = out_str.splitlines()
+            out_str_a = out_str_a[self.get_banner_end(out_str_a):]
+            if ret_code:
+                return result.returncode, out_str_a
+            else:
+                return out_str_a
+        if ret_code:
+            return result.returncode
+
+    def get_banner_end(self, lines):
+        # index of the first line after the leading banner and empty lines
+        line_idx = 0
+        while line_idx < len(lines) and (not lines[line_idx] or lines[line_idx].isspace() or lines[line_idx].startswith(('Invoking SOS', '!! Warning:', '** The flags'))):
+            line_idx += 1
+        return line_idx
+
+    def execute_sos_command_iter(self, sos_command, args, chk_err=True, quiet=False):
+        # yields output lines as they arrive, without the leading banner lines
+        line_stream = self.stream_sos_command_async(sos_command, args, chk_err, quiet)
+        try:
+            while True:
+                try:
+                    line_chunk = self.run_async(line_stream.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield from line_chunk
+        finally:
+            self.run_async(line_stream.aclose())
+
+    async def stream_sos_command_async(self, sos_command, args, chk_err=True, quiet=False):
+        # yields lists of decoded lines per chunk read. stderr is drained in background
+        command = sos_command + args
+        if not quiet:
+            print(f'{bcolors.GRAY}Run cmd: {" ".join(command)}{bcolors.ENDC}')
+        call_idx = self.next_call_idx(command)
+        is_banner = True
+        if self.trace_replay_path and command[0] == 'soscmd':
+            try:
+                result = await self.replay_command(command, chk_err, call_idx)
+            except subprocess.CalledProcessError as e:
+                raise SOSCommandError(f'Failed to execute command: {e}')
+            out_chunks = [result.stdout]
+            proc = None
+        else:
+            try:
+                proc = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except FileNotFoundError as e:
+                raise SOSCommandError(f'Invalid environment: {e}')
+            stderr_task = asyncio.ensure_future(proc.stderr.read())
+        start_time = time.perf_counter()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        rec_chunks = []
+        line_tail = ''
+        try:
+            while True:
+                if proc:
+                    out_chunk = await proc.stdout.read(65536)
+                    if self.trace_record_path:
+                        rec_chunks.append(out_chunk)
+                else:
+                    out_chunk = out_chunks.pop() if out_chunks else b''
+                line_text = line_tail + decoder.decode(out_chunk, final=not out_chunk)
+                if not line_text:
+                    break
+                line_chunk = line_text.splitlines()
+                line_tail = ''
+                if out_chunk and not line_text.endswith(('\n', '\r')): # last line is incomplete
+                    line_tail = line_chunk.pop()
+                if is_banner:
+                    line_idx = self.get_banner_end(line_chunk)
+                    if line_idx < len(line_chunk):
+                        is_banner = False
+                    del line_chunk[:line_idx]
+                if not quiet:
+                    print('\n'.join(line_chunk))
+                if line_chunk:
+                    yield line_chunk
+                if not out_chunk:
+                    break
+            if proc:
+                stderr_data = await stderr_task
+                returncode = await proc.wait()
+                if self.trace_record_path:
+                    self.record_trace(call_idx, command, returncode, time.perf_counter() - start_time, b''.join(rec_chunks))
+                if chk_err and returncode:
+                    raise SOSCommandError(f'Failed to execute command: {subprocess.CalledProcessError(returncode, command, None, stderr_data)}')
+        finally:
+            if proc and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    def get_script_path(self):
+        # child runs go through the launcher, which loads this script from its cached bytecode
+        script_path = os.path.abspath(__file__)
+        launcher_path = os.path.join(os.path.dirname(script_path), 'git2sos')
+        return launcher_path if os.path.isfile(launcher_path) else script_path
+
+    def get_event_loop(self):
+        if self.event_loop is None:
+            self.event_loop = asyncio.new_event_loop()
+        return self.event_loop
+
+    def run_async(self, coro):
+        # runs a coroutine on the shared event loop. Ctrl-C cancels it and kills the running commands
+        self.get_event_loop()
+        main_task = asyncio.ensure_future(coro, loop=self.event_loop)
+        self.event_loop.add_signal_handler(signal.SIGINT, main_task.cancel)
+        try:
+            return self.event_loop.run_until_complete(main_task)
+        except asyncio.CancelledError:
+            print(f'{bcolors.RED}Error: Interrupted.{bcolors.ENDC}')
+            exit(130)
+        except SOSCommandError as e:
+            print(f'{bcolors.RED}Error: {e}{bcolors.ENDC}')
             exit(1)
+        finally:
+            self.event_loop.remove_signal_handler(signal.SIGINT)
+
+    def start_task(self, coro):
+        # the task runs while the loop is driven by other calls, get its result with run_async
+        return self.get_event_loop().create_task(coro)
+
+    def run_parallel(self, coro_list):
+        return self.run_async(self.gather_tasks(coro_list))
+
+    async def gather_tasks(self, coro_list):
+        # results are returned in order. on the first error the other tasks are cancelled
+        tasks = [asyncio.ensure_future(coro) for coro in coro_list]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def run_traced_command(self, command, chk_err, semaphore=None):
+        # record/replay of soscmd calls, see GIT2SOS_RECORD and GIT2SOS_REPLAY in help
+        call_idx = self.next_call_idx(command)
+        if self.trace_replay_path and command[0] == 'soscmd':
+            return await self.replay_command(command, chk_err, call_idx)
+
+        if semaphore is None:
+            if self.job_semaphore is None:
+                self.job_semaphore = asyncio.Semaphore(self.max_jobs)
+            semaphore = self.job_semaphore
+        async with semaphore:
+            start_time = time.perf_counter()
+            proc = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                stdout, stderr = await proc.communicate()
+            except asyncio.CancelledError:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                raise
+            latency = time.perf_counter() - start_time
+        result = subprocess.CompletedProcess(command, proc.returncode, stdout, stderr)
+        if self.trace_record_path:
+            self.record_trace(call_idx, command, result.returncode, latency, result.stdout)
+        if chk_err and result.returncode:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+        return result
+
+    def next_call_idx(self, command):
+        # only soscmd calls are counted, their order is checked in strict replay
+        if command[0] != 'soscmd':
+            return None
+        self.trace_call_idx += 1
+        return self.trace_call_idx - 1
+
+    def record_trace(self, call_idx, command, returncode, latency, stdout):
+        entry = {
+            'idx': call_idx,
+            'argv': command,
+            'cwd': os.getcwd(),
+            'rc': returncode,
+            'lat': round(latency, 6),
+            'out': stdout.decode(errors='surrogateescape'),
+        }
+        out_files = {}
+        for arg_idx, arg in enumerate(command): # exported revisions are needed for replay
+            if arg.startswith('-out') and os.path.isfile(arg[4:]):
+                with open(arg[4:], 'rb') as out_file:
+                    out_files[arg_idx] = out_file.read().decode(errors='surrogateescape')
+        if out_files:
+            entry['files'] = out_files
+        with self.open_trace_file(self.trace_record_path, 'at') as trace_file:
+            trace_file.write(json.dumps(entry) + '\n')
+
+    async def replay_command(self, command, chk_err, call_idx):
+        entry = self.get_replay_entry(command, call_idx)
+        if self.trace_replay_timing == 'original':
+            await asyncio.sleep(entry['lat'])
+        for arg_idx, text in entry.get('files', {}).items():
+            with open(command[int(arg_idx)][4:], 'wb') as out_file:
+                out_file.write(text.encode(errors='surrogateescape'))
+        stdout = entry['out'].encode(errors='surrogateescape')
+        if chk_err and entry['rc']:
+            raise subprocess.CalledProcessError(entry['rc'], command, stdout, b'')
+        return subprocess.CompletedProcess(command, entry['rc'], stdout, b'')
+
+    def get_replay_entry(self, command, call_idx):
+        if self.trace_replay_data is None:
+            self.trace_replay_data = {}
+            with self.open_trace_file(self.trace_replay_path, 'rt') as trace_file:
+                for line in trace_file:
+                    entry = json.loads(line)
+                    key = self.trace_command_key(entry['argv'])
+                    if key not in self.trace_replay_data:
+                        self.trace_replay_data[key] = []
+                    self.trace_replay_data[key].append(entry)
+            # reversed, so that the next entry of each command is taken from the end
+            for entry_list in self.trace_replay_data.values():
+                entry_list.reverse()
+        key = self.trace_command_key(command)
+        if not self.trace_replay_data.get(key):
+            raise SOSCommandError(f'Replay trace has no entry for call #{call_idx}: {" ".join(command)}')
+        entry = self.trace_replay_data[key].pop()
+        if self.trace_replay_strict and entry['idx'] != call_idx:
+            raise SOSCommandError(f'Replay diverged at call #{call_idx}, trace has it at #{entry["idx"]}: {" ".join(command)}')
+        return entry
+
+    def trace_command_key(self, command):
+        # temp file names are random for each run
+        return '\0'.join(re.sub(r'/tmp/ntmp_[A-Za-z0-9]{10}', '<tmp>', arg) for arg in command)
+
+    def open_trace_file(self, file_path, mode):
+        if file_path.endswith('.gz'):
+            return gzip.open(file_path, mode)
+        return open(file_path, mode)
+
+    def chunk_paths(self, paths, max_chars=100000):
+        # split long path lists to stay well below the OS argument size limit
+        chunk, chunk_chars = [], 0
+        for path in paths:
+            if chunk and chunk_chars + len(path) > max_chars:
+                yield chunk
+                chunk, chunk_chars = [], 0
+            chunk.append(path)
+            chunk_chars += len(path) + 1
+        if chunk:
+            yield chunk
+
+    def export_revisions(self, export_list):
+        self.run_async(self.export_revisions_async(export_list))
+
+    def get_revision_filepaths(self, wa_root, rev_items):
+        # maps (file_path, rev) items to files with the numbered revisions. the ones missing in the
+        # revision cache are exported in parallel and added to it. traces must see every export, so
+        # then all are exported to temp files, which the caller removes
+        use_cache = not self.trace_record_path and not self.trace_replay_path
+        rev_filepaths = {}
+        export_coros = []
+        for file_path, rev in rev_items:
+            if use_cache:
+                rev_filepaths[(file_path, rev)] = self.get_rev_cache_filepath(wa_root, file_path, rev)
+                if not os.path.isfile(rev_filepaths[(file_path, rev)]):
+                    export_coros.append(self.add_to_rev_cache_async(f'{file_path}/#/{rev}', rev_filepaths[(file_path, rev)]))
+            else:
+                rev_filepaths[(file_path, rev)] = self.generate_temp_filename()
+                export_coros.append(self.export_revisions_async([(f'{file_path}/#/{rev}', rev_filepaths[(file_path, rev)], None)]))
+        self.run_async(self.gather_tasks(export_coros))
+        return rev_filepaths
+
+    def open_revision(self, rev_item, rev_filepath):
+        # a cached revision can be removed by a running prefetch, it is then exported again
+        try:
+            return open(rev_filepath, 'rb')
+        except FileNotFoundError:
+            self.run_async(self.add_to_rev_cache_async(f'{rev_item[0]}/#/{rev_item[1]}', rev_filepath))
+            return open(rev_filepath, 'rb')
+
+    async def add_to_rev_cache_async(self, rev_path, cache_filepath):
+        # exported next to the cache file and renamed, so readers never see a partial revision
+        os.makedirs(os.path.dirname(cache_filepath), exist_ok=True)
+        tmp_filepath = f'{cache_filepath}.{os.getpid()}.tmp'
+        try:
+            await self.export_revisions_async([(rev_path, tmp_filepath, None)])
+        except BaseException:
+            if os.path.isfile(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+        os.replace(tmp_filepath, cache_filepath)
+
+    def get_revision_lines(self, wa_root, file_path, revs):
+        # numbered revisions of a file as lists of lines
+        rev_lines = {}
+        for (_, rev), rev_filepath in self.get_revision_filepaths(wa_root, [(file_path, rev) for rev in revs]).items():
+            with self.open_revision((file_path, rev), rev_filepath) as rev_file:
+                rev_lines[rev] = rev_file.read().decode(errors='surrogateescape').splitlines(keepends=True)
+            if self.trace_record_path or self.trace_replay_path:
+                os.remove(rev_filepath)
+        return rev_lines
+
+    async def export_revisions_async(self, export_list):
+        # export_list has (<path>[/#/<rev>], <out_path>, <cache_filepath>) items, cached revisions are copied.
+        # traces must see every export, so the cache is not used while recording or replaying
+        use_cache = not self.trace_record_path and not self.trace_replay_path
+        async def export_rev(rev_path, out_path, cache_filepath):
+            if use_cache and cache_filepath and os.path.isfile(cache_filepath):
+                try:
+                    await self.run_blocking(shutil.copyfile, cache_filepath, out_path)
+                    return
+                except OSError:
+                    pass # removed by a running prefetch
+            await self.execute_sos_command_async(['soscmd', 'exportrev'], [rev_path, f'-out{out_path}'], quiet=True)
+        await self.gather_tasks([export_rev(*export_item) for export_item in export_list])
+
+    def get_rev_cache_path(self, wa_root, create=False):
+        self.setup_user_cache()
+        rev_cache_path = os.path.join(self.cache_path, self.rev_cache_dir, hashlib.sha1(wa_root.encode()).hexdigest()[:16])
+        if create:
+            os.makedirs(rev_cache_path, exist_ok=True)
+        return rev_cache_path
+
+    def get_rev_cache_filepath(self, wa_root, file_path, rev):
+        # numbered revisions never change, revisions by label are only valid until the next fetch
+        if self.rev_cache_info is None:
+            rev_cache_path = self.get_rev_cache_path(wa_root)
+            fetch_gen = '0'
+            gen_filepath = os.path.join(rev_cache_path, 'fetch_gen')
+            if os.path.isfile(gen_filepath):
+                with open(gen_filepath) as gen_file:
+                    fetch_gen = gen_file.read().strip()
+            self.rev_cache_info = (rev_cache_path, fetch_gen)
+        rev_cache_path, fetch_gen = self.rev_cache_info
+        rev = str(rev)
+        if not rev.isdigit():
+            rev = rev.replace('/', '_') + '@' + fetch_gen
+        file_relpath = os.path.relpath(os.path.abspath(file_path), wa_root)
+        return os.path.join(rev_cache_path, hashlib.sha1(file_relpath.encode()).hexdigest() + '.' + rev)
+
+    def rev_cache_fetched(self, start_prefetch):
+        # a fetch makes the revisions cached by label stale
+        self.setup_user_cache()
+        if not start_prefetch and not os.path.isdir(os.path.join(self.cache_path, self.rev_cache_dir)):
+            return
+        wa_root = self.get_wa_root_path()
+        rev_cache_path = self.get_rev_cache_path(wa_root, create=start_prefetch)
+        if os.path.isdir(rev_cache_path):
+            gen_filepath = os.path.join(rev_cache_path, 'fetch_gen')
+            with open(f'{gen_filepath}.{os.getpid()}', 'w') as gen_file:
+                gen_file.write(str(time.time_ns()))
+            os.replace(f'{gen_filepath}.{os.getpid()}', gen_filepath)
+            self.rev_cache_info = None
+        if start_prefetch:
+            self.start_prefetch_process(wa_root, [])
+
+    def start_prefetch_process(self, wa_root, prefetch_args):
+        if self.trace_replay_path:
+            return # replayed runs have no server to prefetch from
+        log_filepath = os.path.join(self.get_rev_cache_path(wa_root, create=True), 'prefetch.log')
+        prefetch_env = dict(os.environ)
+        prefetch_env.pop('GIT2SOS_RECORD', None)
+        with open(log_filepath, 'a') as log_file:
+            subprocess.Popen([sys.executable, self.get_script_path(), 'prefetch'] + prefetch_args, cwd=wa_root, env=prefetch_env, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+        print(f'Started revision prefetch in background, logging to \'{log_filepath}\'.')
+
+    def start_daemon_process(self, quiet=False):
+        log_filepath = os.path.join(self.cache_path, 'daemon.log')
+        with open(log_filepath, 'a') as log_file:
+            subprocess.Popen([sys.executable, self.get_script_path(), 'daemon', '--serve'], cwd=self.cache_path, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+        if not quiet:
+            print(f'Started daemon in background, logging to \'{log_filepath}\'.')
+
+    def get_daemon_info(self):
+        # info saved by the running daemon, or None if there is none
+        daemon_filepath = os.path.join(self.cache_path, self.daemon_file)
+        if not os.path.isfile(daemon_filepath):
+            return None
+        try:
+            with open(daemon_filepath, 'r') as daemon_file:
+                daemon_info = json.load(daemon_file)
+            os.kill(daemon_info['pid'], 0)
+        except (OSError, ValueError, KeyError):
+            return None
+        return daemon_info
+
+    def get_script_version(self):
+        script_stat = os.stat(os.path.abspath(__file__))
+        return [script_stat.st_mtime_ns, script_stat.st_size]
+
+    def serve_daemon(self):
+        # each command is run by a forked child, which takes over the client's stdin, stdout
+        # and stderr. the children report the workarea roots they found through a pipe
+        lock_file = open(os.path.join(self.cache_path, 'daemon.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print('Daemon is already running.')
+            return
+        for module in [asyncio, datetime, difflib, gzip, hashlib, mmap, random, shutil, string]:
+            module.load() # loaded once here instead of by each command
+
+        sock_path = os.path.join(self.cache_path, self.daemon_sock_file)
+        if os.path.exists(sock_path): # left by a daemon which was killed
+            os.unlink(sock_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(sock_path)
+        os.chmod(sock_path, 0o600)
+        server.listen(16)
+        script_version = self.get_script_version()
+        daemon_filepath = os.path.join(self.cache_path, self.daemon_file)
+        tmp_filepath = f'{daemon_filepath}.{os.getpid()}'
+        with open(tmp_filepath, 'w') as daemon_file:
+            json.dump({'pid': os.getpid(), 'started': time.strftime('%Y/%m/%d %H:%M:%S'), 'socket': sock_path, 'version': script_version}, daemon_file, indent=2)
+        os.replace(tmp_filepath, daemon_filepath)
+        state_read, state_write = os.pipe()
+        wa_roots = set()
+        state_tail = b''
+        child_count = 0
+        last_time = time.monotonic()
+        reload = False
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        print(f'{time.strftime("%Y/%m/%d %H:%M:%S")} Daemon started with pid {os.getpid()}.', flush=True)
+        try:
+            while True:
+                ready, _, _ = select.select([server, state_read], [], [], 1.0)
+                while child_count:
+                    try:
+                        child_pid, _ = os.waitpid(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        child_pid = 0
+                    if not child_pid:
+                        break
+                    child_count -= 1
+                    last_time = time.monotonic()
+                if state_read in ready:
+                    state_lines = (state_tail + os.read(state_read, 65536)).split(b'\n')
+                    state_tail = state_lines.pop()
+                    for state_line in state_lines:
+                        action, wa_root = os.fsdecode(state_line).split('\0')
+                        if action == 'root':
+                            wa_roots.add(wa_root)
+                        else:
+                            wa_roots.discard(wa_root)
+                if server in ready:
+                    conn, _ = server.accept()
+                    if self.get_script_version() != script_version:
+                        conn.close() # the client runs the command itself
+                        reload = True
+                        break
+                    child_pid = os.fork()
+                    if child_pid == 0:
+                        server.close()
+                        os.close(state_read)
+                        os._exit(self.serve_daemon_request(conn, wa_roots, state_write))
+                    conn.close()
+                    child_count += 1
+                    last_time = time.monotonic()
+                elif not child_count and time.monotonic() - last_time > self.daemon_idle_time:
+                    print(f'{time.strftime("%Y/%m/%d %H:%M:%S")} Daemon stopped after {self.daemon_idle_time}s without commands.', flush=True)
+                    break
+        finally:
+            server.close()
+            os.unlink(sock_path)
+            daemon_info = self.get_daemon_info()
+            if daemon_info and daemon_info['pid'] == os.getpid():
+                os.remove(daemon_filepath)
+            lock_file.close()
+        if reload:
+            print(f'{time.strftime("%Y/%m/%d %H:%M:%S")} Script has changed, restarting daemon.', flush=True)
+            os.execv(sys.executable, [sys.executable, self.get_script_path(), 'daemon', '--serve'])
+
+    def serve_daemon_request(self, conn, wa_roots, state_fd):
+        # runs in the forked child and returns the exit code. the request is a header line with
+        # the payload length, then cwd, umask, argv and environment separated by null bytes
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            request_data, client_fds, _, _ = socket.recv_fds(conn, 65536, 3)
+            while b'\n' not in request_data:
+                request_data += conn.recv(65536)
+            header, request_data = request_data.split(b'\n', 1)
+            payload_len = int(header.split()[1])
+            while len(request_data) < payload_len:
+                recv_data = conn.recv(65536)
+                if not recv_data:
+                    raise ValueError('incomplete request')
+                request_data += recv_data
+            fields = [os.fsdecode(field) for field in request_data.split(b'\0')]
+            cwd, umask, argc = fields[0], int(fields[1], 8), int(fields[2])
+            argv = fields[3:3 + argc]
+            env = dict(field.split('=', 1) for field in fields[3 + argc:] if '=' in field)
+            if len(client_fds) != 3:
+                raise ValueError('missing stdin, stdout or stderr')
+            for fd_idx, client_fd in enumerate(client_fds):
+                os.dup2(client_fd, fd_idx)
+                os.close(client_fd)
+            os.chdir(cwd)
+        except (OSError, ValueError, IndexError) as e:
+            print(f'{time.strftime("%Y/%m/%d %H:%M:%S")} Bad request: {e}', flush=True)
+            return 1
+        os.umask(umask)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.stdin = open(0, 'r', closefd=False)
+        sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+        bcolors.set_color(sys.stdout.isatty() and 'VIMRUNTIME' not in os.environ)
+        conn.sendall(f'pid {os.getpid()}\n'.encode())
+
+        wrapper = SOSWrapper()
+        wa_root = ''
+        if not wrapper.trace_record_path and not wrapper.trace_replay_path: # traces have the findwaroot call
+            wa_root = cwd
+            while wa_root not in wa_roots and os.path.dirname(wa_root) != wa_root:
+                wa_root = os.path.dirname(wa_root)
+            wa_root = wa_root if wa_root in wa_roots and os.path.isdir(wa_root) else ''
+        wrapper.wa_root = wa_root
+        exit_code = 0
+        try:
+            if argv:
+                wrapper.run_command(argv[0], argv[1:])
+            else:
+                print(f'{bcolors.RED}Error: Please provide a command. Run with -h for script help.{bcolors.ENDC}')
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                print(e.code, file=sys.stderr)
+            exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except KeyboardInterrupt:
+            exit_code = 130
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except OSError:
+            pass
+        if wa_root and not wrapper.wa_root: # cleared by declone
+            os.write(state_fd, os.fsencode(f'forget\0{wa_root}\n'))
+        elif wrapper.wa_root and not wa_root:
+            os.write(state_fd, os.fsencode(f'root\0{wrapper.wa_root}\n'))
+        try:
+            conn.sendall(f'exit {exit_code}\n'.encode())
+        except OSError:
+            pass
+        return exit_code
+
+    def merge_files(self, base_filepath, local_filepath, remote_filepath, remote_label):
+        # returns merged bytes and conflict flag, or None if the files cannot be merged as text
+        file_texts = []
+        for file_path in [base_filepath, local_filepath, remote_filepath]:
+            with open(file_path, 'rb') as in_file:
+                file_texts.append(in_file.read())
+        if any(b'\0' in file_text for file_text in file_texts):
+            return None, True
+        base, local, remote = [file_text.decode(errors='surrogateescape').splitlines(keepends=True) for file_text in file_texts]
+        merged, has_conflict = self.merge3_lines(base, local, remote, ['local', 'base', remote_label])
+        return ''.join(merged).encode(errors='surrogateescape'), has_conflict
+
+    def merge3_lines(self, base, local, remote, labels):
+        # diff3 merge over the regions where base, local and remote all match
+        merged = []
+        has_conflict = False
+        idx_base, idx_local, idx_remote = (0,) * 3
+        for sync_base, sync_base_end, sync_local, sync_local_end, sync_remote, sync_remote_end in self.find_sync_regions(base, local, remote):
+            base_part = base[idx_base:sync_base]
+            local_part = local[idx_local:sync_local]
+            remote_part = remote[idx_remote:sync_remote]
+            if local_part == remote_part or remote_part == base_part:
+                merged.extend(local_part)
+            elif local_part == base_part:
+                merged.extend(remote_part)
+            else:
+                has_conflict = True
+                for marker, part in [(f'<<<<<<< {labels[0]}', local_part), (f'||||||| {labels[1]}', base_part), ('=======', remote_part)]:
+                    merged.append(marker + '\n')
+                    merged.extend(part)
+                    if part and not part[-1].endswith('\n'):
+                        merged.append('\n')
+                merged.append(f'>>>>>>> {labels[2]}\n')
+            merged.extend(base[sync_base:sync_base_end])
+            idx_base, idx_local, idx_remote = sync_base_end, sync_local_end, sync_remote_end
+        return merged, has_conflict
+
+    def find_sync_regions(self, base, local, remote):
+        local_matches = difflib.SequenceMatcher(None, base, local, autojunk=False).get_matching_blocks()
+        remote_matches = difflib.SequenceMatcher(None, base, remote, autojunk=False).get_matching_blocks()
+        sync_regions = []
+        idx_local, idx_remote = (0,) * 2
+        while idx_local < len(local_matches) and idx_remote < len(remote_matches):
+            local_base, local_match, local_len = local_matches[idx_local]
+            remote_base, remote_match, remote_len = remote_matches[idx_remote]
+            sync_base = max(local_base, remote_base)
+            sync_base_end = min(local_base + local_len, remote_base + remote_len)
+            if sync_base < sync_base_end:
+                sync_local = local_match + sync_base - local_base
+                sync_remote = remote_match + sync_base - remote_base
+                sync_len = sync_base_end - sync_base
+                sync_regions.append((sync_base, sync_base_end, sync_local, sync_local + sync_len, sync_remote, sync_remote + sync_len))
+            if local_base + local_len < remote_base + remote_len:
+                idx_local += 1
+            else:
+                idx_remote += 1
+        sync_regions.append((len(base), len(base), len(local), len(local), len(remote), len(remote)))
+        return sync_regions
 
     def generate_temp_filename(self, only_randstr=False):
         length = 10
@@ -1385,7 +4018,10 @@ Bye.''')
     def setup_user_cache(self, username=''):
         if not username:
             username = os.environ['USER']
-        self.cache_path = os.path.expanduser(f'~{username}/.cache/git2sos')
+        if 'GIT2SOS_CACHE_DIR' in os.environ and username == os.environ['USER']: # benchmark hook for the current user's cache only
+            self.cache_path = os.environ['GIT2SOS_CACHE_DIR']
+        else:
+            self.cache_path = os.path.expanduser(f'~{username}/.cache/git2sos')
         try:
             if '~' in self.cache_path:
                 raise Exception(f'Invalid user: {username}')
@@ -1411,6 +4047,11 @@ Bye.''')
             return text[len(prefix):]
         return text
 
+    def remove_suffix(self, text, suffix):
+        if suffix and text.endswith(suffix):
+            return text[:-len(suffix)]
+        return text
+
     def get_datetime_from_str(self, arg):
         datetime_object = None
         try: # try date and time
@@ -1441,9 +4082,16 @@ Bye.''')
             return os.path.basename(stash_paths_list[-1])
         return None
 
-if __name__ == '__main__':
+def main():
     wrapper = SOSWrapper()
+    if 'GIT2SOS_DAEMON' in os.environ and sys.argv[1:2] != ['daemon']:
+        wrapper.setup_user_cache()
+        if not wrapper.get_daemon_info():
+            wrapper.start_daemon_process(quiet=True)
     if len(sys.argv) > 1:
         wrapper.run_command(sys.argv[1], sys.argv[2:])
     else:
         print(f'{bcolors.RED}Error: Please provide a command. Run with -h for script help.{bcolors.ENDC}')
+
+if __name__ == '__main__':
+    main()